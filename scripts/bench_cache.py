@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Store and load times, and file sizes, of each CacheManager cache written
+# as JSON and with the binary serializer, filled with synthetic data.
+# Caches are written to a temporary directory only.
+#
+#  usage: PYTHONPATH=src python scripts/bench_cache.py
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from subscription_manager import cache
+from subscription_manager.facts import Facts
+
+PACKAGES = 3000
+PRODUCTS = 30
+ENTITLEMENTS = 100
+FACTS = 400
+
+
+def make_packages():
+    return [{'name': u'package-%s' % i, 'version': u'1.%s.0' % (i % 20),
+             'release': u'%s.el6' % (i % 7), 'arch': u'x86_64', 'epoch': 0,
+             'vendor': u'Red Hat, Inc.'} for i in range(PACKAGES)]
+
+
+def make_installed():
+    return dict((str(i), {'productId': u'%s' % i, 'productName': u'Product %s' % i,
+                          'version': u'6.5', 'arch': u'x86_64'})
+                for i in range(PRODUCTS))
+
+
+def make_entitlement_status():
+    return {'compliant': False, 'status': u'invalid',
+            'date': u'2014-04-26T13:43:12.436+0000',
+            'nonCompliantProducts': [u'%s' % i for i in range(PRODUCTS // 3)],
+            'reasons': [{'key': u'NOTCOVERED', 'message': u'Not supported',
+                         'attributes': {'product_id': u'%s' % i,
+                                        'name': u'Product %s' % i}}
+                        for i in range(PRODUCTS // 3)],
+            'compliantProducts': dict((u'%s' % i, [{'id': u'ent-%s' % j,
+                'startDate': u'2014-01-01T00:00:00.000+0000',
+                'endDate': u'2015-01-01T00:00:00.000+0000',
+                'pool': {'id': u'pool-%s' % j, 'productName': u'SKU %s' % j}}
+                for j in range(ENTITLEMENTS // PRODUCTS)]) for i in range(PRODUCTS))}
+
+
+def make_product_status():
+    return [{'productId': u'%s' % i, 'productName': u'Product %s' % i,
+             'status': u'subscribed', 'startDate': u'2014-01-01T00:00:00.000+0000',
+             'endDate': u'2015-01-01T00:00:00.000+0000'} for i in range(PRODUCTS)]
+
+
+def make_overrides():
+    return [{'contentLabel': u'content-%s' % i, 'name': u'enabled', 'value': u'1'}
+            for i in range(ENTITLEMENTS)]
+
+
+def make_facts():
+    return dict(('fact.%s' % i, u'value %s' % i) for i in range(FACTS))
+
+
+# Each cache type and the data it holds:
+CACHES = [
+    (cache.ProfileManager, make_packages),
+    (cache.InstalledProductsManager, make_installed),
+    (cache.EntitlementStatusCache, make_entitlement_status),
+    (cache.ProductStatusCache, make_product_status),
+    (cache.OverrideStatusCache, make_overrides),
+    (cache.WrittenOverrideCache, make_overrides),
+    (Facts, make_facts),
+]
+
+
+def make_cache(cls, data, cache_file, serializer):
+    # Skip the constructors, they look at the system:
+    mgr = cls.__new__(cls)
+    mgr.CACHE_FILE = cache_file
+    mgr.SERIALIZER = serializer
+    mgr.to_dict = lambda: data
+    # Facts digests leave these out:
+    mgr.graylist = []
+    # Status caches write these next to the status:
+    mgr.validators = None
+    return mgr
+
+
+def load(mgr):
+    # StatusCache keeps what it read in memory:
+    mgr.server_status = None
+    return mgr._read_cache()
+
+
+def bench(func, number):
+    # Best of three, per call, in milliseconds:
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print "%-28s %-7s %10s %10s %10s" % ("", "", "store", "load", "size")
+        for cls, make_data in CACHES:
+            data = make_data()
+            for label, serializer in [("json", cache.CacheSerializer()),
+                                      ("binary", cache.BinaryCacheSerializer())]:
+                cache_file = os.path.join(tmp_dir, "%s-%s" % (cls.__name__, label))
+                mgr = make_cache(cls, data, cache_file, serializer)
+                # StatusCache writes from a thread, time the write itself:
+                store = bench(lambda: cache.CacheManager.write_cache(mgr, False), 20)
+                loaded = bench(lambda: load(mgr), 20)
+                print "%-28s %-7s %7.2f ms %7.2f ms %8d B" % (cls.__name__, label,
+                        store, loaded, os.path.getsize(cache_file))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Microbenchmarks for CertificateDirectory lookups on synthetic
+# entitlement certificates, and for lazy versus eager certificates rebuilt
+# from the certificate cache. Nothing on the system is read or written.
+#
+#  usage: PYTHONPATH=src python scripts/bench_certdirectory.py
+
+from datetime import datetime, timedelta
+import os
+import resource
+import time
+import timeit
+
+from rhsm.certificate import GMT
+from rhsm.certificate2 import EntitlementCertificate, Product, Order, \
+        Content, Pool
+
+from subscription_manager import certcache
+from subscription_manager.certdirectory import EntitlementDirectory
+
+SIZES = [10, 100, 1000, 5000]
+# Number of distinct products, and certs per stack:
+PRODUCTS = 50
+STACK_SIZE = 5
+
+# Certs, and content sets per cert, for the lazy certificate comparison:
+LAZY_CERTS = 500
+LAZY_CONTENT = 300
+
+
+class SyntheticDirectory(EntitlementDirectory):
+
+    def __init__(self, certs):
+        self.certs = certs
+
+    def list(self):
+        return self.certs
+
+    def _check_key(self, cert):
+        return True
+
+
+def make_certs(count):
+    start = datetime.now(GMT()) - timedelta(days=1)
+    end = start + timedelta(days=365)
+    certs = []
+    for i in range(count):
+        products = [Product(id=str(i % PRODUCTS), name="Product %s" % i),
+                    Product(id=str((i + 1) % PRODUCTS), name="Provided %s" % i)]
+        order = Order(name="Order %s" % i, stacking_id="stack-%s" % (i // STACK_SIZE))
+        certs.append(EntitlementCertificate(path="/tmp/%s.pem" % i, serial=i,
+                products=products, order=order, start=start, end=end))
+    return certs
+
+
+# Linear implementations as they were before the index, for comparison:
+def linear_find(certs, sn):
+    for c in certs:
+        if c.serial == sn:
+            return c
+    return None
+
+
+def linear_list_for_product(certs, product_id):
+    return [c for c in certs for p in c.products if p.id == product_id]
+
+
+def linear_list_valid(certs):
+    return [c for c in certs if c.is_valid()]
+
+
+def bench(label, func, number):
+    # Best of three, per call, in microseconds:
+    best = min(timeit.repeat(func, number=number, repeat=3))
+    print "  %-28s %10.2f us" % (label, best / number * 1000000)
+
+
+def make_cert_dicts(count, content_count):
+    """ Cache entries for certs with many content sets, like v3 certs. """
+    cert_dicts = []
+    for cert in make_certs(count):
+        cert.pool = Pool(id="pool-%s" % cert.serial)
+        cert.content = [Content(content_type="yum", name="Content %s" % i,
+                label="content-%s-%s" % (cert.serial, i), vendor="Red Hat",
+                url="/content/dist/rhel/server/6/$releasever/$basearch/%s/os" % i,
+                gpg="file:///etc/pki/rpm-gpg/RPM-GPG-KEY-redhat-release",
+                required_tags="rhel-6,rhel-6-server")
+                for i in range(content_count)]
+        cert_dicts.append(certcache.cert_to_dict(cert))
+    return cert_dicts
+
+
+def list_consumed(certs):
+    # The fields "subscription-manager list --consumed" looks at:
+    for cert in certs:
+        cert.serial, cert.valid_range.end(), cert.is_valid()
+        [p.name for p in cert.products]
+        cert.order and cert.order.service_level
+        cert.pool and cert.pool.id
+
+
+def decode_all(certs):
+    # What certificates rebuilt from the cache cost before they were lazy:
+    for cert in certs:
+        cert.products, cert.order, cert.pool, cert.content
+
+
+def measure_listing(cert_dicts, eager):
+    """
+    Rebuild and list the certs in a child process, so each run starts
+    from the same heap. Returns (seconds, max RSS growth in KB).
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        certs = [certcache.cert_from_dict(d, "/tmp/%s.pem" % i)
+                 for i, d in enumerate(cert_dicts)]
+        if eager:
+            decode_all(certs)
+        list_consumed(certs)
+        elapsed = time.time() - start
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_fd, "%f %d" % (elapsed, after - before))
+        os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 128)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    elapsed, rss = result.split()
+    return float(elapsed), int(rss)
+
+
+def bench_lazy():
+    cert_dicts = make_cert_dicts(LAZY_CERTS, LAZY_CONTENT)
+    print "list --consumed, %d certificates with %d content sets each:" % \
+            (LAZY_CERTS, LAZY_CONTENT)
+    for label, eager in [("eager", True), ("lazy", False)]:
+        elapsed, rss = measure_listing(cert_dicts, eager)
+        print "  %-28s %10.2f ms %10d KB" % (label, elapsed * 1000, rss)
+
+
+def main():
+    for size in SIZES:
+        certs = make_certs(size)
+        cert_dir = SyntheticDirectory(certs)
+        last = size - 1
+        number = max(10, 50000 // size)
+
+        print "%d certificates:" % size
+        bench("find (linear)", lambda: linear_find(certs, last), number)
+        bench("find", lambda: cert_dir.find(last), number)
+        bench("list_for_product (linear)",
+              lambda: linear_list_for_product(certs, '1'), number)
+        bench("list_for_product", lambda: cert_dir.list_for_product('1'), number)
+        bench("find_by_product", lambda: cert_dir.find_by_product('1'), number)
+        bench("find_all_by_product", lambda: cert_dir.find_all_by_product('1'), number)
+        bench("list_valid (linear)", lambda: linear_list_valid(certs), number)
+        bench("list_valid", lambda: cert_dir.list_valid(), number)
+        # Cost of building the indexes from scratch once per listing:
+        bench("index rebuild", lambda: setattr(cert_dir, '_index', None) or
+              cert_dir.find_all_by_product('1'), 10)
+        bench("validity index rebuild", lambda: setattr(cert_dir, '_index', None) or
+              cert_dir.list_expired(), 10)
+
+    bench_lazy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Bytes sent and time of a package profile upload (1500 packages) and a
+# pool listing (1000 pools) against a local TLS stub server, with and
+# without compression. The stub server also emulates a 10 Mbit/s link by
+# holding each body back for the time it would take to transfer. Needs
+# openssl to make the certificate of the stub server.
+#
+#  usage: PYTHONPATH=src python scripts/bench_compression.py
+
+import BaseHTTPServer
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_keepalive import TLSStubServer, make_cert
+
+import rhsm.connection as connection
+from rhsm import ourjson as json
+
+from subscription_manager.connpool import COMPRESS_THRESHOLD, \
+        ConnectionPool, PooledRestlib, _gunzip, _gzip
+
+RUNS = 3
+UUID = "7b9e3b43-1e1e-4ef1-9b3a-5a0e2c5c0b5a"
+# Bytes per second of the emulated link:
+LINK_SPEED = 10 * 1000 * 1000 / 8
+
+
+def make_profile():
+    return [{"name": "package-%d" % i, "version": "%d.%d.%d" % (i % 7, i % 13, i),
+             "release": "%d.el6" % (i % 5), "epoch": 0, "arch": "x86_64",
+             "vendor": "Red Hat, Inc."} for i in range(1500)]
+
+
+def make_pools():
+    pools = []
+    for i in range(1000):
+        pools.append({
+            "id": "8a85f98144f4e5c50144f6f3a9e1%04d" % i,
+            "owner": {"key": "org", "displayName": "Org"},
+            "productId": "RH%05d" % (i % 40),
+            "productName": "Red Hat Enterprise Linux Server, Standard",
+            "quantity": 100, "consumed": i % 100, "exported": 0,
+            "startDate": "2014-01-01T00:00:00.000+0000",
+            "endDate": "2015-01-01T00:00:00.000+0000",
+            "contractNumber": str(10000000 + i),
+            "accountNumber": "1234567",
+            "productAttributes": [{"name": name, "value": value}
+                for name, value in [("arch", "x86_64,ppc64,s390x"),
+                                    ("sockets", "2"), ("type", "MKT"),
+                                    ("support_level", "Standard"),
+                                    ("support_type", "L1-L3"),
+                                    ("variant", "Server")]],
+            "providedProducts": [{"productId": str(69 + j),
+                "productName": "Red Hat Enterprise Linux Server %d" % j}
+                for j in range(8)],
+        })
+    return pools
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _transfer(self, length):
+        self.server.bytes += length
+        if self.server.emulate_link:
+            time.sleep(float(length) / LINK_SPEED)
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self._transfer(len(body))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = _gunzip(body)
+        json.loads(body)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        body = self.server.pools
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = self.server.gzip_pools
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self._transfer(len(body))
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench(server, uep, operation):
+    times = []
+    for i in range(RUNS):
+        sent = server.bytes
+        start = time.time()
+        operation(uep)
+        times.append(time.time() - start)
+    return min(times), server.bytes - sent
+
+
+def main():
+    cert_dir = tempfile.mkdtemp()
+    try:
+        server = TLSStubServer(handler=StubHandler, *make_cert(cert_dir))
+        server.pools = json.dumps(make_pools())
+        # Compressed ahead, the server side is not what is measured:
+        server.gzip_pools = _gzip(server.pools)
+        server.bytes = 0
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+
+        profile = make_profile()
+        operations = [
+            ("profile upload", lambda uep: uep.updatePackageProfile(UUID, profile)),
+            ("pool listing", lambda uep: uep.getPoolsList(owner="org"))]
+
+        for emulate_link in [False, True]:
+            server.emulate_link = emulate_link
+            if emulate_link:
+                print "Emulated %d Mbit/s link:" % (LINK_SPEED * 8 / 1000 / 1000)
+            else:
+                print "Local:"
+            for label, threshold in [("uncompressed", 0),
+                                     ("compressed", COMPRESS_THRESHOLD)]:
+                pool = ConnectionPool(compress_threshold=threshold)
+                uep = connection.UEPConnection('127.0.0.1', server.server_port,
+                        '/candlepin', insecure=True)
+                uep.conn = PooledRestlib(pool, '127.0.0.1', server.server_port,
+                        '/candlepin', insecure=True)
+                for name, operation in operations:
+                    elapsed, length = bench(server, uep, operation)
+                    print "  %-16s %-14s %9d B %9.1f ms" % (name, label,
+                            length / RUNS, elapsed * 1000)
+                pool.close()
+        server.shutdown()
+    finally:
+        shutil.rmtree(cert_dir)
+
+
+if __name__ == "__main__":
+    main()
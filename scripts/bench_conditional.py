@@ -0,0 +1,192 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Bytes downloaded by the status caches and the release listing fetch of
+# a run, against a local TLS stub server sending ETags, when the caches
+# are empty and on the next runs, once nothing changed. Needs openssl to
+# make the certificate of the stub server. Caches are written to a
+# temporary directory only.
+#
+#  usage: PYTHONPATH=src python scripts/bench_conditional.py
+
+import BaseHTTPServer
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_keepalive import TLSStubServer, make_cert
+
+import rhsm.connection as connection
+from rhsm import ourjson as json
+
+import subscription_manager.injection as inj
+from subscription_manager.cache import EntitlementStatusCache, \
+        OverrideStatusCache, ProductStatusCache, ReleaseListingCache, \
+        cache_writer
+from subscription_manager.connpool import ConnectionPool, PooledRestlib
+from subscription_manager.release import CdnReleaseVersionProvider
+from subscription_manager.requestcache import MemoizingRestlib, ResponseCache
+
+RUNS = 5
+UUID = "7b9e3b43-1e1e-4ef1-9b3a-5a0e2c5c0b5a"
+LISTING = "content/dist/rhel/server/6/listing"
+
+
+def make_documents():
+    """ Responses of the size a consumer with 20 products gets. """
+    products = [{"productId": str(69 + i), "productName": "Product %d" % i,
+                 "version": "6.5", "arch": "x86_64", "status": "green",
+                 "startDate": "2014-01-01T00:00:00.000+0000",
+                 "endDate": "2015-01-01T00:00:00.000+0000"}
+                for i in range(20)]
+    compliance = {"status": "valid", "compliant": True, "date": "2014-10-20",
+                  "compliantProducts": dict([(p["productId"], [{
+                      "id": "8a85f98144f4e5c50144f6f3a9e2%04d" % i,
+                      "pool": {"id": "8a85f98144f4e5c50144f6f3a9e1%04d" % i},
+                      "quantity": 1, "startDate": p["startDate"],
+                      "endDate": p["endDate"]}])
+                      for i, p in enumerate(products)]),
+                  "reasons": [], "partiallyCompliantProducts": {},
+                  "nonCompliantProducts": []}
+    consumer = {"uuid": UUID, "name": "bench.example.com",
+                "facts": dict([("fact.%d" % i, "value %d" % i)
+                               for i in range(200)]),
+                "installedProducts": products}
+    overrides = [{"contentLabel": "rhel-6-server-optional-rpms",
+                  "name": "enabled", "value": "1"}]
+    listing = "\n".join(["6.%d" % i for i in range(7)] + ["6Server"]) + "\n"
+    documents = {
+        "/candlepin/consumers/%s/compliance" % UUID: json.dumps(compliance),
+        "/candlepin/consumers/%s" % UUID: json.dumps(consumer),
+        "/candlepin/consumers/%s/content_overrides" % UUID: json.dumps(overrides),
+        "//" + LISTING: listing}
+    return dict([(path, (body, '"%x"' % hash(body)))
+                 for path, body in documents.items()])
+
+
+class ConditionalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body, etag = self.server.documents[self.path]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ContentConnectionProvider(object):
+
+    def __init__(self, content_connection, response_cache):
+        self.content_connection = content_connection
+        self.response_cache = response_cache
+
+    def get_content_connection(self):
+        return self.content_connection
+
+
+def run(uep, content_connection, cache_dir):
+    """ A run with fresh cache objects, as a new process makes them. """
+    response_cache = uep.conn.cache
+    status_caches = []
+    for cache_class in [EntitlementStatusCache, ProductStatusCache,
+                        OverrideStatusCache]:
+        status_cache = cache_class()
+        status_cache.CACHE_FILE = os.path.join(cache_dir,
+                os.path.basename(cache_class.CACHE_FILE))
+        status_caches.append(status_cache)
+    listing_cache = ReleaseListingCache()
+    listing_cache.CACHE_FILE = os.path.join(cache_dir, "release_listings.json")
+    inj.provide(inj.RELEASE_LISTING_CACHE, listing_cache)
+    inj.provide(inj.CP_PROVIDER, ContentConnectionProvider(content_connection,
+            response_cache))
+
+    start = time.time()
+    response_cache.start()
+    try:
+        for status_cache in status_caches:
+            status_cache.load_status(uep, UUID)
+        provider = CdnReleaseVersionProvider()
+        provider._listings_changed = False
+        provider._get_versions(LISTING)
+        if provider._listings_changed:
+            listing_cache.write_cache()
+    finally:
+        response_cache.stop()
+    cache_writer.flush()
+    return time.time() - start, response_cache.bytes_saved
+
+
+def main():
+    cert_dir = tempfile.mkdtemp()
+    cache_dir = tempfile.mkdtemp()
+    ent_dir = tempfile.mkdtemp()
+    pool = ConnectionPool()
+    try:
+        server = TLSStubServer(handler=ConditionalHandler,
+                *make_cert(cert_dir))
+        server.documents = make_documents()
+        server.bytes_sent = 0
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+
+        inj.provide(inj.ENT_DIR, object())
+        inj.provide(inj.PROD_DIR, object())
+        uep = connection.UEPConnection('127.0.0.1', server.server_port,
+                '/candlepin', insecure=True)
+        uep.conn = MemoizingRestlib(PooledRestlib(pool, '127.0.0.1',
+                server.server_port, '/candlepin', insecure=True),
+                ResponseCache())
+        content_connection = connection.ContentConnection(host='127.0.0.1',
+                ssl_port=server.server_port, insecure=True)
+        # No entitlement certificates to present to the stub server:
+        content_connection.ent_dir = ent_dir
+
+        print "%-28s %12s %12s %10s" % ("", "downloaded", "saved", "time")
+        for label, runs in [("empty caches", 1), ("nothing changed", RUNS)]:
+            for i in range(runs):
+                sent = server.bytes_sent
+                elapsed, saved = run(uep, content_connection, cache_dir)
+            print "%-28s %10d B %10d B %7.1f ms" % (label,
+                    server.bytes_sent - sent, saved, elapsed * 1000)
+        server.shutdown()
+    finally:
+        pool.close()
+        shutil.rmtree(cert_dir)
+        shutil.rmtree(cache_dir)
+        shutil.rmtree(ent_dir)
+
+
+if __name__ == "__main__":
+    main()
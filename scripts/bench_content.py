@@ -0,0 +1,100 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Memory use and access cost of plain Content versus CompactContent, for
+# synthetic entitlement certificates carrying many content sets each.
+# Nothing on the system is read or written.
+#
+#  usage: PYTHONPATH=src python scripts/bench_content.py
+
+import os
+import resource
+import time
+
+from rhsm.certificate2 import Content
+
+from subscription_manager.compactcontent import compact_content
+
+CERTS = 200
+CONTENT = 2000
+# Distinct products the content sets are spread over:
+PRODUCTS = 40
+
+
+def make_content(cert, count):
+    # Built from fresh strings, like the certificate parser does:
+    return [Content(content_type=u"yum", name=u"Content %s %s" % (cert, i),
+            label=u"content-%s-%s" % (cert, i), vendor=u"Red" + u" Hat",
+            url=u"/content/dist/rhel/server/6/$releasever/$basearch/%s/os" %
+                (i % PRODUCTS),
+            gpg=u"file:///etc/pki/rpm-gpg/RPM-GPG-KEY-" + u"redhat-release",
+            enabled=True, metadata_expire=u"8" + u"6400",
+            required_tags=[u"rhel-6", u"rhel-6-server", u"product-%s" % (i % PRODUCTS)])
+            for i in range(count)]
+
+
+def walk(contents):
+    # The fields repo generation reads from every content set:
+    for content_list in contents:
+        for content in content_list:
+            content.content_type, content.label, content.url, \
+                content.required_tags, content.gpg
+
+
+def measure(compact):
+    """
+    Build and walk the content sets in a child process, so each run starts
+    from the same heap. Returns (build seconds, walk seconds, RSS growth
+    in KB).
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        contents = []
+        for cert in range(CERTS):
+            content_list = make_content(cert, CONTENT)
+            if compact:
+                content_list = compact_content(content_list)
+            contents.append(content_list)
+        built = time.time()
+        walk(contents)
+        walked = time.time()
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_fd, "%f %f %d" % (built - start, walked - built,
+                                         after - before))
+        os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 128)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    build, access, rss = result.split()
+    return float(build), float(access), int(rss)
+
+
+def main():
+    print "%d certificates with %d content sets each:" % (CERTS, CONTENT)
+    print "  %-14s %12s %12s %12s" % ("", "build", "walk", "max RSS")
+    for label, compact in [("Content", False), ("CompactContent", True)]:
+        build, access, rss = measure(compact)
+        print "  %-14s %9.0f ms %9.0f ms %9d KB" % (label, build * 1000,
+                                                    access * 1000, rss)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Time of the facts check rhsmcertd-worker runs, Facts.has_changed, on
+# this host. The first run collects every fact and writes the caches, the
+# next ones reuse the output of the collectors whose fingerprint did not
+# change. Run as root for the DMI facts. Caches are written to a temporary
+# directory only.
+#
+#  usage: PYTHONPATH=src python scripts/bench_facts.py
+
+import os
+import shutil
+import tempfile
+import time
+
+import subscription_manager.injection as inj
+from subscription_manager.facts import Facts
+
+RUNS = 5
+
+
+class NoPlugins(object):
+
+    def run(self, slot_name, **kwargs):
+        pass
+
+
+def make_facts(cache_dir):
+    facts = Facts(ent_dir=object(), prod_dir=object())
+    facts.CACHE_FILE = os.path.join(cache_dir, "facts.json")
+    facts.collector_cache.CACHE_FILE = os.path.join(cache_dir, "collectors.bin")
+    return facts
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def main():
+    inj.provide(inj.PLUGIN_MANAGER, NoPlugins())
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        first = timed(make_facts(tmp_dir).write_cache)
+        again = min([timed(make_facts(tmp_dir).has_changed) for i in range(RUNS)])
+        print "%-36s %9.1f ms" % ("Collect and write every fact", first * 1000)
+        print "%-36s %9.1f ms" % ("Facts.has_changed, nothing changed", again * 1000)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
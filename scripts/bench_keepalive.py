@@ -0,0 +1,136 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Time of the requests of a rhsmcertd-worker run, made against a local
+# TLS stub server with a new connection each, as python-rhsm does, and
+# over the keep-alive connections of a ConnectionPool. Needs openssl to
+# make the certificate of the stub server.
+#
+#  usage: PYTHONPATH=src python scripts/bench_keepalive.py
+
+import BaseHTTPServer
+import os
+import shutil
+import SocketServer
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+import rhsm.connection as connection
+
+from subscription_manager.connpool import ConnectionPool, PooledRestlib
+
+REQUESTS = 50
+RUNS = 5
+
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like a real server, or Nagle and delayed ACKs hold the first
+    # response of a connection back 40ms:
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = '{"result": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TLSStubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cert_file, key_file, handler=StatusHandler):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.socket = ssl.wrap_socket(self.socket, certfile=cert_file,
+                keyfile=key_file, server_side=True)
+        self.connections = 0
+
+    def handle_error(self, request, client_address):
+        # Clients closing without a TLS close_notify
+        pass
+
+
+def make_cert(cert_dir):
+    cert_file = os.path.join(cert_dir, "cert.pem")
+    key_file = os.path.join(cert_dir, "key.pem")
+    devnull = open(os.devnull, "w")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048",
+            "-nodes", "-days", "1", "-subj", "/CN=localhost",
+            "-keyout", key_file, "-out", cert_file],
+            stdout=devnull, stderr=devnull)
+    devnull.close()
+    return cert_file, key_file
+
+
+def run(restlib):
+    start = time.time()
+    for i in range(REQUESTS):
+        restlib.request_get("/status")
+    return time.time() - start
+
+
+def bench(server, make_restlib):
+    times = []
+    connections = server.connections
+    for i in range(RUNS):
+        times.append(run(make_restlib()))
+    return min(times), (server.connections - connections) / RUNS
+
+
+def main():
+    cert_dir = tempfile.mkdtemp()
+    try:
+        server = TLSStubServer(*make_cert(cert_dir))
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+        args = ('127.0.0.1', server.server_port, '/candlepin')
+
+        pools = []
+
+        def pooled_restlib():
+            pools.append(ConnectionPool())
+            return PooledRestlib(pools[-1], insecure=True, *args)
+
+        print "%d requests:" % REQUESTS
+        for label, make_restlib in [
+                ("connection per request", lambda: connection.Restlib(insecure=True, *args)),
+                ("keep-alive pool", pooled_restlib)]:
+            elapsed, connections = bench(server, make_restlib)
+            print "  %-24s %9.1f ms %5d connections" % (label, elapsed * 1000,
+                    connections)
+        print "  requests per connection: %s" % pools[-1].requests_per_connection()
+        for pool in pools:
+            pool.close()
+        server.shutdown()
+    finally:
+        shutil.rmtree(cert_dir)
+
+
+if __name__ == "__main__":
+    main()
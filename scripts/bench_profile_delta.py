@@ -0,0 +1,107 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Bytes sent and CPU time of package profile uploads, full versus delta,
+# against an in-process stub server that serializes requests the way
+# rhsm.connection does. The cache is written to a temporary directory.
+#
+#  usage: PYTHONPATH=src python scripts/bench_profile_delta.py
+
+import os
+import shutil
+import tempfile
+import time
+
+from rhsm import ourjson as json
+from rhsm.profile import Package, RPMProfile
+
+from subscription_manager import cache
+
+PACKAGES = 5000
+CHANGED = 3
+
+
+class StubConnection(object):
+
+    def __init__(self, server):
+        self.server = server
+
+    def request_put(self, method, params=None, headers=None):
+        self.server.received(method, params)
+
+
+class StubPackageServer(object):
+    """
+    Just enough of a UEPConnection for ProfileManager, recording the size
+    of the request bodies it is sent.
+    """
+
+    def __init__(self, delta=True):
+        self.delta = delta
+        self.conn = StubConnection(self)
+        self.requests = []
+
+    def supports_resource(self, resource_name):
+        if resource_name == cache.PACKAGES_DELTA_RESOURCE:
+            return self.delta
+        return True
+
+    def received(self, method, body):
+        self.requests.append((method, len(json.dumps(body))))
+
+    def updatePackageProfile(self, consumer_uuid, pkg_dicts):
+        self.received("/consumers/%s/packages" % consumer_uuid, pkg_dicts)
+
+
+def make_profile(changed=0):
+    profile = RPMProfile.__new__(RPMProfile)
+    profile.packages = []
+    for i in range(PACKAGES):
+        release = i < changed and u"2.el6" or u"1.el6"
+        profile.packages.append(Package(name=u"package-%s" % i,
+            version=u"1.%s.0" % (i % 20), release=release, arch=u"x86_64",
+            epoch=0, vendor=u"Red Hat, Inc."))
+    return profile
+
+
+def upload(cache_file, delta):
+    """ Returns (bytes sent, CPU seconds) for one changed profile upload. """
+    mgr = cache.ProfileManager(current_profile=make_profile())
+    mgr.CACHE_FILE = cache_file
+    mgr.write_cache()
+
+    mgr.current_profile = make_profile(CHANGED)
+    server = StubPackageServer(delta)
+    start = time.clock()
+    mgr._sync_with_server(server, "consumer")
+    elapsed = time.clock() - start
+    return sum([size for (method, size) in server.requests]), elapsed
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cache_file = os.path.join(tmp_dir, "packages.bin")
+        print "%d packages, %d changed:" % (PACKAGES, CHANGED)
+        for label, delta in [("full", False), ("delta", True)]:
+            sent, elapsed = upload(cache_file, delta)
+            print "  %-8s %10d bytes %8.1f ms CPU" % (label, sent, elapsed * 1000)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
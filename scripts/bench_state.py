@@ -0,0 +1,120 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+# Cold start cost of reading every cache, as separate files and from the
+# state store, with the synthetic data of bench_cache.py. Each read runs
+# in a fresh child process, like a subscription-manager or yum plugin
+# run. Caches are written to a temporary directory only.
+#
+#  usage: PYTHONPATH=src python scripts/bench_state.py
+
+import os
+import shutil
+import tempfile
+import time
+
+from mock import patch
+
+from subscription_manager import statestore
+
+from bench_cache import CACHES, make_cache, load
+
+RUNS = 20
+
+
+def make_caches(cache_dir):
+    mgrs = []
+    for cls, make_data in CACHES:
+        cache_file = os.path.join(cache_dir, cls.__name__)
+        mgrs.append(make_cache(cls, make_data(), cache_file, cls.SERIALIZER))
+    return mgrs
+
+
+def _write_all(mgrs):
+    for mgr in mgrs:
+        mgr._write_data(mgr.to_dict(), False)
+
+
+def write_all(mgrs):
+    # In one transaction if there is a store:
+    statestore.in_transaction(_write_all, mgrs)
+
+
+def read_all(mgrs, store_path):
+    """
+    Read every cache in a child process, opening the store at store_path
+    if there is one. Returns the seconds taken.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            start = time.time()
+            store = None
+            if store_path:
+                store = statestore.StateStore(store_path)
+            statestore.get_state_store = lambda: store
+            for mgr in mgrs:
+                if load(mgr) is None:
+                    raise Exception("Missing cache: %s" % mgr.CACHE_FILE)
+            os.write(write_fd, "%f" % (time.time() - start))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 64)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return float(result)
+
+
+def bench(mgrs, store):
+    store_patch = patch('subscription_manager.statestore.get_state_store',
+            lambda: store)
+    store_patch.start()
+    try:
+        start = time.time()
+        write_all(mgrs)
+        written = time.time() - start
+    finally:
+        store_patch.stop()
+    # Best of RUNS, each in a process of its own:
+    read = min([read_all(mgrs, store and store.path) for i in range(RUNS)])
+    return written, read
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        files_dir = os.path.join(tmp_dir, "files")
+        os.mkdir(files_dir)
+        store_dir = os.path.join(tmp_dir, "store")
+        os.mkdir(store_dir)
+        store = statestore.StateStore(os.path.join(store_dir, "state.db"))
+
+        print "%d caches:" % len(CACHES)
+        print "  %-12s %12s %12s" % ("", "write all", "read all")
+        for label, cache_dir, state_store in [("files", files_dir, None),
+                                              ("state store", store_dir, store)]:
+            written, read = bench(make_caches(cache_dir), state_store)
+            print "  %-12s %9.2f ms %9.2f ms" % (label, written * 1000, read * 1000)
+        store.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -55,6 +55,16 @@ class ActionClient(base_action_client.BaseActionClient):
 
         return lib_set
 
+    def _get_dependencies(self):
+        # Entitlement certs first, then the identity cert. Content needs
+        # both, the facts, package profile and installed products uploads
+        # only need the identity cert, and none of them the others:
+        return {self.idcertlib: [self.entcertlib],
+                self.content_client: [self.entcertlib, self.idcertlib],
+                self.factlib: [self.idcertlib],
+                self.profilelib: [self.idcertlib],
+                self.installedprodlib: [self.idcertlib]}
+
 
 class HealingActionClient(base_action_client.BaseActionClient):
     def _get_libset(self):
@@ -14,13 +14,33 @@
 # in this software or its documentation.
 #
 import logging
+import Queue
+import sys
+import threading
 
 from subscription_manager import injection as inj
 
+from rhsm.config import initConfig
 from rhsm.connection import GoneException, ExpiredIdentityCertException
 
 log = logging.getLogger('rhsm-app.' + __name__)
 
+cfg = initConfig()
+
+
+def _get_action_workers():
+    """
+    Number of threads to run independent action invokers with, 0 or 1
+    to run them one after the other (the default).
+    """
+    if not cfg.has_option('rhsm', 'action_workers'):
+        return 0
+    try:
+        return cfg.get_int('rhsm', 'action_workers') or 0
+    except ValueError:
+        log.warn("Ignoring invalid action_workers setting")
+        return 0
+
 
 class BaseActionClient(object):
     """
@@ -40,6 +60,15 @@ class BaseActionClient(object):
     def _get_libset(self):
         return []
 
+    def _get_dependencies(self):
+        """
+        Map invokers of the libset to the invokers they have to run
+        after. Invokers that do not depend on each other may then run
+        at the same time, see action_workers. None, the default, runs
+        the libset in order.
+        """
+        return None
+
     def update(self, autoheal=False):
         """
         Update I{entitlement} certificates and corresponding
@@ -48,11 +77,17 @@ class BaseActionClient(object):
         @rtype: list
         """
         lock = self.lock
+        # GETs made again during the updates are answered from there:
+        response_cache = inj.require(inj.CP_PROVIDER).response_cache
 
         # TODO: move to using a lock context manager
         try:
             lock.acquire()
-            self.update_reports = self._run_updates(autoheal)
+            response_cache.start()
+            try:
+                self.update_reports = self._run_updates(autoheal)
+            finally:
+                response_cache.stop()
         finally:
             lock.release()
 
@@ -79,6 +114,11 @@ class BaseActionClient(object):
 
     def _run_updates(self, autoheal):
 
+        dependencies = self._get_dependencies()
+        workers = _get_action_workers()
+        if dependencies is not None and workers > 1:
+            return self._run_concurrent_updates(dependencies, workers)
+
         update_reports = []
 
         for lib in self._libset:
@@ -89,3 +129,56 @@ class BaseActionClient(object):
             update_reports.append(update_report)
 
         return update_reports
+
+    def _run_concurrent_updates(self, dependencies, workers):
+        """
+        Run the libset on up to workers threads, each invoker once those
+        it depends on are done. Returns the reports in libset order, like
+        _run_updates.
+
+        A GoneException or ExpiredIdentityCertException stops any other
+        invoker from starting. It is raised once those running are done.
+        """
+        libset = list(self._libset)
+        pending = libset[:]
+        done = {}
+        results = Queue.Queue()
+        running = 0
+        error = None
+
+        def run(lib):
+            try:
+                results.put((lib, self._run_update(lib), None))
+            except Exception:
+                results.put((lib, None, sys.exc_info()))
+
+        def ready(lib):
+            for dependency in dependencies.get(lib, []):
+                if dependency in libset and dependency not in done:
+                    return False
+            return True
+
+        while True:
+            for lib in pending[:]:
+                if error or running >= workers:
+                    break
+                if ready(lib):
+                    log.debug("running lib: %s" % lib)
+                    pending.remove(lib)
+                    thread = threading.Thread(target=run, args=(lib,))
+                    thread.setDaemon(True)
+                    thread.start()
+                    running += 1
+            if not running:
+                break
+            lib, update_report, exc_info = results.get()
+            running -= 1
+            done[lib] = update_report
+            if exc_info and not error:
+                error = exc_info
+
+        if pending and not error:
+            log.warning("Not running libs with unmet dependencies: %s" % pending)
+        if error:
+            raise error[0], error[1], error[2]
+        return [done.get(invoker) for invoker in libset]
@@ -17,29 +17,199 @@ Module for managing the cached information about a system.
 Classes here track various information last sent to the server, compare
 this with the current state, and perform an update on the server if
 necessary.
+
+Caches are written as JSON by default. Caches read on every run can use
+BinaryCacheSerializer instead, a compact encoding that is much cheaper
+to load, and are named .bin rather than .json. Both are read back
+whatever the serializer, the .json file such a cache used to be is moved
+to its new name the first time it is used and rewritten in binary on its
+next write.
+
+Caches that are checked for changes on every run can also keep a digest
+of their data next to it. Checking for changes then only takes hashing
+the current data, the previous data is not read at all.
+
+Status caches keep the validators (ETag, Last-Modified) the server sent
+with the status next to it, and only download it again once it changed.
+
+Cache files are read and written through the statestore module, which
+keeps them in a single database instead when the state_store setting is
+enabled.
 """
 
+import atexit
 import gettext
 import logging
+import marshal
 import os
 import socket
 import threading
+import time
+import urllib
+import zlib
 from M2Crypto import SSL
+from rhsm.https import ssl
 
 from rhsm.config import initConfig
 import rhsm.connection as connection
-from rhsm.profile import get_profile, RPMProfile
+from rhsm.profile import get_profile, Package, RPMProfile
 import subscription_manager.injection as inj
 from subscription_manager.jsonwrapper import PoolWrapper
+from subscription_manager import requestcache
+from subscription_manager import statestore
 from rhsm import ourjson as json
 
+try:
+    from hashlib import sha1
+except ImportError:
+    # python 2.4
+    from sha import new as sha1
+
 _ = gettext.gettext
 log = logging.getLogger('rhsm-app.' + __name__)
 
 PACKAGES_RESOURCE = "packages"
+# Servers taking package profile deltas, see ProfileManager._sync_with_server:
+PACKAGES_DELTA_RESOURCE = "packages_delta"
 
 cfg = initConfig()
 
+DIGEST_SUFFIX = ".digest"
+VALIDATORS_SUFFIX = ".validators"
+
+RPMDB_PATH = "/var/lib/rpm"
+# The rpmdb files written by every transaction, for the Berkeley DB,
+# sqlite (including its write-ahead log) and ndb backends:
+RPMDB_FILES = ["Packages", "rpmdb.sqlite", "rpmdb.sqlite-wal", "Packages.db"]
+
+
+def _package_key(pkg_dict):
+    return (pkg_dict['name'], pkg_dict['epoch'], pkg_dict['version'],
+            pkg_dict['release'], pkg_dict['arch'], pkg_dict['vendor'])
+
+
+def package_profile_delta(cached, current):
+    """
+    Return the changes from the cached list of package dicts to the
+    current one, as a dict of:
+
+      added: dicts of the packages only in current
+      removed: dicts of the packages only in cached
+      changed: dicts of the packages in both under another version or
+          vendor, with the cached epoch, version and release as 'previous'
+
+    Packages only count as changed when they are the only one of their
+    name and arch in both profiles. Updating one of several installed
+    kernels is an add and a remove.
+    """
+    cached_pkgs = dict([(_package_key(pkg), pkg) for pkg in cached])
+    current_pkgs = dict([(_package_key(pkg), pkg) for pkg in current])
+    removed = [cached_pkgs[key] for key in
+               sorted([key for key in cached_pkgs if key not in current_pkgs])]
+    added = [current_pkgs[key] for key in
+             sorted([key for key in current_pkgs if key not in cached_pkgs])]
+
+    def by_name_arch(pkgs):
+        result = {}
+        for pkg in pkgs:
+            result.setdefault((pkg['name'], pkg['arch']), []).append(pkg)
+        return result
+
+    cached_by_name = by_name_arch(cached)
+    current_by_name = by_name_arch(current)
+    changed = []
+    for name_arch, new_pkgs in sorted(by_name_arch(added).items()):
+        old_pkgs = cached_by_name.get(name_arch, [])
+        if len(old_pkgs) != 1 or len(current_by_name[name_arch]) != 1:
+            continue
+        pkg = dict(new_pkgs[0])
+        pkg['previous'] = {'epoch': old_pkgs[0]['epoch'],
+                           'version': old_pkgs[0]['version'],
+                           'release': old_pkgs[0]['release']}
+        changed.append(pkg)
+        removed.remove(old_pkgs[0])
+        added.remove(new_pkgs[0])
+
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def rpmdb_fingerprint():
+    """
+    Return the inode, size and mtime of the rpmdb files, these change with
+    every package installed, updated or removed. Returns None if there is
+    no rpmdb we know.
+    """
+    fingerprint = []
+    for name in RPMDB_FILES:
+        try:
+            st = os.stat(os.path.join(RPMDB_PATH, name))
+        except OSError:
+            continue
+        fingerprint.append([name, st.st_ino, st.st_size, st.st_mtime])
+    return fingerprint or None
+
+
+class CacheSerializer(object):
+    """
+    Writes caches as plain JSON, the format every cache used to have.
+    """
+
+    def dump(self, data, open_file):
+        json.dump(data, open_file)
+
+
+class BinaryCacheSerializer(CacheSerializer):
+    """
+    Writes caches as a header followed by the zlib compressed marshal
+    encoding of the data.
+
+    The header starts with a NUL, which JSON never does, and carries a
+    format version. Files with another version are treated like corrupt
+    caches and regenerated. marshal is only safe for files nobody but
+    root can write, as is everything under /var/lib/rhsm.
+    """
+    MAGIC = "\0rhsm-cache"
+    VERSION = 1
+    # The marshal format version, fixed so python upgrades can still read
+    # existing caches:
+    MARSHAL_VERSION = 2
+
+    def dump(self, data, open_file):
+        try:
+            payload = marshal.dumps(data, self.MARSHAL_VERSION)
+        except ValueError:
+            # Something marshal does not handle, JSON might:
+            return CacheSerializer.dump(self, data, open_file)
+        open_file.write(self.MAGIC)
+        open_file.write(chr(self.VERSION))
+        open_file.write(zlib.compress(payload, 1))
+
+    @classmethod
+    def is_encoded(cls, open_file):
+        """
+        Check if an open cache file was written by this serializer. If not
+        the file is rewound to where it was.
+        """
+        start = open_file.tell()
+        if open_file.read(len(cls.MAGIC)) == cls.MAGIC:
+            return True
+        open_file.seek(start)
+        return False
+
+    @classmethod
+    def load(cls, open_file):
+        """
+        Decode the rest of a cache file after is_encoded has read its
+        magic. Raises ValueError if it can not be decoded.
+        """
+        version = open_file.read(1)
+        if version != chr(cls.VERSION):
+            raise ValueError("Unsupported cache format version: %r" % version)
+        try:
+            return marshal.loads(zlib.decompress(open_file.read()))
+        except (zlib.error, EOFError, TypeError), e:
+            raise ValueError("Corrupt cache: %s" % e)
+
 
 class CacheManager(object):
     """
@@ -52,6 +222,21 @@ class CacheManager(object):
     # Fields the subclass must override:
     CACHE_FILE = None
 
+    # Where the cache was kept before CACHE_FILE, such as the .json file
+    # of a cache now written in binary. It is moved to CACHE_FILE, or
+    # removed if there is one already, the first time the cache is used:
+    LEGACY_CACHE_FILE = None
+
+    # The files kept next to CACHE_FILE, by suffix:
+    STATE_SUFFIXES = [DIGEST_SUFFIX]
+
+    # How the cache is written to disk:
+    SERIALIZER = CacheSerializer()
+
+    # Keep a digest of the data in CACHE_FILE + DIGEST_SUFFIX, for
+    # _digest_changed:
+    DIGEST = False
+
     def to_dict(self):
         """
         Returns the data for this collection as a dict to be serialized
@@ -62,10 +247,17 @@ class CacheManager(object):
     def _load_data(self, open_file):
         """
         Load the data in whatever format the sub-class uses from
-        an already opened file descriptor.
+        an already opened file descriptor of a JSON cache.
         """
         raise NotImplementedError
 
+    def _load_dict(self, data):
+        """
+        Build what _load_data returns from the output of to_dict, as read
+        back from a binary cache.
+        """
+        return data
+
     def _sync_with_server(self, uep, consumer_uuid):
         """
         Sync the latest data to/from the server.
@@ -79,15 +271,86 @@ class CacheManager(object):
         """
         raise NotImplementedError
 
+    def _digest_data(self, data):
+        """
+        Return the output of to_dict in a canonical form, data comparing
+        equal for has_changed must have the same canonical form.
+        """
+        return data
+
+    def _digest(self, data):
+        canonical = json.dumps(self._digest_data(data), sort_keys=True)
+        if isinstance(canonical, unicode):
+            canonical = canonical.encode('utf-8')
+        return sha1(canonical).hexdigest()
+
+    def _read_digest(self):
+        try:
+            f = statestore.open_state(self.CACHE_FILE + DIGEST_SUFFIX)
+            try:
+                return f.read().strip()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+    def _digest_changed(self, data):
+        """
+        Compare data to the digest stored with the cache. Returns None if
+        there is no digest, and the cache has to be read and compared
+        instead.
+        """
+        if not self.DIGEST:
+            return None
+        digest = self._read_digest()
+        if not digest:
+            return None
+        try:
+            return self._digest(data) != digest
+        except (TypeError, ValueError):
+            return None
+
     @classmethod
     def delete_cache(cls):
         """ Delete the cache for this collection from disk. """
-        if os.path.exists(cls.CACHE_FILE):
+        if statestore.state_exists(cls.CACHE_FILE):
             log.info("Deleting cache: %s" % cls.CACHE_FILE)
-            os.remove(cls.CACHE_FILE)
+        statestore.in_transaction(cls._delete_state)
+
+    @classmethod
+    def _delete_state(cls):
+        for suffix in [''] + cls.STATE_SUFFIXES:
+            statestore.remove_state(cls.CACHE_FILE + suffix)
+            if cls.LEGACY_CACHE_FILE:
+                statestore.remove_state(cls.LEGACY_CACHE_FILE + suffix)
+
+    def _migrate_legacy(self):
+        """ Move the cache left at LEGACY_CACHE_FILE to CACHE_FILE. """
+        legacy_file = self.LEGACY_CACHE_FILE
+        if not legacy_file or legacy_file == self.CACHE_FILE:
+            return
+        try:
+            if statestore.state_exists(legacy_file):
+                statestore.in_transaction(self._move_legacy_state)
+        except (IOError, OSError), e:
+            log.warn("Unable to migrate cache %s: %s" % (legacy_file, e))
+
+    def _move_legacy_state(self):
+        # Whatever format it is in, _read_cache tells. A cache written
+        # since the legacy one is the current one:
+        if statestore.state_exists(self.CACHE_FILE):
+            for suffix in [''] + self.STATE_SUFFIXES:
+                statestore.remove_state(self.LEGACY_CACHE_FILE + suffix)
+            return
+        log.info("Moving cache %s to %s" % (self.LEGACY_CACHE_FILE,
+                 self.CACHE_FILE))
+        for suffix in [''] + self.STATE_SUFFIXES:
+            statestore.rename_state(self.LEGACY_CACHE_FILE + suffix,
+                    self.CACHE_FILE + suffix)
 
     def _cache_exists(self):
-        return os.path.exists(self.CACHE_FILE)
+        self._migrate_legacy()
+        return statestore.state_exists(self.CACHE_FILE)
 
     def write_cache(self, debug=True):
         """
@@ -98,36 +361,62 @@ class CacheManager(object):
         required, but the method is exposed as some system data can be
         bundled up with the registration request, after which we need to
         manually write to disk.
+
+        Returns True if the cache was written.
+        """
+        return self._write_data(self.to_dict(), debug)
+
+    def _write_data(self, data, debug=True):
+        """
+        Write data, the output of to_dict, as the cache. Returns True if it
+        was written.
         """
         # Logging in this method (when threaded) can cause a segfault, BZ 988861 and 988430
         try:
-            if not os.access(os.path.dirname(self.CACHE_FILE), os.R_OK):
-                os.makedirs(os.path.dirname(self.CACHE_FILE))
-            f = open(self.CACHE_FILE, "w+")
-            json.dump(self.to_dict(), f)
-            f.close()
+            statestore.in_transaction(self._write_state, data)
             if debug:
                 log.debug("Wrote cache: %s" % self.CACHE_FILE)
-        except IOError, e:
+            return True
+        except (IOError, OSError, TypeError, ValueError), e:
             if debug:
                 log.error("Unable to write cache: %s" %
                         self.CACHE_FILE)
                 log.exception(e)
+            return False
+
+    def _write_state(self, data):
+        self._migrate_legacy()
+        digest_file = self.CACHE_FILE + DIGEST_SUFFIX
+        if self.DIGEST:
+            # Never leave the digest of older data behind, if writing
+            # fails from here on we compare with the cache instead:
+            statestore.remove_state(digest_file)
+        statestore.write_state(self.CACHE_FILE,
+                lambda f: self.SERIALIZER.dump(data, f))
+        if self.DIGEST:
+            digest = self._digest(data)
+            statestore.write_state(digest_file, lambda f: f.write(digest + "\n"))
 
     def _read_cache(self):
         """
         Load the last data we sent to the server.
         Returns none if no cache file exists.
         """
+        self._migrate_legacy()
         try:
-            f = open(self.CACHE_FILE)
-            data = self._load_data(f)
-            f.close()
+            f = statestore.open_state(self.CACHE_FILE)
+            try:
+                if BinaryCacheSerializer.is_encoded(f):
+                    data = self._load_dict(BinaryCacheSerializer.load(f))
+                else:
+                    data = self._load_data(f)
+            finally:
+                f.close()
             return data
         except IOError:
             log.error("Unable to read cache: %s" % self.CACHE_FILE)
         except ValueError:
-            # ignore json file parse errors, we are going to generate
+            # ignore corrupt or outdated caches, we are going to generate
             # a new as if it didn't exist
             pass
 
@@ -156,19 +445,225 @@ class CacheManager(object):
             return 0  # No updates performed.
 
 
+class CacheWriter(object):
+    """
+    Writes caches from a single background thread, so callers never block
+    on disk io.
+
+    Writes queued for a cache file that is still waiting to be written
+    replace the data queued before, only the latest state is written.
+    Queued writes are flushed when the process exits.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # Cache files waiting to be written, in order, and the cache and
+        # data to write for each:
+        self._queue = []
+        self._pending = {}
+        # The cache file being written:
+        self._writing = None
+        self._thread = None
+
+    def write(self, cache):
+        """ Queue a write of the current data of cache. """
+        data = cache.to_dict()
+        self._cond.acquire()
+        try:
+            if cache.CACHE_FILE not in self._pending:
+                self._queue.append(cache.CACHE_FILE)
+            self._pending[cache.CACHE_FILE] = (cache, data)
+            if self._thread is None:
+                self._start()
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="CacheWriter")
+        # Exiting does not wait for the thread, flush does:
+        self._thread.setDaemon(True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        # No logging from here, BZ 988861 and 988430
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._queue:
+                    self._cond.wait()
+                self._writing = self._queue.pop(0)
+                cache, data = self._pending.pop(self._writing)
+            finally:
+                self._cond.release()
+
+            try:
+                try:
+                    cache._write_data(data, False)
+                except Exception:
+                    # Keep the thread alive for the other caches:
+                    pass
+            finally:
+                self._cond.acquire()
+                try:
+                    self._writing = None
+                    self._cond.notifyAll()
+                finally:
+                    self._cond.release()
+
+    def discard(self, cache_file):
+        """
+        Drop queued writes of cache_file, and wait for one in progress to
+        finish. Once this returns the file can be deleted for good.
+        """
+        self._cond.acquire()
+        try:
+            if self._pending.pop(cache_file, None) is not None:
+                self._queue.remove(cache_file)
+            while self._writing == cache_file:
+                self._cond.wait()
+        finally:
+            self._cond.release()
+
+    def flush(self):
+        """ Wait for every queued write to be written. """
+        self._cond.acquire()
+        try:
+            while self._queue or self._writing is not None:
+                self._cond.wait()
+        finally:
+            self._cond.release()
+
+
+# Writes the status caches:
+cache_writer = CacheWriter()
+
+
+class StatusRefresher(object):
+    """
+    Refreshes the status caches served from their fresh cache, see
+    status_cache_freshness, once the process is done.
+
+    The refresh runs on the main thread at exit, after the command has
+    printed its output: nothing else uses the connection then, and
+    logging still works, unlike on a thread left running at exit (BZ
+    988861 and 988430).
+    """
+
+    def __init__(self):
+        # The (cache, uep, uuid) to refresh, in order:
+        self._refreshes = []
+        self._registered = False
+
+    def add(self, cache, uep, uuid):
+        """ Refresh cache from the server at exit, once. """
+        for queued in self._refreshes:
+            if queued[0] is cache:
+                return
+        self._refreshes.append((cache, uep, uuid))
+        if not self._registered:
+            atexit.register(self.run)
+            self._registered = True
+
+    def run(self):
+        """ Refresh the queued caches and wait for them to be written. """
+        while self._refreshes:
+            cache, uep, uuid = self._refreshes.pop(0)
+            cache._refresh(uep, uuid)
+        cache_writer.flush()
+
+
+# Refreshes the status caches served while fresh:
+status_refresher = StatusRefresher()
+
+
+def _get_status_cache_freshness():
+    """
+    Seconds a status cache is served as is, and refreshed once the
+    process is done, 0 to always ask the server first (the default).
+    """
+    if not cfg.has_option('rhsm', 'status_cache_freshness'):
+        return 0
+    try:
+        return cfg.get_int('rhsm', 'status_cache_freshness') or 0
+    except ValueError:
+        log.warn("Ignoring invalid status_cache_freshness setting")
+        return 0
+
+
 class StatusCache(CacheManager):
     """
     Unlike other cache managers, this one gets info from the server rather
     than sending it.
     """
+    SERIALIZER = BinaryCacheSerializer()
+    STATE_SUFFIXES = [DIGEST_SUFFIX, VALIDATORS_SUFFIX]
+
+    # Certificate directories whose changes make the status stale, such
+    # as attaching a subscription or installing a product:
+    DEPENDS_ON = ['entitlementCertDir', 'productCertDir', 'consumerCertDir']
+
+    # The path of the GET the status comes from, with the consumer uuid
+    # to fill in:
+    STATUS_PATH = None
+
     def __init__(self):
         self.server_status = None
+        # The validators of server_status, see _conditional_sync:
+        self.validators = None
         self.last_error = None
+        # Age in seconds of the cached status load_status last returned,
+        # None if it came straight from the server:
+        self.cached_age = None
+
+    def cache_age(self):
+        """
+        Seconds since the cache was written, or None if there is no cache.
+        """
+        self._migrate_legacy()
+        try:
+            return time.time() - statestore.state_mtime(self.CACHE_FILE)
+        except OSError:
+            return None
+
+    def _is_fresh(self, freshness):
+        self._migrate_legacy()
+        try:
+            written = statestore.state_mtime(self.CACHE_FILE)
+        except OSError:
+            return False
+        age = time.time() - written
+        if age < 0 or age >= freshness:
+            return False
+        for option in self.DEPENDS_ON:
+            try:
+                if os.stat(cfg.get('rhsm', option)).st_mtime >= written:
+                    return False
+            except OSError:
+                continue
+        return True
+
+    def _refresh(self, uep, uuid):
+        """
+        Sync with the server and cache the result, see StatusRefresher.
+        A failure leaves the cache as is, the next run past the freshness
+        window asks the server itself.
+        """
+        try:
+            self._sync_with_server(uep, uuid)
+            self.write_cache()
+        except Exception, e:
+            log.debug("Unable to refresh cached status %s: %s" %
+                      (self.CACHE_FILE, e))
 
     def load_status(self, uep, uuid):
         """
         Load status from wherever is appropriate.
 
+        If the cache is younger than the status_cache_freshness setting,
+        return it and refresh it from the server when the process exits.
+
         If server is reachable, return it's response
         and cache the results to disk.
 
@@ -177,12 +672,24 @@ class StatusCache(CacheManager):
 
         Returns None if we cannot reach the server, or use the cache.
         """
+        self.cached_age = None
+        freshness = _get_status_cache_freshness()
+        if freshness and self._is_fresh(freshness):
+            age = self.cache_age()
+            status = self._read_cache()
+            if status is not None:
+                log.debug("Using cached status %ds old, refreshing it at "
+                          "exit: %s" % (age, self.CACHE_FILE))
+                self.cached_age = age
+                status_refresher.add(self, uep, uuid)
+                return status
+
         try:
             self._sync_with_server(uep, uuid)
             self.write_cache()
             self.last_error = False
             return self.server_status
-        except SSL.SSLError, ex:
+        except (SSL.SSLError, ssl.SSLError), ex:
             log.exception(ex)
             self.last_error = ex
             log.error("Consumer certificate is invalid")
@@ -203,6 +710,7 @@ class StatusCache(CacheManager):
                 return None
 
             log.warn("Unable to reach server, using cached status.")
+            self.cached_age = self.cache_age()
             return self._read_cache()
 
         except connection.NetworkException, ex:
@@ -213,6 +721,7 @@ class StatusCache(CacheManager):
                 raise
 
             log.warn("Unable to reach server, using cached status.")
+            self.cached_age = self.cache_age()
             return self._read_cache()
         except connection.ExpiredIdentityCertException, ex:
             log.exception(ex)
@@ -225,6 +734,78 @@ class StatusCache(CacheManager):
             self.last_error = ex
             return None
 
+    def _get_status(self, uep, uuid):
+        """ Fetch the server response the status comes from. """
+        raise NotImplementedError
+
+    def _status_from_response(self, response):
+        """ The status to cache out of the server response. """
+        return response
+
+    def _sync_with_server(self, uep, uuid):
+        if requestcache.supports_conditional(uep):
+            self._conditional_sync(uep, uuid)
+            return
+        self.server_status = self._status_from_response(
+                self._get_status(uep, uuid))
+        self.validators = None
+
+    def _conditional_sync(self, uep, uuid):
+        """
+        Sync with a GET sending the validators of the cached status, a
+        304 Not Modified answer means the cache is still current.
+        """
+        method = self.STATUS_PATH % uep.sanitize(uuid)
+        validators = self._read_validators()
+        modified, response, new_validators = \
+                requestcache.conditional_get(uep, method, validators)
+        if not modified:
+            log.debug("Status not modified, %d bytes saved: %s" %
+                      ((validators or {}).get('length', 0), self.CACHE_FILE))
+            # Rewritten all the same, its age is that of the last check:
+            self.server_status = self._read_cache()
+            return
+        self.server_status = self._status_from_response(response)
+        if self.server_status is None:
+            self.validators = None
+            return
+        digest = self._digest(self.server_status)
+        if new_validators:
+            # Tells which status they are the validators of:
+            new_validators['digest'] = digest
+        elif validators and validators.get('digest') == digest:
+            # Answered by the ResponseCache, the status did not change
+            new_validators = validators
+        self.validators = new_validators
+
+    def _read_validators(self):
+        """
+        The validators of the cached status, None if there are none or
+        they are not those of the cached status.
+        """
+        if not self._cache_exists():
+            return None
+        status = self._read_cache()
+        if status is None:
+            return None
+        validators = self.validators
+        if validators is None:
+            try:
+                f = statestore.open_state(self.CACHE_FILE + VALIDATORS_SUFFIX)
+                try:
+                    validators = json.loads(f.read())
+                finally:
+                    f.close()
+            except (IOError, ValueError):
+                return None
+        try:
+            if validators.get('digest') != self._digest(status):
+                return None
+        except (AttributeError, TypeError, ValueError):
+            return None
+        self.validators = validators
+        return validators
+
     def to_dict(self):
         return self.server_status
 
@@ -232,6 +813,16 @@ class StatusCache(CacheManager):
         json_str = open_file.read()
         return json.loads(json_str)
 
+    def _write_state(self, data):
+        super(StatusCache, self)._write_state(data)
+        validators_file = self.CACHE_FILE + VALIDATORS_SUFFIX
+        validators = self.validators
+        if validators and validators.get('digest') == self._digest(data):
+            statestore.write_state(validators_file,
+                    lambda f: f.write(json.dumps(validators)))
+        else:
+            statestore.remove_state(validators_file)
+
     def _read_cache(self):
         """
         Prefer in memory cache to avoid io.  If it doesn't exist, save
@@ -255,13 +846,15 @@ class StatusCache(CacheManager):
         This is threaded because it should never block in runtime.
         Writing to disk means it will be read from memory for the rest of this run.
         """
-        threading.Thread(target=super(StatusCache, self).write_cache, args=[False], name="WriteCache%s" % self.__class__.__name__).start()
-        log.debug("Started thread to write cache: %s" % self.CACHE_FILE)
+        cache_writer.write(self)
 
     # we override a @classmethod with an instance method in the sub class?
     def delete_cache(self):
+        # Or a queued write would bring it back:
+        cache_writer.discard(self.CACHE_FILE)
         super(StatusCache, self).delete_cache()
         self.server_status = None
+        self.validators = None
 
 
 class EntitlementStatusCache(StatusCache):
@@ -270,35 +863,42 @@ class EntitlementStatusCache(StatusCache):
     Unlike other cache managers, this one gets info from the server rather
     than sending it.
     """
-    CACHE_FILE = "/var/lib/rhsm/cache/entitlement_status.json"
+    CACHE_FILE = "/var/lib/rhsm/cache/entitlement_status.bin"
+    LEGACY_CACHE_FILE = "/var/lib/rhsm/cache/entitlement_status.json"
+    STATUS_PATH = "/consumers/%s/compliance"
 
-    def _sync_with_server(self, uep, uuid):
-        self.server_status = uep.getCompliance(uuid)
+    def _get_status(self, uep, uuid):
+        return uep.getCompliance(uuid)
 
 
 class ProductStatusCache(StatusCache):
     """
     Manages the system cache of installed product valid date ranges.
     """
-    CACHE_FILE = "/var/lib/rhsm/cache/product_status.json"
+    CACHE_FILE = "/var/lib/rhsm/cache/product_status.bin"
+    LEGACY_CACHE_FILE = "/var/lib/rhsm/cache/product_status.json"
+    STATUS_PATH = "/consumers/%s"
 
-    def _sync_with_server(self, uep, uuid):
-        consumer_data = uep.getConsumer(uuid)
+    def _get_status(self, uep, uuid):
+        return uep.getConsumer(uuid)
 
+    def _status_from_response(self, consumer_data):
         if 'installedProducts' not in consumer_data:
             log.warn("Server does not support product date ranges.")
-        else:
-            self.server_status = consumer_data['installedProducts']
+            return self.server_status
+        return consumer_data['installedProducts']
 
 
 class OverrideStatusCache(StatusCache):
     """
     Manages the cache of yum repo overrides set on the server.
     """
-    CACHE_FILE = "/var/lib/rhsm/cache/content_overrides.json"
+    CACHE_FILE = "/var/lib/rhsm/cache/content_overrides.bin"
+    LEGACY_CACHE_FILE = "/var/lib/rhsm/cache/content_overrides.json"
+    STATUS_PATH = "/consumers/%s/content_overrides"
 
-    def _sync_with_server(self, uep, consumer_uuid):
-        self.server_status = uep.getContentOverrides(consumer_uuid)
+    def _get_status(self, uep, consumer_uuid):
+        return uep.getContentOverrides(consumer_uuid)
 
 
 # this is injected normally
@@ -306,13 +906,20 @@ class ProfileManager(CacheManager):
     """
     Manages the profile of packages installed on this system.
     """
-    CACHE_FILE = "/var/lib/rhsm/packages/packages.json"
+    CACHE_FILE = "/var/lib/rhsm/packages/packages.bin"
+    LEGACY_CACHE_FILE = "/var/lib/rhsm/packages/packages.json"
+    SERIALIZER = BinaryCacheSerializer()
+    DIGEST = True
+    # The rpmdb fingerprint the cached profile was collected with:
+    RPMDB_SUFFIX = ".rpmdb"
+    STATE_SUFFIXES = [DIGEST_SUFFIX, RPMDB_SUFFIX]
 
     def __init__(self, current_profile=None):
 
         # Could be None, we'll read the system's current profile later once
         # we're sure we actually need the data.
         self._current_profile = current_profile
+        self._rpmdb_fingerprint = None
         self._report_package_profile = cfg.get_int('rhsm', 'report_package_profile')
 
     # give tests a chance to use something other than RPMProfile
@@ -322,11 +929,14 @@ class ProfileManager(CacheManager):
     def _get_current_profile(self):
         # If we weren't given a profile, load the current systems packages:
         if not self._current_profile:
+            # Taken first, anything installed while we collect changes it:
+            self._rpmdb_fingerprint = rpmdb_fingerprint()
             self._current_profile = self._get_profile('rpm')
         return self._current_profile
 
     def _set_current_profile(self, value):
         self._current_profile = value
+        self._rpmdb_fingerprint = None
 
     def _set_report_package_profile(self, value):
         self._report_package_profile = value
@@ -339,6 +949,19 @@ class ProfileManager(CacheManager):
     def _load_data(self, open_file):
         return RPMProfile(from_file=open_file)
 
+    def _load_dict(self, data):
+        # RPMProfile only loads from JSON files or the rpm database, fill
+        # one in ourselves:
+        profile = RPMProfile.__new__(RPMProfile)
+        profile.packages = [Package(name=pkg_dict['name'],
+                                    version=pkg_dict['version'],
+                                    release=pkg_dict['release'],
+                                    arch=pkg_dict['arch'],
+                                    epoch=pkg_dict['epoch'],
+                                    vendor=pkg_dict['vendor'])
+                            for pkg_dict in data]
+        return profile
+
     def update_check(self, uep, consumer_uuid, force=False):
         """
         Check if packages have changed, and push an update if so.
@@ -355,17 +978,116 @@ class ProfileManager(CacheManager):
 
         return CacheManager.update_check(self, uep, consumer_uuid, force)
 
+    def _read_rpmdb_fingerprint(self):
+        try:
+            f = statestore.open_state(self.CACHE_FILE + self.RPMDB_SUFFIX)
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+
+    def _rpmdb_unchanged(self):
+        """
+        Check if the rpmdb is as it was when the cached profile was
+        collected, in which case the profile is too.
+        """
+        # Only if we would collect the profile from the rpmdb ourselves:
+        if self._current_profile:
+            return False
+        fingerprint = rpmdb_fingerprint()
+        return fingerprint is not None and \
+                fingerprint == self._read_rpmdb_fingerprint()
+
     def has_changed(self):
         if not self._cache_exists():
             log.info("Cache does not exist")
             return True
 
+        if self._rpmdb_unchanged():
+            log.info("rpmdb unchanged since the package profile was cached.")
+            return False
+
+        changed = self._digest_changed(self.to_dict())
+        if changed is not None:
+            return changed
+
         cached_profile = self._read_cache()
         return not cached_profile == self.current_profile
 
+    def write_cache(self, debug=True):
+        # The profile, its digest and fingerprint are committed together:
+        try:
+            return statestore.in_transaction(self._write_profile, debug)
+        except IOError, e:
+            if debug:
+                log.error("Unable to write cache: %s" % e)
+            return False
+
+    def _write_profile(self, debug):
+        fingerprint_file = self.CACHE_FILE + self.RPMDB_SUFFIX
+        # Like the digest, never leave a fingerprint for other data behind:
+        try:
+            statestore.remove_state(fingerprint_file)
+        except (IOError, OSError):
+            pass
+        if not CacheManager.write_cache(self, debug):
+            return False
+        # Only for profiles we collected from the rpmdb:
+        fingerprint = self._rpmdb_fingerprint
+        if fingerprint:
+            try:
+                statestore.write_state(fingerprint_file,
+                        lambda f: json.dump(fingerprint, f))
+            except (IOError, OSError), e:
+                if debug:
+                    log.error("Unable to write rpmdb fingerprint: %s" % e)
+        return True
+
+    def _digest_data(self, data):
+        # Profiles compare equal whatever the order of their packages:
+        return sorted(data, key=lambda pkg: (pkg['name'], pkg['version'],
+            pkg['release'], pkg['arch'], pkg['epoch'], pkg['vendor']))
+
+    def _profile_delta(self, current):
+        """
+        Return the delta from the profile we last sent to the current one,
+        or None if we have no usable cache or the delta would not be much
+        smaller than the full profile.
+        """
+        if not self._cache_exists():
+            return None
+        cached_profile = self._read_cache()
+        if cached_profile is None:
+            return None
+        cached = cached_profile.collect()
+
+        delta = package_profile_delta(cached, current)
+        size = len(delta['added']) + len(delta['removed']) + len(delta['changed'])
+        if size * 2 > len(current):
+            return None
+        # Lets the server check the delta applies to the profile it has:
+        delta['base'] = self._read_digest() or self._digest(cached)
+        return delta
+
     def _sync_with_server(self, uep, consumer_uuid):
-        uep.updatePackageProfile(consumer_uuid,
-                self.current_profile.collect())
+        current = self.current_profile.collect()
+        if uep.supports_resource(PACKAGES_DELTA_RESOURCE):
+            delta = self._profile_delta(current)
+            if delta is not None:
+                try:
+                    # Not wrapped by UEPConnection:
+                    method = "/consumers/%s/packages/delta" % \
+                            urllib.quote(consumer_uuid)
+                    uep.conn.request_put(method, delta)
+                    log.info("Uploaded package profile delta.")
+                    return
+                except connection.RestlibException, e:
+                    # Most likely the server has another base profile:
+                    log.info("Package profile delta rejected, uploading the "
+                             "full profile: %s" % e)
+        uep.updatePackageProfile(consumer_uuid, current)
 
 
 class InstalledProductsManager(CacheManager):
@@ -373,7 +1095,10 @@ class InstalledProductsManager(CacheManager):
     Manages the cache of the products installed on this system, and what we
     last sent to the server.
     """
-    CACHE_FILE = "/var/lib/rhsm/cache/installed_products.json"
+    CACHE_FILE = "/var/lib/rhsm/cache/installed_products.bin"
+    LEGACY_CACHE_FILE = "/var/lib/rhsm/cache/installed_products.json"
+    SERIALIZER = BinaryCacheSerializer()
+    DIGEST = True
 
     def __init__(self):
         self._installed = None
@@ -407,10 +1132,14 @@ class InstalledProductsManager(CacheManager):
             log.info("Cache does not exist")
             return True
 
-        cached = self._read_cache()
-
         self._setup_installed()
 
+        changed = self._digest_changed(self.installed)
+        if changed is not None:
+            return changed
+
+        cached = self._read_cache()
+
         if len(cached.keys()) != len(self.installed.keys()):
             return True
 
@@ -447,46 +1176,111 @@ class InstalledProductsManager(CacheManager):
                 installed_products=self.format_for_server())
 
 
-class PoolTypeCache(object):
+class PoolTypeCache(CacheManager):
+    """
+    Maps pool ids to the type of the pool.
+
+    The types of attached pools are persisted, only pools attached since
+    they were need looking up on the server.
+    """
+    CACHE_FILE = "/var/lib/rhsm/cache/pool_types.bin"
+    LEGACY_CACHE_FILE = "/var/lib/rhsm/cache/pool_types.json"
+    SERIALIZER = BinaryCacheSerializer()
+
+    # Up to this many pools are looked up one by one, past that (such as
+    # on the first run) we fetch every entitlement in one request:
+    MAX_POOL_REQUESTS = 5
 
     def __init__(self):
         self.identity = inj.require(inj.IDENTITY)
         self.cp_provider = inj.require(inj.CP_PROVIDER)
         self.ent_dir = inj.require(inj.ENT_DIR)
         self.pooltype_map = {}
+        # The attached pool types as last persisted:
+        self._persisted = {}
+        if self._cache_exists():
+            self._persisted = self._read_cache() or {}
+        self.pooltype_map.update(self._persisted)
         self.update()
 
     def get(self, pool_id):
         return self.pooltype_map.get(pool_id, '')
 
     def update(self):
-        if self.requires_update():
-            self._do_update()
+        attached_pool_ids = self._attached_pool_ids()
+        missing_types = attached_pool_ids - set(self.pooltype_map)
+        if missing_types:
+            self._do_update(missing_types)
+        self._persist(attached_pool_ids)
 
-    def requires_update(self):
-        attached_pool_ids = set([ent.pool.id for ent in self.ent_dir.list()
+    def _attached_pool_ids(self):
+        return set([ent.pool.id for ent in self.ent_dir.list()
             if ent.pool and ent.pool.id])
-        missing_types = attached_pool_ids - set(self.pooltype_map)
+
+    def requires_update(self):
+        missing_types = self._attached_pool_ids() - set(self.pooltype_map)
         return bool(missing_types)
 
-    def _do_update(self):
+    def _do_update(self, pool_ids=None):
+        """
+        Look up the types of pool_ids on the server, or of every attached
+        pool if None.
+        """
         result = {}
         if self.identity.is_valid():
             cp = self.cp_provider.get_consumer_auth_cp()
-            entitlement_list = []
+            pools = None
+            if pool_ids is not None and len(pool_ids) <= self.MAX_POOL_REQUESTS:
+                pools = self._get_pools(cp, pool_ids)
+            if pools is None:
+                pools = self._get_entitlement_pools(cp)
+
+            for pool in pools:
+                pool = PoolWrapper(pool)
+                result[pool.get_id()] = pool.get_pool_type()
+
+        self.pooltype_map.update(result)
+
+    def _get_pools(self, cp, pool_ids):
+        """
+        Fetch each pool, or return None if any of them can not be.
+        """
+        pools = []
+        for pool_id in pool_ids:
             try:
-                entitlement_list = cp.getEntitlementList(self.identity.uuid)
+                # The pool type is only calculated for a consumer:
+                pools.append(cp.getPool(pool_id, self.identity.uuid))
             except Exception, e:
-                # In this case, return an empty map.  We just won't populate the field
-                log.debug('Problem attmepting to get entitlements from the server')
+                log.debug('Problem attempting to get pool %s from the server' % pool_id)
                 log.debug(e)
+                return None
+        return pools
 
-            for ent in entitlement_list:
-                pool = PoolWrapper(ent.get('pool', {}))
-                pool_type = pool.get_pool_type()
-                result[pool.get_id()] = pool_type
+    def _get_entitlement_pools(self, cp):
+        entitlement_list = []
+        try:
+            entitlement_list = cp.getEntitlementList(self.identity.uuid)
+        except Exception, e:
+            # In this case, return an empty map.  We just won't populate the field
+            log.debug('Problem attmepting to get entitlements from the server')
+            log.debug(e)
+        return [ent.get('pool', {}) for ent in entitlement_list]
+
+    def _persist(self, attached_pool_ids):
+        # Only attached pools, we may know the types of every available
+        # pool but most will never be looked up again:
+        attached_types = dict([(pool_id, self.pooltype_map[pool_id])
+                               for pool_id in attached_pool_ids
+                               if pool_id in self.pooltype_map])
+        if attached_types != self._persisted:
+            self._persisted = attached_types
+            self.write_cache()
 
-        self.pooltype_map.update(result)
+    def to_dict(self):
+        return self._persisted
+
+    def _load_data(self, open_file):
+        return json.loads(open_file.read())
 
     def update_from_pools(self, pool_map):
         # pool_map maps pool ids to pool json
@@ -522,3 +1316,73 @@ class WrittenOverrideCache(CacheManager):
             # ignore json file parse errors, we are going to generate
             # a new as if it didn't exist
             pass
+
+
+class ReleaseListingCache(CacheManager):
+    """
+    The release listings last downloaded from the CDN, when, and with the
+    validators they came with. A listing is not downloaded again for a
+    while, and then only once it changed.
+    """
+    CACHE_FILE = "/var/lib/rhsm/cache/release_listings.json"
+
+    def __init__(self):
+        self.listings = None
+        # Listings are fetched from several threads:
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self.listings is None:
+            self.listings = {}
+            if self._cache_exists():
+                self.listings = self._read_cache() or {}
+
+    def get(self, url):
+        """ Return (data, validators) of the listing at url, or None. """
+        self._lock.acquire()
+        try:
+            self._load()
+            listing = self.listings.get(url)
+        finally:
+            self._lock.release()
+        if not listing:
+            return None
+        return listing.get('data'), listing.get('validators')
+
+    def get_fresh(self, url, ttl):
+        """
+        Return the data of the listing at url if it was fetched less than
+        ttl seconds ago, None otherwise.
+        """
+        self._lock.acquire()
+        try:
+            self._load()
+            listing = self.listings.get(url)
+        finally:
+            self._lock.release()
+        if not listing:
+            return None
+        age = time.time() - listing.get('fetched', 0)
+        if age < 0 or age >= ttl:
+            return None
+        return listing.get('data')
+
+    def put(self, url, data, validators):
+        """ Keep data as the listing at url, fetched now. """
+        self._lock.acquire()
+        try:
+            self._load()
+            self.listings[url] = {'data': data, 'validators': validators,
+                                  'fetched': time.time()}
+        finally:
+            self._lock.release()
+
+    def to_dict(self):
+        self._lock.acquire()
+        try:
+            return dict(self.listings or {})
+        finally:
+            self._lock.release()
+
+    def _load_data(self, open_file):
+        return json.loads(open_file.read())
@@ -203,37 +203,36 @@ class ComplianceManager(object):
         Scan entitlement certs looking for unentitled products which may
         have expired, or be entitled in future.
 
-        Also builds up a list of valid certs today. (used when determining
-        if anything is in it's warning period)
+        Also builds up a list of valid certs today, or on the date we're
+        checking. (used when determining if anything is in it's warning
+        period)
         """
         # Subtract out the valid and partially valid items from the
         # list of installed products
         unknown_products = dict((k, v) for (k, v) in self.installed_products.items()
                                 if k not in self.valid_products.keys()
                                 and k not in self.partially_valid_products.keys())
-        ent_certs = self.entitlement_dir.list()
+        validity = self.entitlement_dir.get_validity_index()
 
-        on_date = datetime.now(GMT())
-        for ent_cert in ent_certs:
+        on_date = self.on_date or datetime.now(GMT())
 
-            # Builds the list of valid entitlement certs today:
-            if ent_cert.is_valid():
-                self.valid_entitlement_certs.append(ent_cert)
+        # Builds the list of entitlement certs valid on the date we're checking:
+        self.valid_entitlement_certs.extend(validity.valid_at(on_date))
 
-            for product in ent_cert.products:
-                if product.id in unknown_products.keys():
-                    # If the entitlement starts after the date we're checking, we
-                    # consider this a future entitlement. Technically it could be
-                    # partially stacked on that date, but we cannot determine that
-                    # without recursively cert sorting again on that date.
-                    if ent_cert.valid_range.begin() > on_date:
-                        product_dict = self.future_products
-                    # Check if entitlement has already expired:
-                    elif ent_cert.valid_range.end() < on_date:
-                        product_dict = self.expired_products
-                    else:
-                        continue
+        # If the entitlement starts after the date we're checking, we
+        # consider this a future entitlement. Technically it could be
+        # partially stacked on that date, but we cannot determine that
+        # without recursively cert sorting again on that date.
+        self._add_unknown_products(validity.starting_after(on_date),
+                unknown_products, self.future_products)
+        # Check if entitlement has already expired:
+        self._add_unknown_products(validity.expired_before(on_date),
+                unknown_products, self.expired_products)
 
+    def _add_unknown_products(self, ent_certs, unknown_products, product_dict):
+        for ent_cert in ent_certs:
+            for product in ent_cert.products:
+                if product.id in unknown_products:
                     product_dict.setdefault(product.id, []).append(ent_cert)
 
     def get_system_status(self):
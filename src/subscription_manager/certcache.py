@@ -0,0 +1,404 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Persistent on-disk cache of parsed certificates.
+
+Parsing certificates (v3 entitlement certificates in particular) is
+expensive, and nearly every subscription-manager, yum plugin and
+rhsmcertd-worker run lists the same, mostly unchanged, certificate
+directories. The cache stores the fields we use from each parsed
+certificate, keyed on the file's inode, size and mtime, so unchanged
+files can be rebuilt without touching the PEM.
+
+Certificates rebuilt from the cache are lazy: their header is restored
+up front, their products, order, pool and content on first access. Their
+content is made of compactcontent.CompactContent. They carry no x509
+object or PEM text, callers needing those must parse the file with
+create_from_file.
+"""
+
+import calendar
+from datetime import datetime
+import logging
+import os
+import tempfile
+import threading
+
+from rhsm.certificate import GMT
+from rhsm.certificate2 import EntitlementCertificate, ProductCertificate, \
+        Product, Order, Pool, Version
+from rhsm import ourjson as json
+
+from subscription_manager.compactcontent import CompactContent, content_to_dict
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+# Bump this whenever the layout of a cached certificate changes, caches
+# written with another version are discarded and rebuilt.
+CACHE_VERSION = 2
+
+ENTITLEMENT_TYPE = "entitlement"
+PRODUCT_TYPE = "product"
+
+
+def file_signature(path):
+    """
+    Return the (inode, size, mtime) tuple used to detect modified files.
+
+    Raises OSError if the file can not be stat'ed.
+    """
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def _to_timestamp(date):
+    if date is None:
+        return None
+    return calendar.timegm(date.utctimetuple())
+
+
+def _from_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, GMT())
+
+
+def _obj_to_dict(obj):
+    if obj is None:
+        return None
+    return dict(vars(obj))
+
+
+def _obj_from_dict(cls, obj_dict):
+    """
+    Rebuild a Product/Order/Content/Pool from its attributes.
+
+    The constructors normalize their arguments, the cached attributes
+    already are, so we skip them and restore the attributes as they were.
+    """
+    if obj_dict is None:
+        return None
+    obj = cls.__new__(cls)
+    obj.__dict__.update(obj_dict)
+    return obj
+
+
+def _list_to_dicts(objs):
+    if objs is None:
+        return None
+    return [_obj_to_dict(obj) for obj in objs]
+
+
+def _list_from_dicts(cls, obj_dicts):
+    if obj_dicts is None:
+        return None
+    return [_obj_from_dict(cls, obj_dict) for obj_dict in obj_dicts]
+
+
+def _contents_to_dicts(contents):
+    if contents is None:
+        return None
+    return [content_to_dict(content) for content in contents]
+
+
+def _contents_from_dicts(content_dicts):
+    if content_dicts is None:
+        return None
+    return [CompactContent.from_fields(content_dict) for content_dict in content_dicts]
+
+
+# The lazily decoded certificate fields, mapped to the functions that
+# encode and decode their JSON serializable form:
+LAZY_FIELDS = {
+    'products': (_list_to_dicts, lambda dicts: _list_from_dicts(Product, dicts)),
+    'order': (_obj_to_dict, lambda obj_dict: _obj_from_dict(Order, obj_dict)),
+    'pool': (_obj_to_dict, lambda obj_dict: _obj_from_dict(Pool, obj_dict)),
+    'content': (_contents_to_dicts, _contents_from_dicts),
+}
+
+
+class _LazyField(object):
+    """
+    Descriptor decoding a certificate field from its cached JSON text on
+    first access. Assigning the field replaces the cached text.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, cert, owner):
+        if cert is None:
+            return self
+        if self.name not in cert.__dict__:
+            # Another thread may be decoding this too, only drop the text
+            # once the value is in place so one of us always finds it:
+            encoded = cert._encoded.get(self.name)
+            if encoded is not None:
+                decode = LAZY_FIELDS[self.name][1]
+                cert.__dict__.setdefault(self.name, decode(json.loads(encoded)))
+                cert._encoded.pop(self.name, None)
+        return cert.__dict__[self.name]
+
+    def __set__(self, cert, value):
+        cert._encoded.pop(self.name, None)
+        cert.__dict__[self.name] = value
+
+
+class LazyProductCertificate(ProductCertificate):
+    """
+    Product certificate rebuilt from the cache, the header (serial,
+    validity, path) is restored up front and products on first access.
+    """
+    products = _LazyField('products')
+
+
+class LazyEntitlementCertificate(EntitlementCertificate):
+    """
+    Entitlement certificate rebuilt from the cache, the header (serial,
+    validity, path) is restored up front, products, order, pool and
+    content are each decoded on first access.
+
+    Most callers only look at the header, and the content of a v3
+    certificate can run to thousands of entries.
+    """
+    products = _LazyField('products')
+    order = _LazyField('order')
+    pool = _LazyField('pool')
+    content = _LazyField('content')
+
+
+def _encode_field(cert, name):
+    # A lazy certificate's undecoded fields are already encoded:
+    encoded = getattr(cert, '_encoded', {})
+    if name in encoded:
+        return encoded[name]
+    encode = LAZY_FIELDS[name][0]
+    return json.dumps(encode(getattr(cert, name)))
+
+
+def cert_to_dict(cert):
+    """
+    Return a JSON serializable dict of the fields we use from a parsed
+    certificate, or None if we do not know how to cache this type.
+
+    The header fields are stored as is, the lazily decoded fields as JSON
+    text so loading the cache does not build their objects.
+    """
+    if isinstance(cert, EntitlementCertificate):
+        cert_type = ENTITLEMENT_TYPE
+        fields = ['products', 'order', 'pool', 'content']
+    elif isinstance(cert, ProductCertificate):
+        cert_type = PRODUCT_TYPE
+        fields = ['products']
+    else:
+        return None
+
+    cert_dict = {
+        'type': cert_type,
+        'version': cert.version and str(cert.version),
+        'serial': cert.serial,
+        'start': _to_timestamp(cert.start),
+        'end': _to_timestamp(cert.end),
+        'subject': cert.subject,
+        'issuer': getattr(cert, 'issuer', None),
+    }
+    for name in fields:
+        cert_dict[name] = _encode_field(cert, name)
+    return cert_dict
+
+
+def cert_from_dict(cert_dict, path):
+    """
+    Rebuild a lazy certificate object from the output of cert_to_dict.
+    """
+    version = None
+    if cert_dict['version']:
+        version = Version(cert_dict['version'])
+
+    if cert_dict['type'] == ENTITLEMENT_TYPE:
+        cls = LazyEntitlementCertificate
+        fields = ['products', 'order', 'pool', 'content']
+    else:
+        cls = LazyProductCertificate
+        fields = ['products']
+
+    # The field descriptors need _encoded while the constructor runs, it
+    # assigns defaults to them which we then drop:
+    cert = cls.__new__(cls)
+    cert._encoded = {}
+    cert.__init__(path=path, version=version, serial=cert_dict['serial'],
+                  start=_from_timestamp(cert_dict['start']),
+                  end=_from_timestamp(cert_dict['end']),
+                  subject=cert_dict['subject'])
+    for name in fields:
+        cert.__dict__.pop(name, None)
+        cert._encoded[name] = cert_dict[name]
+
+    # Not a constructor argument in every version of python-rhsm:
+    cert.issuer = cert_dict['issuer']
+    return cert
+
+
+class CertificateCache(object):
+    """
+    Cache of the parsed certificates in one directory.
+
+    Maps certificate file names to the file signature they were parsed
+    with, and the serialized certificate. Entries whose signature no longer
+    matches the file on disk are ignored, and replaced once the caller
+    has re-parsed the file.
+
+    Directories are shared by threads, so changes to the entries and
+    saving them are done holding a lock.
+    """
+
+    def __init__(self, cache_file, dir_path):
+        self.cache_file = cache_file
+        self.dir_path = dir_path
+        self.entries = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        Load the cache from disk. A missing, unreadable or outdated cache
+        is treated as empty and rebuilt on the next save.
+        """
+        self._lock.acquire()
+        try:
+            self.entries = self._read()
+            self._dirty = False
+        finally:
+            self._lock.release()
+
+    def _read(self):
+        entries = {}
+        if not os.path.exists(self.cache_file):
+            return entries
+
+        try:
+            f = open(self.cache_file)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            log.debug("Ignoring unreadable certificate cache %s: %s" %
+                    (self.cache_file, e))
+            return entries
+
+        if data.get('version') != CACHE_VERSION or \
+                data.get('path') != self.dir_path:
+            log.debug("Ignoring outdated certificate cache: %s" %
+                    self.cache_file)
+            return entries
+
+        for filename, entry in data.get('certs', {}).items():
+            entries[filename] = (tuple(entry['signature']), entry['cert'])
+        return entries
+
+    def _ensure_loaded(self):
+        self._lock.acquire()
+        try:
+            if self.entries is None:
+                self.load()
+        finally:
+            self._lock.release()
+
+    def lookup(self, filename, signature):
+        """
+        Return the cached certificate for filename, or None if it is not
+        cached or the file has changed since it was.
+        """
+        self._ensure_loaded()
+        entry = self.entries.get(filename)
+        if entry is None or entry[0] != signature:
+            return None
+        try:
+            return cert_from_dict(entry[1], os.path.join(self.dir_path, filename))
+        except Exception, e:
+            log.debug("Ignoring bad certificate cache entry %s: %s" %
+                    (filename, e))
+            return None
+
+    def store(self, filename, signature, cert):
+        """ Cache a freshly parsed certificate. """
+        self._ensure_loaded()
+        cert_dict = cert_to_dict(cert)
+        if cert_dict is None:
+            return
+        self._lock.acquire()
+        try:
+            self.entries[filename] = (signature, cert_dict)
+            self._dirty = True
+        finally:
+            self._lock.release()
+
+    def prune(self, filenames):
+        """ Drop entries for files no longer in the directory. """
+        self._ensure_loaded()
+        self._lock.acquire()
+        try:
+            for filename in set(self.entries) - set(filenames):
+                del self.entries[filename]
+                self._dirty = True
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """
+        Write the cache to disk if it changed. Failing to write only costs
+        us a re-parse next time, so errors are logged and ignored.
+        """
+        self._lock.acquire()
+        try:
+            if not self._dirty:
+                return
+            self._write()
+        finally:
+            self._lock.release()
+
+    def _write(self):
+        data = {
+            'version': CACHE_VERSION,
+            'path': self.dir_path,
+            'certs': dict((filename, {'signature': list(signature), 'cert': cert_dict})
+                          for filename, (signature, cert_dict) in self.entries.items()),
+        }
+
+        try:
+            cache_dir = os.path.dirname(self.cache_file)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # Write to a temp file and rename it into place, so readers
+            # never see a partially written cache:
+            fd, tmp_path = tempfile.mkstemp(prefix='.', dir=cache_dir)
+            try:
+                f = os.fdopen(fd, 'w')
+                try:
+                    json.dump(data, f)
+                finally:
+                    f.close()
+                os.chmod(tmp_path, 0644)
+                os.rename(tmp_path, self.cache_file)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+            self._dirty = False
+            log.debug("Wrote certificate cache: %s" % self.cache_file)
+        except (IOError, OSError, TypeError, ValueError), e:
+            log.debug("Unable to write certificate cache %s: %s" %
+                    (self.cache_file, e))
@@ -15,12 +15,25 @@
 # in this software or its documentation.
 #
 
+from bisect import bisect_left, bisect_right
+import calendar
+from datetime import datetime
 import gettext
+import glob
 import logging
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
+import time
 
 from rhsm.certificate import Key, create_from_file
 from rhsm.config import initConfig
+from subscription_manager.certcache import CertificateCache, cert_to_dict, \
+        cert_from_dict, file_signature
+from subscription_manager.compactcontent import clear_shared, \
+        compact_certificate
 from subscription_manager.injection import require, ENT_DIR
 
 log = logging.getLogger('rhsm-app.' + __name__)
@@ -29,6 +42,14 @@ _ = gettext.gettext
 
 cfg = initConfig()
 
+# BatchWriter stages files in a directory next to the one they are for,
+# named after it with this suffix and a random part:
+STAGING_SUFFIX = '.staging-'
+
+# Staging directories older than this are assumed to be left over from
+# a writer which died:
+STAGING_TIMEOUT = 60
+
 
 class Directory(object):
 
@@ -95,81 +116,464 @@ class Directory(object):
         return self.path
 
 
+def _get_parse_workers():
+    """
+    Number of processes to parse certificates with, 0 or 1 to parse them
+    serially (the default).
+    """
+    if not cfg.has_option('rhsm', 'cert_parse_workers'):
+        return 0
+    try:
+        return cfg.get_int('rhsm', 'cert_parse_workers') or 0
+    except ValueError:
+        log.warn("Ignoring invalid cert_parse_workers setting")
+        return 0
+
+
+def _parse_cert_file(path):
+    """
+    Parse a certificate in a worker process.
+
+    Certificates hold an x509 object which can not be pickled back to the
+    parent, so this returns the serialized form used by the persistent
+    cache instead, or None if the certificate could not be parsed.
+    """
+    try:
+        return cert_to_dict(create_from_file(path))
+    except (Exception, SystemExit):
+        # The parent will parse it again and report the error:
+        return None
+
+
+def _stacking_id(cert):
+    # Product certificates have no order:
+    order = getattr(cert, 'order', None)
+    if order:
+        return order.stacking_id
+    return None
+
+
+def _timestamp(on_date=None):
+    """
+    Return on_date, or now, in seconds since the epoch. Naive dates are
+    taken to be in UTC, as Certificate.is_valid does.
+    """
+    if on_date is None:
+        on_date = datetime.utcnow()
+    return calendar.timegm(on_date.utctimetuple()) + on_date.microsecond / 1000000.0
+
+
+class ValidityIndex(object):
+    """
+    Interval index over the validity ranges of a certificate listing.
+
+    Answers which certificates are valid on, expired before, starting
+    after or expiring within some days of a date in logarithmic time
+    (plus the size of the answer), rather than checking every
+    certificate. Results are in listing order. Dates are compared as
+    Certificate.is_valid and friends do, both ends of the range included,
+    and default to now.
+
+    Ranges are kept as timestamps, comparing timezone aware datetimes
+    calls back into their tzinfo every time.
+    """
+
+    def __init__(self, listing):
+        self.listing = listing
+        intervals = [(_timestamp(c.valid_range.begin()),
+                      _timestamp(c.valid_range.end()), i)
+                     for i, c in enumerate(listing)]
+
+        by_begin = sorted(intervals)
+        self._begins = [interval[0] for interval in by_begin]
+        self._by_begin = [interval[2] for interval in by_begin]
+
+        by_end = sorted(intervals, key=lambda interval: (interval[1], interval[2]))
+        self._ends = [interval[1] for interval in by_end]
+        self._by_end = by_end
+
+        self._tree = self._build(by_begin)
+
+    def _build(self, intervals):
+        """
+        Build a centered interval tree over intervals, sorted by begin.
+
+        Each node holds the intervals containing its center, sorted by
+        begin and by descending end, those entirely before the center go
+        to the left subtree and those entirely after to the right.
+        """
+        if not intervals:
+            return None
+        # The median begin leaves at most half the intervals on each side:
+        center = intervals[len(intervals) // 2][0]
+
+        left, here, right = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        by_end_desc = sorted(here, key=lambda interval: interval[1], reverse=True)
+        return (center, here, by_end_desc, self._build(left), self._build(right))
+
+    def _certs(self, positions):
+        return [self.listing[i] for i in sorted(positions)]
+
+    def valid_at(self, on_date=None):
+        """ Certificates whose validity range includes on_date. """
+        on_date = _timestamp(on_date)
+        positions = []
+        node = self._tree
+        while node is not None:
+            center, by_begin, by_end_desc, left, right = node
+            if on_date < center:
+                for begin, end, i in by_begin:
+                    if begin > on_date:
+                        break
+                    positions.append(i)
+                node = left
+            elif on_date > center:
+                for begin, end, i in by_end_desc:
+                    if end < on_date:
+                        break
+                    positions.append(i)
+                node = right
+            else:
+                positions.extend([interval[2] for interval in by_begin])
+                break
+        return self._certs(positions)
+
+    def expired_before(self, on_date=None):
+        """ Certificates which ended before on_date. """
+        last = bisect_left(self._ends, _timestamp(on_date))
+        return self._certs([interval[2] for interval in self._by_end[:last]])
+
+    def starting_after(self, on_date=None):
+        """ Certificates which only become valid after on_date. """
+        first = bisect_right(self._begins, _timestamp(on_date))
+        return self._certs(self._by_begin[first:])
+
+    def expiring_within(self, days, on_date=None):
+        """
+        Certificates valid on on_date which end less than days after it.
+        """
+        on_date = _timestamp(on_date)
+        first = bisect_left(self._ends, on_date)
+        last = bisect_left(self._ends, on_date + days * 24 * 60 * 60)
+        return self._certs([i for begin, end, i in self._by_end[first:last]
+                            if begin <= on_date])
+
+
+class CertificateIndex(object):
+    """
+    Hash lookups over a certificate listing: serial to certificate, and
+    product ID or stacking ID to the certificates carrying it, both in
+    listing order.
+
+    Each lookup is built on first use, so callers only interested in
+    serials never touch the products or order of a certificate.
+    """
+
+    def __init__(self, listing):
+        self.listing = listing
+        self._size = len(listing)
+        self._by_serial = None
+        self._by_product = None
+        self._by_stacking_id = None
+        self._by_validity = None
+
+    @property
+    def by_serial(self):
+        if self._by_serial is None:
+            by_serial = {}
+            for cert in self.listing:
+                # Like a linear scan, the first match wins:
+                by_serial.setdefault(cert.serial, cert)
+            self._by_serial = by_serial
+        return self._by_serial
+
+    @property
+    def by_product(self):
+        if self._by_product is None:
+            by_product = {}
+            for cert in self.listing:
+                for product in cert.products:
+                    by_product.setdefault(product.id, []).append(cert)
+            self._by_product = by_product
+        return self._by_product
+
+    @property
+    def by_stacking_id(self):
+        if self._by_stacking_id is None:
+            by_stacking_id = {}
+            for cert in self.listing:
+                stacking_id = _stacking_id(cert)
+                if stacking_id:
+                    by_stacking_id.setdefault(stacking_id, []).append(cert)
+            self._by_stacking_id = by_stacking_id
+        return self._by_stacking_id
+
+    @property
+    def by_validity(self):
+        if self._by_validity is None:
+            self._by_validity = ValidityIndex(self.listing)
+        return self._by_validity
+
+    def is_current(self, listing):
+        # The length check catches callers appending to the listing:
+        return listing is self.listing and len(listing) == self._size
+
+
 class CertificateDirectory(Directory):
 
     KEY = 'key.pem'
 
+    # The index is built from whatever list() returns, so also default it
+    # here for subclasses (stubs) that skip our __init__:
+    _index = None
+
+    # Action invokers running at the same time share a directory, the
+    # lock keeps one of them scanning it at a time:
+    _lock = threading.RLock()
+
+    # Names of the key files found by the last scan, None until we scan:
+    _key_files = None
+    _entries = None
+
+    # Subclasses can set this to persist parsed certificates between runs,
+    # see certcache.CertificateCache.
+    CACHE_FILE = None
+
+    # Fewest certificates worth starting a process pool for:
+    PARALLEL_PARSE_MIN = 32
+
     def __init__(self, path):
         super(CertificateDirectory, self).__init__(path)
         self.create()
         self._listing = None
+        self._index = None
+        self._lock = threading.RLock()
+        self._parse_workers = _get_parse_workers()
+        # Maps file name to the (signature, cert) it was last loaded with:
+        self._entries = {}
+        self._cache = None
+        if self.CACHE_FILE:
+            self._cache = CertificateCache(self.CACHE_FILE, self.path)
 
     def refresh(self):
-        # simply clear the cache. the next list() will reload.
+        # The next list() will rescan the directory, only loading the
+        # certificates which were added or modified since the last scan.
         self._listing = None
 
     def list(self):
-        if self._listing is not None:
+        listing = self._listing
+        if listing is not None:
+            return listing
+        self._lock.acquire()
+        try:
+            if self._listing is None:
+                self._listing = self._scan()
             return self._listing
+        finally:
+            self._lock.release()
+
+    def _scan(self):
+        """
+        Diff the directory against the previous scan by file name and stat
+        data, re-using certificates which have not changed, loading those
+        which were added or modified, and dropping those which were deleted.
+        """
+        names = []
         listing = []
+        unparsed = []
+        key_files = set()
         for p, fn in Directory.list(self):
-            if not fn.endswith('.pem') or fn.endswith(self.KEY):
+            if fn.endswith(self.KEY):
+                key_files.add(fn)
                 continue
-            path = self.abspath(fn)
-            listing.append(create_from_file(path))
-        self._listing = listing
+            if not fn.endswith('.pem'):
+                continue
+            try:
+                signature = file_signature(self.abspath(fn))
+            except OSError:
+                # Let the parser report the problem as usual:
+                signature = None
+
+            cert = self._lookup(fn, signature)
+            if cert is None:
+                unparsed.append(len(listing))
+            names.append((fn, signature))
+            listing.append(cert)
+
+        parsed = self._parse([self.abspath(names[i][0]) for i in unparsed])
+        for i, cert in zip(unparsed, parsed):
+            listing[i] = cert
+            fn, signature = names[i]
+            if self._cache and signature is not None:
+                self._cache.store(fn, signature, cert)
+
+        self._entries = dict((fn, (signature, cert))
+                             for (fn, signature), cert in zip(names, listing))
+        self._key_files = key_files
+        if self._cache:
+            self._cache.prune(self._entries.keys())
+            self._cache.save()
+        # The certificates loaded above share what they can, keeping the
+        # copies around after that would keep those of every certificate
+        # ever loaded:
+        clear_shared()
         return listing
 
-    def list_valid(self):
-        valid = []
-        for c in self.list():
-            if c.is_valid():
-                valid.append(c)
-        return valid
+    def _lookup(self, filename, signature):
+        """
+        Return the already parsed certificate for filename, from the last
+        scan or the persistent cache, or None if it needs parsing.
+        """
+        if signature is None:
+            return None
 
-    def list_expired(self):
-        expired = []
-        for c in self.list():
-            if c.is_expired():
-                expired.append(c)
-        return expired
+        entry = self._entries.get(filename)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
 
-    def find(self, sn):
-        # TODO: could optimize to just load SERIAL.pem? Maybe not in all cases.
-        for c in self.list():
-            if c.serial == sn:
-                return c
+        if self._cache:
+            return self._cache.lookup(filename, signature)
         return None
 
+    def _parse(self, paths):
+        """
+        Parse the certificates at paths, in order. Large batches are spread
+        over a process pool if cert_parse_workers is configured, anything
+        the pool did not return is parsed here so errors surface as usual.
+        """
+        results = [None] * len(paths)
+        if self._parse_workers > 1 and len(paths) >= self.PARALLEL_PARSE_MIN:
+            results = self._parse_parallel(paths)
+        return [cert or compact_certificate(create_from_file(path))
+                for path, cert in zip(paths, results)]
+
+    def _parse_parallel(self, paths):
+        workers = min(self._parse_workers, len(paths))
+        try:
+            pool = multiprocessing.Pool(workers)
+        except (OSError, ImportError), e:
+            log.debug("Unable to start certificate parsing pool: %s" % e)
+            return [None] * len(paths)
+
+        try:
+            cert_dicts = pool.map(_parse_cert_file, paths,
+                                  max(1, len(paths) // (workers * 4)))
+            pool.close()
+        except Exception, e:
+            pool.terminate()
+            log.debug("Parallel certificate parsing failed: %s" % e)
+            cert_dicts = [None] * len(paths)
+        pool.join()
+
+        log.debug("Parsed %s certificates with %s workers" % (len(paths), workers))
+        return [cert_dict and cert_from_dict(cert_dict, path)
+                for path, cert_dict in zip(paths, cert_dicts)]
+
+    def add_written(self, certs):
+        """
+        Add certificates just written to this directory to the listing,
+        as already parsed, see BatchWriter.
+        """
+        self._lock.acquire()
+        try:
+            if self._entries is not None:
+                for cert in certs:
+                    dir_path, filename = os.path.split(cert.path)
+                    if dir_path != os.path.normpath(self.path):
+                        continue
+                    try:
+                        signature = file_signature(cert.path)
+                    except OSError:
+                        continue
+                    self._entries[filename] = (signature, compact_certificate(cert))
+                    if self._cache:
+                        self._cache.store(filename, signature, cert)
+            self.refresh()
+        finally:
+            self._lock.release()
+
+    @classmethod
+    def delete_cache(cls):
+        """ Delete the persistent cache of parsed certificates. """
+        if cls.CACHE_FILE and os.path.exists(cls.CACHE_FILE):
+            log.info("Deleting cache: %s" % cls.CACHE_FILE)
+            os.remove(cls.CACHE_FILE)
+
+    def list_valid(self, on_date=None):
+        """ Certificates valid on on_date, defaults to now. """
+        return self.get_validity_index().valid_at(on_date)
+
+    def list_expired(self, on_date=None):
+        """ Certificates expired on on_date, defaults to now. """
+        return self.get_validity_index().expired_before(on_date)
+
+    def list_future(self, on_date=None):
+        """ Certificates not yet valid on on_date, defaults to now. """
+        return self.get_validity_index().starting_after(on_date)
+
+    def list_expiring(self, days, on_date=None):
+        """
+        Certificates valid on on_date, defaults to now, which expire
+        within the given number of days.
+        """
+        return self.get_validity_index().expiring_within(days, on_date)
+
+    def get_validity_index(self):
+        """ Return the ValidityIndex for the current listing. """
+        return self._get_index().by_validity
+
+    def _get_index(self):
+        """
+        Return the CertificateIndex for the current listing, building it
+        once per listing so a refresh brings it back in sync.
+        """
+        self._lock.acquire()
+        try:
+            listing = self.list()
+            if self._index is None or not self._index.is_current(listing):
+                self._index = CertificateIndex(listing)
+            return self._index
+        finally:
+            self._lock.release()
+
+    def find(self, sn):
+        return self._get_index().by_serial.get(sn)
+
     def find_all_by_product(self, p_hash):
-        certs = set()
-        providing_stack_ids = set()
-        stack_id_map = {}
-        for c in self.list():
-            for p in c.products:
-                if p.id == p_hash:
-                    certs.add(c)
-                    # Keep track of stacks that provide our product
-                    if (c.order and c.order.stacking_id):
-                        providing_stack_ids.add(c.order.stacking_id)
-
-            # Keep track of stack ids in case we need them later.  avoids another loop
-            if (c.order and c.order.stacking_id):
-                if c.order.stacking_id not in stack_id_map:
-                    stack_id_map[c.order.stacking_id] = set()
-                stack_id_map[c.order.stacking_id].add(c)
-
-        # Complete
-        for stack_id in providing_stack_ids:
-            certs |= stack_id_map[stack_id]
-
-        return list(certs)
+        index = self._get_index()
+        certs = []
+        seen = set()
+
+        def add(cert):
+            if cert not in seen:
+                seen.add(cert)
+                certs.append(cert)
+
+        providing = index.by_product.get(p_hash, [])
+        for c in providing:
+            add(c)
+
+        # Complete with the other certs in stacks that provide our product,
+        # in listing order like the rest:
+        for c in providing:
+            stacking_id = _stacking_id(c)
+            if stacking_id:
+                for stacked in index.by_stacking_id[stacking_id]:
+                    add(stacked)
+
+        return certs
 
     def find_by_product(self, p_hash):
-        for c in self.list():
-            for p in c.products:
-                if p.id == p_hash:
-                    return c
+        certs = self._get_index().by_product.get(p_hash)
+        if certs:
+            return certs[0]
         return None
 
     #Set up an alias for backwards compatibility
@@ -179,6 +583,7 @@ class CertificateDirectory(Directory):
 class ProductDirectory(CertificateDirectory):
 
     PATH = cfg.get('rhsm', 'productCertDir')
+    CACHE_FILE = "/var/lib/rhsm/cache/product_certs.json"
 
     def __init__(self):
         super(ProductDirectory, self).__init__(self.PATH)
@@ -209,6 +614,7 @@ class EntitlementDirectory(CertificateDirectory):
 
     PATH = cfg.get('rhsm', 'entitlementCertDir')
     PRODUCT = 'product'
+    CACHE_FILE = "/var/lib/rhsm/cache/entitlement_certs.json"
 
     @classmethod
     def productpath(cls):
@@ -217,17 +623,52 @@ class EntitlementDirectory(CertificateDirectory):
     def __init__(self):
         super(EntitlementDirectory, self).__init__(self.productpath())
 
+    def _scan(self):
+        listing = super(EntitlementDirectory, self)._scan()
+        self._migrate_keys(listing)
+        return listing
+
+    def _migrate_keys(self, listing):
+        """
+        Write the old style key (key.pem) out in the new style
+        (SERIAL-key.pem) for each certificate missing a key of its own.
+
+        Runs once per scan, see bz #711133.
+        """
+        if self.KEY not in self._key_files:
+            return
+        old_key_path = self.abspath(self.KEY)
+        if not os.access(old_key_path, os.R_OK):
+            return
+
+        key = None
+        for cert in listing:
+            key_filename = os.path.basename(cert.key_path())
+            if key_filename in self._key_files:
+                continue
+            if key is None:
+                key = Key.read(old_key_path)
+            # Re-parse the cert as one loaded from the cache has no PEM
+            # to write:
+            Writer().write(key, create_from_file(cert.path))
+            self._key_files.add(key_filename)
+
     def _check_key(self, cert):
         """
-        If the new key file (SERIAL-key.pem) does not exist, check for
-        the old style (key.pem), and if found write it out as the new style.
+        Return false if there is no key for this certificate.
 
-        Return false if neither is found, indicating we have no key for this
-        certificate.
+        Certificates from our listing are checked against the key files
+        found by the scan which loaded them, any others on disk: if the new
+        key file (SERIAL-key.pem) does not exist, check for the old style
+        (key.pem), and if found write it out as the new style.
 
         See bz #711133.
         """
         key_path = cert.key_path()
+        if self._key_files is not None and \
+                os.path.dirname(key_path) == os.path.normpath(self.path):
+            return os.path.basename(key_path) in self._key_files
+
         if not os.access(key_path, os.R_OK):
             # read key from old key path
             old_key_path = "%s/key.pem" % self.path
@@ -237,23 +678,23 @@ class EntitlementDirectory(CertificateDirectory):
             if not os.access(old_key_path, os.R_OK):
                 return False
 
-            # write the key/cert out again in new style format
+            # write the key/cert out again in new style format, re-parse
+            # the cert as one loaded from the cache has no PEM to write:
             key = Key.read(old_key_path)
-            cert_writer = Writer(self)
-            cert_writer.write(key, cert)
+            cert_writer = Writer()
+            cert_writer.write(key, create_from_file(cert.path))
         return True
 
-    def list_valid(self):
+    def list_valid(self, on_date=None):
         valid = []
-        for c in self.list():
+        for c in super(EntitlementDirectory, self).list_valid(on_date):
 
             # If something is amiss with the key for this certificate, consider
             # it invalid:
             if not self._check_key(c):
                 continue
 
-            if c.is_valid():
-                valid.append(c)
+            valid.append(c)
 
         return valid
 
@@ -262,12 +703,7 @@ class EntitlementDirectory(CertificateDirectory):
         Returns all entitlement certificates providing access to the given
         product ID.
         """
-        entitlements = []
-        for cert in self.list():
-            for cert_product in cert.products:
-                if product_id == cert_product.id:
-                    entitlements.append(cert)
-        return entitlements
+        return list(self._get_index().by_product.get(product_id, []))
 
 
 class Path:
@@ -294,19 +730,125 @@ class Path:
         return os.path.isdir(path)
 
 
-class Writer:
+def remove_stale_staging(path):
+    """
+    Remove the staging directories of path left over by writers which
+    died, see STAGING_TIMEOUT.
+    """
+    for staging_dir in glob.glob(os.path.normpath(path) + STAGING_SUFFIX + '*'):
+        try:
+            if time.time() - os.path.getmtime(staging_dir) < STAGING_TIMEOUT:
+                continue
+        except OSError:
+            # Committed while we were looking:
+            continue
+        log.info("Removing stale staging directory: %s" % staging_dir)
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
-    def __init__(self):
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BatchWriter(object):
+    """
+    Write entitlement certificates and keys as one batch.
+
+    Files are written to a staging directory next to the entitlement
+    directory, and only synced and renamed into place, keys ahead of
+    their certificates, when the batch is committed. The file monitor
+    holds off while a staging directory exists, so a batch shows up as a
+    single change.
+    """
+
+    def __init__(self, path=None):
         self.ent_dir = require(ENT_DIR)
+        if path is None:
+            path = Path.abs(self.ent_dir.productpath())
+        self.path = os.path.normpath(path)
+        self._staging_dir = None
+        self._filenames = []
+        self._certs = []
+
+    def _stage_path(self, filename):
+        if self._staging_dir is None:
+            remove_stale_staging(self.path)
+            self._staging_dir = tempfile.mkdtemp(
+                    prefix=os.path.basename(self.path) + STAGING_SUFFIX,
+                    dir=os.path.dirname(self.path))
+        self._filenames.append(filename)
+        return os.path.join(self._staging_dir, filename)
 
     def write(self, key, cert):
+        """ Stage a certificate and its key, named after its serial. """
         serial = cert.serial
-        ent_dir_path = self.ent_dir.productpath()
+        key.write(self._stage_path('%s-key.pem' % str(serial)))
+        cert.write(self._stage_path('%s.pem' % str(serial)))
+        self._certs.append(cert)
+
+    def write_pem(self, filename, content):
+        """ Stage a certificate or key from its PEM text. """
+        f = open(self._stage_path(filename), 'w')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+
+    def commit(self):
+        """
+        Move the staged files into place, and hand the staged certificates
+        to the entitlement directory so it does not parse them again.
+        """
+        if self._staging_dir is None:
+            return
+
+        # Keys first, so no certificate shows up without its key:
+        filenames = sorted(set(self._filenames),
+                           key=lambda filename: not filename.endswith('-key.pem'))
+        certs = self._certs
+        try:
+            for filename in filenames:
+                _fsync_path(os.path.join(self._staging_dir, filename))
+            for filename in filenames:
+                os.rename(os.path.join(self._staging_dir, filename),
+                          os.path.join(self.path, filename))
+            try:
+                _fsync_path(self.path)
+            except OSError, e:
+                # Not every filesystem can sync a directory:
+                log.debug("Unable to sync %s: %s" % (self.path, e))
+        finally:
+            self.abort()
+
+        for cert in certs:
+            cert.path = os.path.join(self.path, os.path.basename(cert.path))
+        log.debug("Wrote %s files to %s" % (len(filenames), self.path))
+        self.ent_dir.add_written(certs)
+
+    def abort(self):
+        """ Discard anything staged and not yet committed. """
+        if self._staging_dir is not None:
+            shutil.rmtree(self._staging_dir, ignore_errors=True)
+            self._staging_dir = None
+        self._filenames = []
+        self._certs = []
 
-        key_filename = '%s-key.pem' % str(serial)
-        key_path = Path.join(ent_dir_path, key_filename)
-        key.write(key_path)
 
-        cert_filename = '%s.pem' % str(serial)
-        cert_path = Path.join(ent_dir_path, cert_filename)
-        cert.write(cert_path)
+class Writer:
+
+    def __init__(self):
+        self.ent_dir = require(ENT_DIR)
+
+    def write(self, key, cert):
+        # A batch of one, so the key and cert show up together:
+        batch_writer = BatchWriter()
+        try:
+            batch_writer.write(key, cert)
+            batch_writer.commit()
+        except Exception:
+            batch_writer.abort()
+            raise
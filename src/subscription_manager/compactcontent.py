@@ -0,0 +1,161 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Compact representation of entitlement certificate content sets.
+
+Entitlement certificates for the larger SKUs carry thousands of content
+sets each, and every long running process holds all of them. Most of
+their fields repeat from one content set to the next: types, vendors,
+GPG URLs, required tags, and the leading part of their URLs. Content
+sets are converted to slotted CompactContent records sharing a single
+copy of each of those.
+
+The shared copies are forgotten by clear_shared, which certificate
+directories call once they have scanned. Content built since keeps the
+copies it has, but nothing else keeps them alive.
+"""
+
+from rhsm.certificate2 import Content
+
+# Content attributes, as taken by the Content constructor:
+CONTENT_FIELDS = ('content_type', 'name', 'label', 'vendor', 'url', 'gpg',
+                  'enabled', 'metadata_expire', 'required_tags', 'arches')
+
+# Shared strings, tag and arch tuples, and URL prefixes, found in the
+# certificates loaded since the last clear_shared. Neither strings nor
+# tuples can be weakly referenced:
+_strings = {}
+_tuples = {}
+
+
+def share_string(value):
+    """
+    Return the shared copy of a string equal to value. Unlike intern()
+    this works for unicode, which is what certificates decode to.
+    """
+    if not isinstance(value, basestring):
+        return value
+    return _strings.setdefault(value, value)
+
+
+def share_tuple(values):
+    """ Return the shared tuple of the (shared) strings in values. """
+    if not values:
+        return ()
+    values = tuple(values)
+    shared = _tuples.get(values)
+    if shared is None:
+        shared = tuple([share_string(value) for value in values])
+        _tuples[shared] = shared
+    return shared
+
+
+def clear_shared():
+    """ Forget the shared strings and tuples. """
+    _strings.clear()
+    _tuples.clear()
+
+
+class CompactContent(Content):
+    """
+    A Content keeping its fields in slots, with shared copies of its
+    repeated strings. Content itself has no __slots__, so instances still
+    have a __dict__ slot, but it is never filled.
+
+    The URL is kept as a shared prefix, up to and including the last
+    '/', and a shared last path component. Required tags and arches are
+    shared tuples.
+    """
+    __slots__ = ('content_type', 'name', 'label', 'vendor', '_url_prefix',
+                 '_url_suffix', 'gpg', 'enabled', 'metadata_expire',
+                 'required_tags', 'arches')
+
+    def _get_url(self):
+        if self._url_suffix is None:
+            return self._url_prefix
+        return self._url_prefix + self._url_suffix
+
+    def _set_url(self, url):
+        if not url:
+            self._url_prefix = url
+            self._url_suffix = None
+            return
+        split = url.rfind('/') + 1
+        self._url_prefix = share_string(url[:split])
+        self._url_suffix = share_string(url[split:])
+
+    url = property(_get_url, _set_url)
+
+    @classmethod
+    def _build(cls, get):
+        # get(name) returns the value of one of the CONTENT_FIELDS:
+        content = cls.__new__(cls)
+        content.content_type = share_string(get('content_type'))
+        content.name = get('name')
+        content.label = get('label')
+        content.vendor = share_string(get('vendor'))
+        content.url = get('url')
+        content.gpg = share_string(get('gpg'))
+        content.enabled = get('enabled')
+        content.metadata_expire = share_string(get('metadata_expire'))
+        content.required_tags = share_tuple(get('required_tags'))
+        content.arches = share_tuple(get('arches'))
+        return content
+
+    @classmethod
+    def from_fields(cls, fields):
+        """
+        Build from a dict of CONTENT_FIELDS, as already validated and
+        normalized by the Content constructor.
+        """
+        return cls._build(fields.get)
+
+    @classmethod
+    def from_content(cls, content):
+        if isinstance(content, cls):
+            return content
+        return cls._build(lambda name: getattr(content, name, None))
+
+    def __eq__(self, other):
+        # Content only compares equal to its own class, be equal to a
+        # plain Content with the same label too:
+        return isinstance(other, Content) and (self.label == other.label)
+
+    def __hash__(self):
+        return hash(self.label)
+
+
+def content_to_dict(content):
+    """ Return the CONTENT_FIELDS of any Content as a dict. """
+    return dict([(name, getattr(content, name, None)) for name in CONTENT_FIELDS])
+
+
+def compact_content(contents):
+    """ Return a list of CompactContent for a list of Content. """
+    if contents is None:
+        return None
+    return [CompactContent.from_content(content) for content in contents]
+
+
+def compact_certificate(cert):
+    """
+    Replace the content of an entitlement certificate with CompactContent,
+    returns the certificate.
+    """
+    contents = getattr(cert, 'content', None)
+    if contents:
+        cert.content = compact_content(contents)
+    return cert
@@ -0,0 +1,482 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Keep-alive connections to the entitlement server.
+
+python-rhsm opens a new connection, and so goes through a full TLS
+handshake, for every request it makes. The connections CPProvider builds
+use PooledRestlib instead, which takes an open connection from the
+ConnectionPool of the provider and puts it back once the response is
+read. Requests to the same server, through the same proxy and with the
+same client certificate, then share one connection, whichever of the
+consumer, basic or no auth connections they are made with.
+
+Idle connections are closed after the keepalive_timeout setting, at 0
+each is closed once its response is read. A request failing because the server closed a connection it had already
+answered on is retried once on a new connection.
+
+Connections are made with rhsm.https, as python-rhsm makes its own, over
+the standard ssl module or M2Crypto, whichever python-rhsm settled on.
+TLS failures raise its ssl.SSLError, which is M2Crypto's SSL.SSLError
+only in the latter case, so callers catch both.
+
+Requests ask for gzip compressed responses, and request bodies past the
+compress_threshold setting, such as package profiles and facts, are sent
+compressed. A server refusing a compressed body gets it again as is, and
+only uncompressed bodies from then on. This does not depend on keeping
+connections open, PooledRestlib is used unless both settings are 0.
+"""
+
+import base64
+import errno
+import gzip
+import logging
+import os
+import select
+import socket
+import StringIO
+import threading
+import time
+
+from rhsm import certificate
+from rhsm.config import initConfig
+import rhsm.connection as connection
+from rhsm.https import httplib, ssl
+from rhsm import ourjson as json
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+cfg = initConfig()
+
+# Seconds an idle connection is kept open by default:
+KEEPALIVE_TIMEOUT = 15
+
+# Request bodies of at least this many bytes are compressed by default:
+COMPRESS_THRESHOLD = 8192
+
+# Errors from a connection the server closed while it was idle:
+RESET_ERRNOS = [errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED]
+
+# How a server not taking compressed request bodies fails them:
+GZIP_REFUSED_STATUSES = [400, 415]
+
+
+class PooledConnection(object):
+    """
+    An open connection, and how many requests were made over it.
+    """
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.requests = 0
+        self.last_used = time.time()
+        self.closed = False
+
+    def idle_time(self):
+        return time.time() - self.last_used
+
+    def is_dropped(self):
+        """
+        Whether the server closed the connection while it was idle. It
+        has nothing more to send once the last response was read, so a
+        readable socket means it was closed, or is unusable anyway.
+        """
+        sock = self.conn.sock
+        if sock is None:
+            return True
+        try:
+            return bool(select.select([sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            log.debug("Closing connection to %s after %d requests" %
+                      (self.name, self.requests))
+            self.conn.close()
+
+
+class ConnectionPool(object):
+    """
+    Open connections kept for reuse, grouped by a key describing what
+    they connect to.
+
+    A connection is used by one request at a time: checkout hands out
+    an idle connection for the key, or opens a new one, and checkin
+    makes it available again. Concurrent requests each get their own.
+    """
+
+    # Idle connections kept per key, others are closed:
+    MAX_IDLE = 4
+
+    def __init__(self, idle_timeout=KEEPALIVE_TIMEOUT,
+                 compress_threshold=COMPRESS_THRESHOLD):
+        self.idle_timeout = idle_timeout
+        # 0 to neither compress requests nor ask for compressed responses:
+        self.compress_threshold = compress_threshold
+        self._idle = {}
+        self._lock = threading.Lock()
+        # Every connection opened, for their request counters:
+        self.connections = []
+        self.reused = 0
+        self.reconnects = 0
+        # Servers that refused a compressed request body:
+        self.gzip_refused = set()
+
+    def _take_idle(self, key):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key, [])
+            while idle:
+                pooled = idle.pop()
+                if pooled.idle_time() <= self.idle_timeout and \
+                        not pooled.is_dropped():
+                    self.reused += 1
+                    return pooled
+                pooled.close()
+        finally:
+            self._lock.release()
+        return None
+
+    def connect(self, key, name, connect):
+        """
+        Open a new connection for key through connect(), which returns
+        an httplib connection.
+        """
+        pooled = PooledConnection(connect(), name)
+        self._lock.acquire()
+        try:
+            self.connections.append(pooled)
+        finally:
+            self._lock.release()
+        return pooled
+
+    def checkout(self, key, name, connect):
+        pooled = self._take_idle(key)
+        if pooled is None:
+            pooled = self.connect(key, name, connect)
+        return pooled
+
+    def checkin(self, key, pooled):
+        pooled.last_used = time.time()
+        if self.idle_timeout <= 0:
+            pooled.close()
+            return
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append(pooled)
+                return
+        finally:
+            self._lock.release()
+        pooled.close()
+
+    def requests_per_connection(self):
+        """ The number of requests made over each connection opened. """
+        return [pooled.requests for pooled in self.connections]
+
+    def close(self):
+        """ Close every idle connection. """
+        self._lock.acquire()
+        try:
+            for idle in self._idle.values():
+                for pooled in idle:
+                    pooled.close()
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+
+def _encode_auth(username, password):
+    return "Basic %s" % base64.b64encode("%s:%s" % (username, password))
+
+
+def _gzip(data):
+    buf = StringIO.StringIO()
+    # Level 6 compresses JSON about as well as 9, in half the time:
+    gzip_file = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6)
+    gzip_file.write(data)
+    gzip_file.close()
+    return buf.getvalue()
+
+
+def _gunzip(data):
+    gzip_file = gzip.GzipFile(fileobj=StringIO.StringIO(data), mode='rb')
+    try:
+        return gzip_file.read()
+    finally:
+        gzip_file.close()
+
+
+def _is_reset(e):
+    """
+    Whether e is how a connection the server closed while it was idle
+    fails the next request.
+    """
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    return getattr(e, 'errno', None) in RESET_ERRNOS
+
+
+class KeepAliveRestLib(connection.BaseRestLib):
+    """
+    BaseRestLib making its requests over the connections of a
+    ConnectionPool, rather than over a new connection each.
+    """
+
+    def __init__(self, pool, *args, **kwargs):
+        super(KeepAliveRestLib, self).__init__(*args, **kwargs)
+        self.pool = pool
+
+    def _pool_key(self):
+        """
+        What a connection made by this restlib connects to, and with
+        which client certificate. The certificate is identified by its
+        inode and mtime too, so a regenerated one is not mistaken for
+        the certificate an open connection was made with.
+        """
+        cert = None
+        if self.cert_file and os.path.exists(self.cert_file):
+            cert_stat = os.stat(self.cert_file)
+            cert = (self.cert_file, self.key_file, cert_stat.st_ino,
+                    cert_stat.st_mtime)
+        return (self.host, connection.safe_int(self.ssl_port),
+                self.proxy_hostname, self.proxy_port, self.proxy_user,
+                self.proxy_password, cert, self.insecure, self.ca_dir,
+                self.timeout)
+
+    def _new_connection(self):
+        # See note in BaseRestLib._request
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+
+        # Disable SSLv2 and SSLv3 support to avoid poodles.
+        context.options = ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+
+        if self.insecure:
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            context.verify_mode = ssl.CERT_REQUIRED
+            if self.ca_dir is not None:
+                self._load_ca_certificates(context)
+        if self.cert_file and os.path.exists(self.cert_file):
+            context.load_cert_chain(self.cert_file, keyfile=self.key_file)
+
+        if self.proxy_hostname and self.proxy_port:
+            log.debug("Using proxy: %s:%s" % (self.proxy_hostname, self.proxy_port))
+            proxy_headers = {'User-Agent': self.user_agent}
+            if self.proxy_user and self.proxy_password:
+                proxy_headers['Proxy-Authorization'] = _encode_auth(
+                        self.proxy_user, self.proxy_password)
+            conn = httplib.HTTPSConnection(self.proxy_hostname, self.proxy_port,
+                    context=context, timeout=self.timeout)
+            conn.set_tunnel(self.host, connection.safe_int(self.ssl_port),
+                    proxy_headers)
+        else:
+            conn = httplib.HTTPSConnection(self.host, self.ssl_port,
+                    context=context, timeout=self.timeout)
+        return conn
+
+    def _send(self, pooled, request_type, handler, body, headers):
+        """ Make a request over pooled, returns the response read. """
+        conn = pooled.conn
+        try:
+            conn.request(request_type, handler, body=body, headers=headers)
+        except ssl.SSLError:
+            if self.cert_file:
+                id_cert = certificate.create_from_file(self.cert_file)
+                if not id_cert.is_valid():
+                    raise connection.ExpiredIdentityCertException()
+            raise
+        except socket.error, e:
+            if str(e)[-3:] == str(httplib.PROXY_AUTHENTICATION_REQUIRED):
+                raise connection.ProxyException(e)
+            raise
+        response = conn.getresponse()
+        content = response.read()
+        pooled.requests += 1
+        return response, content
+
+    def _exchange(self, request_type, handler, body, headers):
+        """
+        Make a request over a connection of the pool, returns the
+        response and its content.
+        """
+        key = self._pool_key()
+        name = "%s:%s" % (self.host, self.ssl_port)
+        pooled = self.pool.checkout(key, name, self._new_connection)
+        exchanged = False
+        try:
+            try:
+                response, content = self._send(pooled, request_type, handler,
+                        body, headers)
+            except (httplib.BadStatusLine, socket.error), e:
+                if not pooled.requests or not _is_reset(e):
+                    raise
+                # Closed by the server since it answered the last request
+                # made over it, the request never reached it:
+                log.debug("Connection to %s was closed after %d requests, "
+                          "reconnecting" % (name, pooled.requests))
+                pooled.close()
+                self.pool.reconnects += 1
+                pooled = self.pool.connect(key, name, self._new_connection)
+                response, content = self._send(pooled, request_type, handler,
+                        body, headers)
+            exchanged = True
+        finally:
+            # Whatever is left of an interrupted exchange can not be reused:
+            if not exchanged:
+                pooled.close()
+
+        if response.will_close:
+            pooled.close()
+        else:
+            self.pool.checkin(key, pooled)
+        return response, content
+
+    def _send_compressed(self, request_type, handler, body, headers):
+        """
+        Make a request with body compressed, or as is if the server
+        refuses it compressed.
+        """
+        server = (self.host, connection.safe_int(self.ssl_port))
+        compressed = _gzip(body)
+        log.debug("Compressed request body from %d to %d bytes" %
+                  (len(body), len(compressed)))
+        compressed_headers = headers.copy()
+        compressed_headers['Content-Encoding'] = 'gzip'
+        response, content = self._exchange(request_type, handler, compressed,
+                compressed_headers)
+        if response.status not in GZIP_REFUSED_STATUSES:
+            return response, content
+
+        response, content = self._exchange(request_type, handler, body,
+                headers)
+        # Or the request is at fault, whatever its encoding:
+        if response.status < 400:
+            log.debug("%s:%s does not take compressed request bodies" % server)
+            self.pool.gzip_refused.add(server)
+        return response, content
+
+    def _compress_body(self, body):
+        threshold = self.pool.compress_threshold
+        if body is None or threshold <= 0 or len(body) < threshold:
+            return False
+        return (self.host, connection.safe_int(self.ssl_port)) not in \
+                self.pool.gzip_refused
+
+    def _request(self, request_type, method, info=None, headers=None):
+        handler = self.apihandler + method
+
+        if info is not None:
+            body = json.dumps(info, default=json.encode)
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+        else:
+            body = None
+
+        log.debug("Making request: %s %s" % (request_type, handler))
+
+        if self.user_agent:
+            self.headers['User-Agent'] = self.user_agent
+
+        final_headers = self.headers.copy()
+        if body is None:
+            final_headers["Content-Length"] = "0"
+        if self.pool.compress_threshold > 0:
+            final_headers['Accept-Encoding'] = 'gzip'
+        if headers:
+            final_headers.update(headers)
+
+        if self._compress_body(body):
+            response, content = self._send_compressed(request_type, handler,
+                    body, final_headers)
+        else:
+            response, content = self._exchange(request_type, handler, body,
+                    final_headers)
+        if response.getheader('content-encoding', '').lower() == 'gzip':
+            content = _gunzip(content)
+
+        result = {
+            "content": content.decode('utf-8'),
+            "status": response.status,
+            "headers": dict(response.getheaders())
+        }
+
+        response_log = 'Response: status=' + str(result['status'])
+        if response.getheader('x-candlepin-request-uuid'):
+            response_log = "%s, requestUuid=%s" % (response_log,
+                    response.getheader('x-candlepin-request-uuid'))
+        response_log = "%s, request=\"%s %s\"" % (response_log,
+            request_type, handler)
+        log.info(response_log)
+
+        # Look for server drift, and log a warning
+        if connection.drift_check(response.getheader('date')):
+            log.warn("Clock skew detected, please check your system time")
+
+        self.validateResponse(result, request_type, handler)
+
+        return result
+
+
+class PooledRestlib(connection.Restlib, KeepAliveRestLib):
+    """
+    Restlib, parsing the responses of a KeepAliveRestLib.
+    """
+    pass
+
+
+def _get_keepalive_timeout():
+    """
+    Seconds an idle connection to the server is kept open for the next
+    request, 0 to open a new connection for every request.
+    """
+    if not cfg.has_option('server', 'keepalive_timeout'):
+        return KEEPALIVE_TIMEOUT
+    try:
+        return cfg.get_int('server', 'keepalive_timeout') or 0
+    except ValueError:
+        log.warn("Ignoring invalid keepalive_timeout setting")
+        return KEEPALIVE_TIMEOUT
+
+
+def _get_compress_threshold():
+    """
+    Size in bytes from which request bodies are compressed, 0 to not
+    compress requests nor ask for compressed responses.
+    """
+    if not cfg.has_option('server', 'compress_threshold'):
+        return COMPRESS_THRESHOLD
+    try:
+        return cfg.get_int('server', 'compress_threshold') or 0
+    except ValueError:
+        log.warn("Ignoring invalid compress_threshold setting")
+        return COMPRESS_THRESHOLD
+
+
+def create_connection_pool():
+    """
+    Return a new ConnectionPool, or None if connections are neither to
+    be kept open nor to compress.
+    """
+    idle_timeout = _get_keepalive_timeout()
+    compress_threshold = _get_compress_threshold()
+    if idle_timeout <= 0 and compress_threshold <= 0:
+        return None
+    return ConnectionPool(idle_timeout, compress_threshold)
@@ -12,6 +12,8 @@
 # in this software or its documentation.
 #
 
+from subscription_manager import connpool
+from subscription_manager.requestcache import MemoizingRestlib, ResponseCache
 from subscription_manager.identity import ConsumerIdentity
 import rhsm.connection as connection
 
@@ -28,15 +30,25 @@ class CPProvider(object):
     basic_auth_cp: also called admin_auth uses a username/password
     no_auth_cp: no authentication
     content_connection: ent cert based auth connection to cdn
+
+    The candlepin connections make their requests through
+    connection_pool, unless the keepalive_timeout and compress_threshold
+    settings are both 0. While
+    response_cache is active, the GETs they make again are answered from
+    it.
     """
 
     consumer_auth_cp = None
     basic_auth_cp = None
     no_auth_cp = None
     content_connection = None
+    connection_pool = None
+    response_cache = None
 
     # Initialize with default connection info from the config file
     def __init__(self):
+        self.connection_pool = connpool.create_connection_pool()
+        self.response_cache = ResponseCache()
         self.set_connection_info()
 
     # Reread the config file and prefer arguments over config values
@@ -85,34 +97,37 @@ class CPProvider(object):
         self.basic_auth_cp = None
         self.no_auth_cp = None
 
+    def _pooled_restlib(self, *args, **kwargs):
+        return connpool.PooledRestlib(self.connection_pool, *args, **kwargs)
+
+    def _uep_connection(self, **kwargs):
+        if self.connection_pool is not None:
+            kwargs['restlib_class'] = self._pooled_restlib
+        uep = connection.UEPConnection(
+                proxy_hostname=self.proxy_hostname,
+                proxy_port=self.proxy_port,
+                proxy_user=self.proxy_user,
+                proxy_password=self.proxy_password,
+                **kwargs)
+        uep.conn = MemoizingRestlib(uep.conn, self.response_cache)
+        return uep
+
     def get_consumer_auth_cp(self):
         if not self.consumer_auth_cp:
-            self.consumer_auth_cp = connection.UEPConnection(
-                    proxy_hostname=self.proxy_hostname,
-                    proxy_port=self.proxy_port,
-                    proxy_user=self.proxy_user,
-                    proxy_password=self.proxy_password,
+            self.consumer_auth_cp = self._uep_connection(
                     cert_file=self.cert_file, key_file=self.key_file)
         return self.consumer_auth_cp
 
     def get_basic_auth_cp(self):
         if not self.basic_auth_cp:
-            self.basic_auth_cp = connection.UEPConnection(
-                    proxy_hostname=self.proxy_hostname,
-                    proxy_port=self.proxy_port,
-                    proxy_user=self.proxy_user,
-                    proxy_password=self.proxy_password,
+            self.basic_auth_cp = self._uep_connection(
                     username=self.username,
                     password=self.password)
         return self.basic_auth_cp
 
     def get_no_auth_cp(self):
         if not self.no_auth_cp:
-            self.no_auth_cp = connection.UEPConnection(
-                    proxy_hostname=self.proxy_hostname,
-                    proxy_port=self.proxy_port,
-                    proxy_user=self.proxy_user,
-                    proxy_password=self.proxy_password)
+            self.no_auth_cp = self._uep_connection()
         return self.no_auth_cp
 
     def get_content_connection(self):
@@ -15,12 +15,17 @@
 
 import gettext
 import logging
+import Queue
 import socket
+import sys
+import threading
+import time
 
 from rhsm.config import initConfig
 from rhsm.certificate import Key, create_from_pem
+from rhsm.connection import GoneException, ExpiredIdentityCertException
 
-from subscription_manager.certdirectory import Writer
+from subscription_manager.certdirectory import BatchWriter, Writer
 from subscription_manager import certlib
 from subscription_manager import content_action_client
 from subscription_manager import utils
@@ -35,6 +40,29 @@ _ = gettext.gettext
 
 cfg = initConfig()
 
+# Certificates fetched per request by default:
+CERT_CHUNK_SIZE = 50
+
+# Chunks fetched at the same time at most:
+MAX_CHUNK_FETCHES = 3
+
+# Times a chunk is fetched again after failing:
+CHUNK_RETRIES = 1
+
+
+def _get_cert_chunk_size():
+    """
+    Number of entitlement certificates fetched per request, 0 to fetch
+    them all at once.
+    """
+    if not cfg.has_option('rhsm', 'cert_chunk_size'):
+        return CERT_CHUNK_SIZE
+    try:
+        return cfg.get_int('rhsm', 'cert_chunk_size') or 0
+    except ValueError:
+        log.warn("Ignoring invalid cert_chunk_size setting")
+        return CERT_CHUNK_SIZE
+
 
 class EntCertActionInvoker(certlib.BaseActionInvoker):
     """Invoker for entitlement certificate updating actions."""
@@ -156,7 +184,8 @@ class EntCertUpdateAction(object):
     def install(self, missing_serials):
         """Install any missing entitlement certificates."""
 
-        cert_bundles = self.get_certificates_by_serial_list(missing_serials)
+        # Staged as each chunk arrives, not once they all did:
+        cert_bundles = self._fetch_certificates(missing_serials)
 
         ent_cert_bundles_installer = EntitlementCertBundlesInstaller(self.report)
         ent_cert_bundles_installer.install(cert_bundles)
@@ -236,16 +265,79 @@ class EntCertUpdateAction(object):
 
     def get_certificates_by_serial_list(self, sn_list):
         """Fetch a list of entitlement certificates specified by a list of serial numbers."""
-        result = []
-        if sn_list:
-            sn_list = [str(sn) for sn in sn_list]
-            # NOTE: use injected IDENTITY, need to validate this
-            # handles disconnected errors properly
-            reply = self.uep.getCertificates(self.identity.getConsumerId(),
-                                              serials=sn_list)
-            for cert in reply:
-                result.append(cert)
-        return result
+        return list(self._fetch_certificates(sn_list))
+
+    def _fetch_certificates(self, sn_list):
+        """
+        Yield the cert bundles of the serial numbers in sn_list as they
+        arrive. They are fetched in chunks of the cert_chunk_size setting,
+        on up to MAX_CHUNK_FETCHES threads.
+
+        A chunk failing is fetched again up to CHUNK_RETRIES times, and
+        then left out and its error added to the report. A
+        GoneException or ExpiredIdentityCertException stops any other
+        chunk from being fetched, and is raised once those being fetched
+        are done.
+        """
+        if not sn_list:
+            return
+        sn_list = [str(sn) for sn in sn_list]
+        chunk_size = _get_cert_chunk_size() or len(sn_list)
+        pending = [sn_list[i:i + chunk_size]
+                   for i in range(0, len(sn_list), chunk_size)]
+        # NOTE: use injected IDENTITY, need to validate this
+        # handles disconnected errors properly
+        consumer_id = self.identity.getConsumerId()
+        results = Queue.Queue()
+        running = 0
+        error = None
+
+        def fetch(chunk):
+            start = time.time()
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    reply = self.uep.getCertificates(consumer_id, serials=chunk)
+                    exc_info = None
+                except (GoneException, ExpiredIdentityCertException):
+                    reply, exc_info = None, sys.exc_info()
+                    break
+                except Exception:
+                    reply, exc_info = None, sys.exc_info()
+                    if attempts <= CHUNK_RETRIES:
+                        continue
+                break
+            results.put((chunk, reply, exc_info, attempts, time.time() - start))
+
+        while pending or running:
+            while pending and running < MAX_CHUNK_FETCHES and not error:
+                thread = threading.Thread(target=fetch, args=(pending.pop(0),))
+                thread.setDaemon(True)
+                thread.start()
+                running += 1
+            if not running:
+                break
+            chunk, reply, exc_info, attempts, elapsed = results.get()
+            running -= 1
+            self.report.chunks.append({'serials': len(chunk),
+                                       'attempts': attempts,
+                                       'seconds': elapsed,
+                                       'failed': exc_info is not None})
+            if exc_info is None:
+                for cert in reply:
+                    yield cert
+            elif issubclass(exc_info[0], (GoneException,
+                                          ExpiredIdentityCertException)):
+                if not error:
+                    error = exc_info
+            else:
+                log.error("Unable to fetch entitlement certificates %s: %s" %
+                          (chunk, exc_info[1]))
+                self.report._exceptions.append(exc_info[1])
+
+        if error:
+            raise error[0], error[1], error[2]
 
     def _get_expected_serials(self):
         exp = self.get_certificate_serials_list()
@@ -285,12 +377,38 @@ class EntitlementCertBundlesInstaller(object):
 
     def install(self, cert_bundles):
         """Fetch entitliement certs, install them, and update the report."""
-        bundle_installer = EntitlementCertBundleInstaller(self.report)
-        for cert_bundle in cert_bundles:
-            bundle_installer.install(cert_bundle)
+        batch_writer = BatchWriter()
+        bundle_installer = EntitlementCertBundleInstaller(self.report, batch_writer)
+        committed = False
+        try:
+            # cert_bundles may raise partway through, see _fetch_certificates:
+            for cert_bundle in cert_bundles:
+                bundle_installer.install(cert_bundle)
+            self.commit(batch_writer, bundle_installer.installed)
+            committed = True
+        finally:
+            if not committed:
+                batch_writer.abort()
+                self._drop_added(bundle_installer.installed)
         self.exceptions = bundle_installer.exceptions
         self.post_install()
 
+    def commit(self, batch_writer, installed):
+        """Move the staged ent certs into place, all at once."""
+        try:
+            batch_writer.commit()
+        except Exception, e:
+            log.exception(e)
+            log.error('Unable to install entitlement certificates: %s', e)
+            self.report._exceptions.append(e)
+            self._drop_added(installed)
+
+    def _drop_added(self, installed):
+        """ Drop the certs of a batch that was not committed from the report. """
+        failed = set([id(cert) for cert in installed])
+        self.report.added = [cert for cert in self.report.added
+                             if id(cert) not in failed]
+
     # TODO: add subman plugin slot,conduit,hooks
     def pre_install(self):
         """Hook called before any ent cert bundles are installed."""
@@ -323,19 +441,24 @@ class EntitlementCertBundleInstaller(object):
     bundles, while this is pre/post each ent cert bundle.
     """
 
-    def __init__(self, report):
+    def __init__(self, report, writer=None):
         self.exceptions = []
         self.report = report
+        # A BatchWriter to stage the cert/key in, written out right away
+        # if not given:
+        self.writer = writer
+        self.installed = []
 
     def install(self, bundle):
         """Persist an ent cert and it's key after splitting it from the bundle."""
         self.pre_install(bundle)
 
-        cert_bundle_writer = Writer()
+        cert_bundle_writer = self.writer or Writer()
         try:
             key, cert = self.build_cert(bundle)
             cert_bundle_writer.write(key, cert)
 
+            self.installed.append(cert)
             self.report.added.append(cert)
         except Exception, e:
             self.install_exception(bundle, e)
@@ -383,6 +506,9 @@ class EntCertUpdateReport(certlib.ActionReport):
         self.expected = []
         self.added = []
         self.rogue = []
+        # Each request certificates were fetched with: the number of
+        # serials, attempts and seconds it took, and whether it failed:
+        self.chunks = []
         self._exceptions = []
 
     def updates(self):
@@ -424,4 +550,8 @@ class EntCertUpdateReport(certlib.ActionReport):
         s.append(_('Expected (UEP) serial# %s') % self.expected)
         self.write(s, _('Added (new)'), self.added)
         self.write(s, _('Deleted (rogue):'), self.rogue)
+        if self.chunks:
+            s.append(_('Fetched in %d requests: %s') % (len(self.chunks),
+                ', '.join(['%d in %.2fs' % (chunk['serials'], chunk['seconds'])
+                           for chunk in self.chunks])))
         return '\n'.join(s)
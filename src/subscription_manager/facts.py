@@ -20,7 +20,8 @@ import os
 import rhsm.config
 
 from subscription_manager.injection import PLUGIN_MANAGER, require
-from subscription_manager.cache import CacheManager
+from subscription_manager.cache import BinaryCacheSerializer, CacheManager
+from subscription_manager import statestore
 import subscription_manager.injection as inj
 from rhsm import ourjson as json
 
@@ -33,6 +34,31 @@ log = logging.getLogger('rhsm-app.' + __name__)
 CERT_VERSION = "3.2"
 
 
+class CollectorCache(CacheManager):
+    """
+    The facts reported by each fact collector we can skip, with the
+    fingerprint they were collected with. Not sent anywhere, it saves
+    collecting facts again while nothing they depend on changed.
+    """
+    CACHE_FILE = "/var/lib/rhsm/facts/collectors.bin"
+    LEGACY_CACHE_FILE = "/var/lib/rhsm/facts/collectors.json"
+    SERIALIZER = BinaryCacheSerializer()
+
+    def __init__(self):
+        self.collected = {}
+
+    def to_dict(self):
+        return self.collected
+
+    def _load_data(self, open_file):
+        return json.loads(open_file.read())
+
+    def load(self):
+        if self._cache_exists():
+            self.collected = self._read_cache() or {}
+        return self.collected
+
+
 class Facts(CacheManager):
     """
     Manages the facts for this system, maintains a cache of the most
@@ -42,6 +68,7 @@ class Facts(CacheManager):
     facts to be loaded from /etc/rhsm/facts/.
     """
     CACHE_FILE = "/var/lib/rhsm/facts/facts.json"
+    DIGEST = True
 
     def __init__(self, ent_dir=None, prod_dir=None):
         self.facts = {}
@@ -58,9 +85,15 @@ class Facts(CacheManager):
         # plugin manager so we can add custom facst via plugin
         self.plugin_manager = require(PLUGIN_MANAGER)
 
+        self.collector_cache = CollectorCache()
+        # What the collectors reported on the last get_facts:
+        self._collected = {}
+        # Cleared by a forced update_check, which probes everything again:
+        self._use_collector_cache = True
+
     def get_last_update(self):
         try:
-            return datetime.fromtimestamp(os.stat(self.CACHE_FILE).st_mtime)
+            return datetime.fromtimestamp(statestore.state_mtime(self.CACHE_FILE))
         except Exception:
             return None
 
@@ -73,34 +106,93 @@ class Facts(CacheManager):
             log.info("Cache %s does not exit" % self.CACHE_FILE)
             return True
 
-        cached_facts = self._read_cache() or {}
         # In order to accurately check for changes, we must refresh local data
-        self.facts = self.get_facts(True)
+        self.facts = self._collect_facts(self._use_collector_cache)
 
+        changed = self._digest_changed(self.facts)
+        if changed is not None:
+            return changed
+
+        cached_facts = self._read_cache() or {}
         for key in (set(self.facts) | set(cached_facts)) - set(self.graylist):
             if self.facts.get(key) != cached_facts.get(key):
                 return True
         return False
 
     def get_facts(self, refresh=False):
+        """
+        Return the facts, collecting them if there are none yet. refresh
+        collects them again, probing everything rather than reusing what
+        the collector cache has.
+        """
         if ((len(self.facts) == 0) or refresh):
-            facts = {}
-            facts.update(self._load_hw_facts())
+            self._collect_facts(not refresh)
+        return self.facts
 
-            # Set the preferred entitlement certificate version:
-            facts.update({"system.certificate_version": CERT_VERSION})
+    def _collect_facts(self, use_collector_cache):
+        self.collector_cache.load()
+        self._collected = {}
+        facts = {}
+        facts.update(self._load_hw_facts(use_collector_cache))
 
-            facts.update(self._load_custom_facts())
-            self.plugin_manager.run('post_facts_collection', facts=facts)
-            self.facts = facts
-        return self.facts
+        # Set the preferred entitlement certificate version:
+        facts.update({"system.certificate_version": CERT_VERSION})
+
+        facts.update(self._load_custom_facts(use_collector_cache))
+        self.plugin_manager.run('post_facts_collection', facts=facts)
+        self.facts = facts
+        return facts
+
+    def update_check(self, uep, consumer_uuid, force=False):
+        self._use_collector_cache = not force
+        try:
+            updated = CacheManager.update_check(self, uep, consumer_uuid, force)
+        finally:
+            self._use_collector_cache = True
+        if not updated:
+            # Even if the facts did not change, what the collectors depend
+            # on may have, such as after a reboot:
+            self._save_collected()
+        return updated
+
+    def _save_collected(self):
+        """
+        Cache what the collectors reported on the last get_facts, unless
+        it is what they reported before.
+        """
+        if self._collected != self.collector_cache.collected:
+            self.collector_cache.collected = self._collected
+            self.collector_cache.write_cache()
+
+    def write_cache(self, debug=True):
+        written = CacheManager.write_cache(self, debug)
+        self._save_collected()
+        return written
 
     def to_dict(self):
         return self.get_facts()
 
-    def _load_hw_facts(self):
+    def _digest_data(self, data):
+        # has_changed ignores graylisted facts, and treats facts set to
+        # None like missing ones:
+        return dict([(key, value) for (key, value) in data.items()
+                     if value is not None and key not in self.graylist])
+
+    @classmethod
+    def _delete_state(cls):
+        super(Facts, cls)._delete_state()
+        CollectorCache.delete_cache()
+
+    def _load_hw_facts(self, use_collector_cache=True):
         import hwprobe
-        return hwprobe.Hardware().get_all()
+        hardware = hwprobe.Hardware()
+        cached = None
+        if use_collector_cache:
+            cached = self.collector_cache.collected.get('hardware')
+        hw_facts = hardware.get_all(cached)
+        if hardware.collected:
+            self._collected['hardware'] = hardware.collected
+        return hw_facts
 
     def _parse_facts_json(self, json_buffer, file_path):
         custom_facts = None
@@ -128,14 +220,26 @@ class Facts(CacheManager):
 
         return json_buffer
 
-    def _load_custom_facts(self):
+    def _load_custom_facts(self, use_collector_cache=True):
         """
         Load custom facts from .facts files in /etc/rhsm/facts.
         """
         # BZ 1112326 don't double the '/'
         facts_file_glob = "%s/facts/*.facts" % rhsm.config.DEFAULT_CONFIG_DIR.rstrip('/')
+        file_paths = glob.glob(facts_file_glob)
+        if not file_paths:
+            return {}
+
+        fingerprint = self._custom_facts_fingerprint(file_paths)
+        cached = None
+        if use_collector_cache:
+            cached = self.collector_cache.collected.get('custom')
+        if fingerprint is not None and cached and cached[0] == fingerprint:
+            self._collected['custom'] = cached
+            return cached[1]
+
         file_facts = {}
-        for file_path in glob.glob(facts_file_glob):
+        for file_path in file_paths:
             log.info("Loading custom facts from: %s" % file_path)
             json_buffer = self._open_custom_facts(file_path)
 
@@ -147,8 +251,24 @@ class Facts(CacheManager):
             if custom_facts:
                 file_facts.update(custom_facts)
 
+        if fingerprint is not None:
+            self._collected['custom'] = [fingerprint, file_facts]
         return file_facts
 
+    def _custom_facts_fingerprint(self, file_paths):
+        """
+        The custom facts files with their inode, size and mtime, or None
+        if one of them can not be stat'ed.
+        """
+        fingerprint = []
+        for file_path in sorted(file_paths):
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                return None
+            fingerprint.append([file_path, st.st_ino, st.st_size, st.st_mtime])
+        return fingerprint
+
     def _sync_with_server(self, uep, consumer_uuid):
         log.debug("Updating facts on server")
         uep.updateConsumer(consumer_uuid, facts=self.get_facts())
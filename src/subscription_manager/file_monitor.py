@@ -19,11 +19,18 @@ Watch for and be notified of changes in a file.
 Perfers to use gio as the backend, but can fallback to polling.
 """
 
+import glob
 import gobject
 import os
+import time
 
 import rhsm.config
 
+# Staging directories older than STAGING_TIMEOUT are assumed to be left
+# over from a writer which died, and no longer hold off change
+# notifications:
+from subscription_manager.certdirectory import STAGING_SUFFIX, STAGING_TIMEOUT
+
 
 class MonitorDirectory(object):
 
@@ -42,7 +49,26 @@ class MonitorDirectory(object):
             exists = False
         return (mtime, exists)
 
+    def _is_staging(self):
+        """
+        Whether a BatchWriter is staging changes to this directory.
+        """
+        pattern = os.path.normpath(self.path) + STAGING_SUFFIX + '*'
+        for staging_dir in glob.glob(pattern):
+            try:
+                if time.time() - os.path.getmtime(staging_dir) < STAGING_TIMEOUT:
+                    return True
+            except OSError:
+                # Committed while we were looking:
+                pass
+        return False
+
     def update(self):
+        # Hold off while a batch of changes is being staged, so we see
+        # them all at once when it is committed:
+        if self._is_staging():
+            return False
+
         mtime, exists = self._check_mtime()
 
         # Has something changed?
@@ -33,6 +33,11 @@ _ = gettext.gettext
 log = logging.getLogger('rhsm-app.' + __name__)
 
 
+# Bump this whenever the facts a collector reports change, cached collector
+# output from other versions is then collected anew.
+COLLECTOR_CACHE_VERSION = 1
+
+
 # Exception classes used by this module.
 # from later versions of subprocess, but not there on 2.4, so include our version
 class CalledProcessError(Exception):
@@ -107,6 +112,9 @@ class Hardware:
 
     def __init__(self, prefix=None, testing=None):
         self.allhw = {}
+        # Maps the collectors get_all can skip to the (fingerprint, facts)
+        # they last reported:
+        self.collected = {}
         # prefix to look for /sys, for testing
         self.prefix = prefix or ''
         self.testing = testing or False
@@ -825,23 +833,76 @@ class Hardware:
         "Log any warnings from firmware info gather,and/or clear them."
         self.get_platform_specific_info_provider().log_warnings()
 
-    def get_all(self):
-        hardware_methods = [self.get_uname_info,
-                            self.get_release_info,
-                            self.get_mem_info,
-                            self.get_cpu_info,
-                            self.get_ls_cpu_info,
-                            self.get_network_info,
-                            self.get_network_interfaces,
-                            self.get_virt_info,
+    def _read_proc_file(self, path):
+        try:
+            f = open("%s%s" % (self.prefix, path), 'r')
+            try:
+                return f.read().strip()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+    def get_boot_fingerprint(self):
+        """
+        Identify the current boot and the cpus online in it, which is all
+        the cpu, firmware and virt facts can change with. Returns None if
+        the boot can not be identified.
+        """
+        boot_id = self._read_proc_file("/proc/sys/kernel/random/boot_id")
+        if not boot_id:
+            return None
+        return [COLLECTOR_CACHE_VERSION, boot_id,
+                self._read_proc_file("/sys/devices/system/cpu/online")]
+
+    def _collect(self, hardware_method, fingerprint, cached):
+        """
+        Run hardware_method, unless cached has the facts it reported with
+        the same fingerprint, then they are reported again instead.
+        """
+        name = hardware_method.__name__
+        entry = cached.get(name)
+        if fingerprint is not None and entry and entry[0] == fingerprint:
+            facts = entry[1]
+            self.allhw.update(facts)
+        else:
+            before = self.allhw.copy()
+            hardware_method()
+            facts = dict([(key, value) for (key, value) in self.allhw.items()
+                          if key not in before or before[key] != value])
+        if fingerprint is not None:
+            self.collected[name] = [fingerprint, facts]
+
+    def get_all(self, cached=None):
+        """
+        Collect every hardware fact.
+
+        cached is what self.collected was after an earlier run. Collectors
+        whose fingerprint has not changed since report the facts they did
+        then, without probing the hardware again.
+        """
+        cached = cached or {}
+        self.collected = {}
+        boot = self.get_boot_fingerprint()
+        # Forking lscpu, virt-what and reading DMI tables is what takes
+        # time, their output only changes across boots. The rest is cheap,
+        # and network addresses can change any time:
+        hardware_methods = [(self.get_uname_info, None),
+                            (self.get_release_info, None),
+                            (self.get_mem_info, None),
+                            (self.get_cpu_info, boot),
+                            (self.get_ls_cpu_info, boot),
+                            (self.get_network_info, None),
+                            (self.get_network_interfaces, None),
+                            (self.get_virt_info, boot),
                             # this has to happen after everything else, since
                             # it expects to check virt and processor info
-                            self.get_platform_specific_info]
+                            (self.get_platform_specific_info, boot)]
         # try each hardware method, and try/except around, since
         # these tend to be fragile
-        for hardware_method in hardware_methods:
+        for hardware_method, fingerprint in hardware_methods:
             try:
-                hardware_method()
+                self._collect(hardware_method, fingerprint, cached)
             except Exception, e:
                 log.warn("%s" % hardware_method)
                 log.warn("Hardware detection failed: %s" % e)
@@ -22,6 +22,7 @@ PROD_DIR = "PROD_DIR"
 ENTITLEMENT_STATUS_CACHE = "ENTITLEMENT_STATUS_CACHE"
 PROD_STATUS_CACHE = "PROD_STATUS_CACHE"
 OVERRIDE_STATUS_CACHE = "OVERRIDE_STATUS_CACHE"
+RELEASE_LISTING_CACHE = "RELEASE_LISTING_CACHE"
 CP_PROVIDER = "CP_PROVIDER"
 PLUGIN_MANAGER = "PLUGIN_MANAGER"
 DBUS_IFACE = "DBUS_IFACE"
@@ -31,6 +32,7 @@ FACTS = "FACTS"
 PROFILE_MANAGER = "PROFILE_MANAGER"
 INSTALLED_PRODUCTS_MANAGER = "INSTALLED_PRODUCTS_MANAGER"
 
+import threading
 import types
 
 
@@ -45,6 +47,8 @@ class FeatureBroker:
     """
     def __init__(self):
         self.providers = {}
+        # Singletons may require others while they are created:
+        self._lock = threading.RLock()
 
     def provide(self, feature, provider):
         """
@@ -73,12 +77,22 @@ class FeatureBroker:
 
         if isinstance(provider, (type, types.ClassType)):
             # Args should never be used with singletons, they are ignored
-            self.providers[feature] = provider()
+            self._create_singleton(feature)
         elif callable(provider):
             return provider(*args, **kwargs)
 
         return self.providers[feature]
 
+    def _create_singleton(self, feature):
+        self._lock.acquire()
+        try:
+            # Unless another thread created it meanwhile:
+            provider = self.providers[feature]
+            if isinstance(provider, (type, types.ClassType)):
+                self.providers[feature] = provider()
+        finally:
+            self._lock.release()
+
 
 def nonSingleton(other):
     """
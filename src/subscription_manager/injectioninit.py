@@ -16,7 +16,7 @@ import subscription_manager.injection as inj
 
 
 from subscription_manager.cache import ProductStatusCache, EntitlementStatusCache, OverrideStatusCache, \
-    ProfileManager, InstalledProductsManager, PoolTypeCache
+    ProfileManager, InstalledProductsManager, PoolTypeCache, ReleaseListingCache
 
 from subscription_manager.cert_sorter import CertSorter
 from subscription_manager.certdirectory import EntitlementDirectory
@@ -49,6 +49,7 @@ def init_dep_injection():
     inj.provide(inj.ENTITLEMENT_STATUS_CACHE, EntitlementStatusCache, singleton=True)
     inj.provide(inj.PROD_STATUS_CACHE, ProductStatusCache, singleton=True)
     inj.provide(inj.OVERRIDE_STATUS_CACHE, OverrideStatusCache, singleton=True)
+    inj.provide(inj.RELEASE_LISTING_CACHE, ReleaseListingCache, singleton=True)
     inj.provide(inj.PROFILE_MANAGER, ProfileManager, singleton=True)
     inj.provide(inj.INSTALLED_PRODUCTS_MANAGER, InstalledProductsManager, singleton=True)
 
@@ -87,6 +87,10 @@ class LockFile:
 class Lock:
 
     mutex = Mutex()
+    # How many times the lock at each path is held in this process, by
+    # any Lock instance. The lock file is only removed once none holds
+    # it, so locks taken by the threads of a process share it.
+    held = {}
 
     def __init__(self, path):
         self.depth = 0
@@ -103,41 +107,59 @@ class Lock:
     def acquire(self):
         if self.lockdir is None:
             return
-        f = LockFile(self.path)
+        # Only hold the mutex while looking at the lock file, not while
+        # waiting for another process to release it, so other threads can
+        # take and release their locks in the meantime:
+        while not self._try_acquire():
+            time.sleep(0.5)
+
+    def _try_acquire(self):
+        """
+        Take the lock unless another process holds it, in which case
+        return False.
+        """
+        mutex = self.mutex
+        mutex.acquire()
         try:
+            f = LockFile(self.path)
             try:
-                while True:
+                try:
                     f.open()
                     f.getpid()
                     if f.mypid():
                         self.P()
-                        return
+                        return True
                     if f.valid():
-                        f.close()
-                        time.sleep(0.5)
-                    else:
-                        break
-                self.P()
-                f.setpid()
-            except OSError:
-                print "could not create lock"
+                        return False
+                    self.P()
+                    f.setpid()
+                except OSError:
+                    print "could not create lock"
+            finally:
+                f.close()
+            return True
         finally:
-            f.close()
+            mutex.release()
 
     def release(self):
         if self.lockdir is None:
             return
-        if not self.acquired():
-            return
-        self.V()
-        if self.acquired():
-            return
-        f = LockFile(self.path)
+        mutex = self.mutex
+        mutex.acquire()
         try:
-            f.open()
-            f.delete()
+            if not self.acquired():
+                return
+            self.V()
+            if self.acquired() or self.held.get(self.path):
+                return
+            f = LockFile(self.path)
+            try:
+                f.open()
+                f.delete()
+            finally:
+                f.close()
         finally:
-            f.close()
+            mutex.release()
 
     def acquired(self):
         if self.lockdir is None:
@@ -155,6 +177,7 @@ class Lock:
         mutex.acquire()
         try:
             self.depth += 1
+            self.held[self.path] = self.held.get(self.path, 0) + 1
         finally:
             mutex.release()
         return self
@@ -167,6 +190,7 @@ class Lock:
         try:
             if self.acquired():
                 self.depth -= 1
+                self.held[self.path] -= 1
         finally:
             mutex.release()
     V = signal
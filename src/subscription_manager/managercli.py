@@ -2386,6 +2386,10 @@ class StatusCommand(CliCommand):
         overall_status = self.sorter.get_system_status()
         reasons = self.sorter.reasons.get_name_message_map()
         print(_("Overall Status: %s\n") % overall_status)
+        if not self.options.on_date:
+            cached_age = inj.require(inj.ENTITLEMENT_STATUS_CACHE).cached_age
+            if cached_age is not None:
+                print(_("Status cached %d seconds ago\n") % cached_age)
 
         columns = get_terminal_width()
         for name in reasons:
@@ -27,6 +27,7 @@ from rhsm.config import initConfig
 from rhsm.certificate import Key, CertificateException, create_from_pem
 
 import subscription_manager.cache as cache
+from subscription_manager.certdirectory import BatchWriter, EntitlementDirectory
 from subscription_manager.cert_sorter import StackingGroupSorter, ComplianceManager
 from subscription_manager import identity
 from subscription_manager.facts import Facts
@@ -37,6 +38,7 @@ from subscription_manager.injection import require, CERT_SORTER, \
 from subscription_manager import isodate
 from subscription_manager.jsonwrapper import PoolWrapper
 from subscription_manager.repolib import RepoActionInvoker
+from subscription_manager import statestore
 from subscription_manager import utils
 
 # FIXME FIXME
@@ -661,6 +663,7 @@ class ImportFileExtractor(object):
     def __init__(self, cert_file_path):
         self.path = cert_file_path
         self.file_name = os.path.basename(cert_file_path)
+        self._batch_writer = None
 
         content = self._read(cert_file_path)
         self.parts = self._process_content(content)
@@ -737,6 +740,8 @@ class ImportFileExtractor(object):
     def write_to_disk(self):
         """
         Write/copy cert to the entitlement cert dir.
+
+        The cert and key are staged, and only moved into place together.
         """
         self._ensure_entitlement_dir_exists()
         dest_file_path = os.path.join(ENT_CONFIG_DIR,
@@ -752,12 +757,18 @@ class ImportFileExtractor(object):
             log.debug("Writing key file: %s" % (dest_key_file_path))
             self._write_file(dest_key_file_path, self.get_key_content())
 
+        self._commit()
+
     def _write_file(self, target_path, content):
-        new_file = open(target_path, "w")
-        try:
-            new_file.write(content)
-        finally:
-            new_file.close()
+        if self._batch_writer is None:
+            self._batch_writer = BatchWriter(os.path.dirname(target_path))
+        self._batch_writer.write_pem(os.path.basename(target_path), content)
+
+    def _commit(self):
+        if self._batch_writer is not None:
+            batch_writer = self._batch_writer
+            self._batch_writer = None
+            batch_writer.commit()
 
     def _ensure_entitlement_dir_exists(self):
         if not os.access(ENT_CONFIG_DIR, os.R_OK):
@@ -861,16 +872,22 @@ def clean_all_data(backup=True):
     else:
         log.warn("Entitlement cert directory does not exist: %s" % ent_cert_dir)
 
+    EntitlementDirectory.delete_cache()
+    statestore.in_transaction(_delete_caches)
+    RepoActionInvoker.delete_repo_file()
+    log.info("Cleaned local data")
+
+
+def _delete_caches():
     cache.ProfileManager.delete_cache()
     cache.InstalledProductsManager.delete_cache()
+    cache.PoolTypeCache.delete_cache()
     Facts.delete_cache()
 
     # Must also delete in-memory cache
     require(ENTITLEMENT_STATUS_CACHE).delete_cache()
     require(PROD_STATUS_CACHE).delete_cache()
     require(OVERRIDE_STATUS_CACHE).delete_cache()
-    RepoActionInvoker.delete_repo_file()
-    log.info("Cleaned local data")
 
 
 def valid_quantity(quantity):
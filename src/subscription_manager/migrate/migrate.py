@@ -27,6 +27,7 @@ import traceback
 
 import libxml2
 from M2Crypto.SSL import SSLError
+from rhsm.https import ssl
 
 from rhn import rpclib
 
@@ -290,7 +291,7 @@ class MigrationEngine(object):
 
         try:
             self.cp.getOwnerList(username)
-        except SSLError, e:
+        except (SSLError, ssl.SSLError), e:
             print _("Error: CA certificate for subscription service has not been installed.")
             system_exit(1, CONNECTION_FAILURE % e)
         except Exception, e:
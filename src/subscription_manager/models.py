@@ -43,11 +43,18 @@ class ContentSet(object):
 
 class EntCertEntitledContent(object):
     """Associate a Content with it's entitlement cert."""
+    # There is one of these per content set of every cert:
+    __slots__ = ('content', 'cert')
+
     def __init__(self, content=None, cert=None):
         self.content = content
         self.cert = cert
+
+    @property
+    def content_type(self):
         if self.content:
-            self.content_type = self.content.content_type
+            return self.content.content_type
+        return None
 
 
 class EntCertEntitledContentSet(ContentSet):
@@ -18,7 +18,6 @@
 import gettext
 from gzip import GzipFile
 import logging
-import os
 import types
 import yum
 # for labelCompare
@@ -30,6 +29,7 @@ from subscription_manager.certdirectory import Directory
 from subscription_manager.injection import PLUGIN_MANAGER, require
 
 from subscription_manager import rhelproduct
+from subscription_manager import statestore
 
 from subscription_manager.utils import DefaultDict
 
@@ -76,11 +76,11 @@ class ProductDatabase:
         return self.content.get(product, None)
 
     def create(self):
-        if not os.path.exists(self.__fn()):
+        if not statestore.state_exists(self.__fn()):
             self.write()
 
     def read(self):
-        f = open(self.__fn())
+        f = statestore.open_state(self.__fn())
         try:
             d = json.load(f)
             # munge old format to new if need be
@@ -102,12 +102,11 @@ class ProductDatabase:
                 self.content[productid] = repo_data
 
     def write(self):
-        f = open(self.__fn(), 'w')
         try:
-            json.dump(self.content, f, indent=2)
+            statestore.write_state(self.__fn(),
+                    lambda f: json.dump(self.content, f, indent=2))
         except Exception:
             pass
-        f.close()
 
     def __fn(self):
         return self.dir.abspath('productid.js')
@@ -19,14 +19,20 @@
 import gettext
 import httplib
 import logging
+import Queue
 import socket
+import sys
+import threading
 
 from M2Crypto.SSL import SSLError
+from rhsm.https import ssl
 
 import rhsm.config
+import rhsm.connection as connection
 
 from subscription_manager import injection as inj
 from subscription_manager import listing
+from subscription_manager import requestcache
 from subscription_manager import rhelproduct
 
 _ = gettext.gettext
@@ -35,6 +41,26 @@ log = logging.getLogger('rhsm-app.' + __name__)
 
 cfg = rhsm.config.initConfig()
 
+# Listings fetched at the same time at most:
+MAX_LISTING_FETCHES = 4
+
+# Seconds a release listing is used without asking the CDN by default:
+RELEASE_LISTING_TTL = 600
+
+
+def _get_release_listing_ttl():
+    """
+    Seconds a fetched release listing is used without asking the CDN
+    again, 0 to always ask.
+    """
+    if not cfg.has_option('rhsm', 'release_listing_ttl'):
+        return RELEASE_LISTING_TTL
+    try:
+        return cfg.get_int('rhsm', 'release_listing_ttl') or 0
+    except ValueError:
+        log.warn("Ignoring invalid release_listing_ttl setting")
+        return RELEASE_LISTING_TTL
+
 
 class ContentConnectionProvider(object):
     def __init__(self):
@@ -77,6 +103,7 @@ class CdnReleaseVersionProvider(object):
         self.product_dir = inj.require(inj.PROD_DIR)
         self.cp_provider = inj.require(inj.CP_PROVIDER)
         self.content_connection = self.cp_provider.get_content_connection()
+        self.listing_cache = inj.require(inj.RELEASE_LISTING_CACHE)
 
     def get_releases(self):
         # cdn base url
@@ -120,18 +147,8 @@ class CdnReleaseVersionProvider(object):
         # with one content with one listing file. We shall see.
         releases = []
         listings = sorted(set(listings))
-        for listing_path in listings:
-            try:
-                data = self.content_connection.get_versions(listing_path)
-            except (socket.error,
-                    httplib.HTTPException,
-                    SSLError) as e:
-                # content connection doesn't handle any exceptions
-                # and the code that invokes this doesn't either, so
-                # swallow them here.
-                log.exception(e)
-                continue
-
+        self._listings_changed = False
+        for data in self._get_listings(listings):
             # any non 200 response on fetching the release version
             # listing file returns a None here
             if not data:
@@ -142,9 +159,130 @@ class CdnReleaseVersionProvider(object):
             # ver_listing.releases can be empty
             releases = releases + ver_listing.get_releases()
 
+        if self._listings_changed:
+            self.listing_cache.write_cache()
+
         releases_set = sorted(set(releases))
         return releases_set
 
+    def _get_listings(self, listing_paths):
+        """
+        The content of each listing of listing_paths, None for those that
+        could not be fetched. Listings cached less than the
+        release_listing_ttl setting ago are used as is, the others are
+        fetched concurrently.
+        """
+        listings = {}
+        fetch = []
+        ttl = _get_release_listing_ttl()
+        for listing_path in listing_paths:
+            data = None
+            url = self._listing_url(listing_path)
+            if url and ttl > 0:
+                data = self.listing_cache.get_fresh(url, ttl)
+            if data is None:
+                fetch.append(listing_path)
+            else:
+                log.debug("Using cached listing: %s" % url)
+                listings[listing_path] = data
+        if fetch:
+            listings.update(self._fetch_listings(fetch))
+        return [listings.get(listing_path) for listing_path in listing_paths]
+
+    def _fetch_listings(self, listing_paths):
+        """
+        Fetch the listings on up to MAX_LISTING_FETCHES threads, returns
+        their content by listing path.
+        """
+        pending = list(listing_paths)
+        results = Queue.Queue()
+        listings = {}
+        running = 0
+        error = None
+
+        def fetch(listing_path):
+            # Put whatever happens, or the loop below waits for it forever:
+            result = (listing_path, None, None)
+            try:
+                try:
+                    result = (listing_path, self._get_versions(listing_path),
+                            None)
+                except (socket.error,
+                        httplib.HTTPException,
+                        SSLError,
+                        ssl.SSLError) as e:
+                    # content connection doesn't handle any exceptions
+                    # and the code that invokes this doesn't either, so
+                    # swallow them here.
+                    log.exception(e)
+                except Exception:
+                    result = (listing_path, None, sys.exc_info())
+            finally:
+                results.put(result)
+
+        while pending or running:
+            while pending and running < MAX_LISTING_FETCHES and not error:
+                thread = threading.Thread(target=fetch, args=(pending.pop(0),))
+                thread.setDaemon(True)
+                thread.start()
+                running += 1
+            if not running:
+                break
+            listing_path, data, exc_info = results.get()
+            running -= 1
+            listings[listing_path] = data
+            if exc_info and not error:
+                error = exc_info
+
+        if error:
+            raise error[0], error[1], error[2]
+        return listings
+
+    def _listing_url(self, listing_path):
+        """
+        Where the listing at listing_path is fetched from, None if the
+        content connection is not one listings are cached for.
+        """
+        conn = self.content_connection
+        if not isinstance(conn, connection.ContentConnection):
+            return None
+        return "%s:%s%s/%s" % (conn.host, conn.ssl_port, conn.handler,
+                listing_path)
+
+    def _get_versions(self, listing_path):
+        """
+        The content of the listing at listing_path, '' if it could not be
+        fetched. A cached listing is only downloaded again once the CDN
+        tells it changed.
+        """
+        conn = self.content_connection
+        url = self._listing_url(listing_path)
+        if url is None or not requestcache.takes_headers(conn._request):
+            return conn.get_versions(listing_path)
+
+        handler = "%s/%s" % (conn.handler, listing_path)
+        cached = self.listing_cache.get(url)
+        validators = None
+        if cached:
+            validators = cached[1]
+        result = conn._request("GET", handler, body="",
+                headers=requestcache.validator_headers(validators))
+
+        if result['status'] == 304 and cached:
+            length = (validators or {}).get('length', 0)
+            log.debug("Listing not modified, %d bytes saved: %s" % (length, url))
+            self.cp_provider.response_cache.count_not_modified(length)
+            # Fresh again for release_listing_ttl:
+            self.listing_cache.put(url, cached[0], validators)
+            self._listings_changed = True
+            return cached[0]
+        if result['status'] != 200:
+            return ''
+        self.listing_cache.put(url, result['content'],
+                requestcache.response_validators(result))
+        self._listings_changed = True
+        return result['content']
+
     def _build_listing_path(self, content_url):
         listing_parts = content_url.split('$releasever', 1)
         listing_base = listing_parts[0]
@@ -226,12 +226,17 @@ class RepoUpdateActionCommand(object):
             certs = self.ent_dir.list_valid()
 
         lst = set()
+        tags_we_have = None
+        # Maps each distinct set of required tags to the ones we are
+        # missing, compact content shares them between content sets:
+        missing_tags = {}
 
         for cert in certs:
             if not cert.content:
                 continue
 
-            tags_we_have = self.prod_dir.get_provided_tags()
+            if tags_we_have is None:
+                tags_we_have = self.prod_dir.get_provided_tags()
 
             for content in cert.content:
                 if not content.content_type in ALLOWED_CONTENT_TYPES:
@@ -239,13 +244,15 @@ class RepoUpdateActionCommand(object):
                         content.content_type, content.label))
                     continue
 
-                all_tags_found = True
-                for tag in content.required_tags:
-                    if not tag in tags_we_have:
-                        log.debug("Missing required tag '%s', skipping content: %s" % (
-                            tag, content.label))
-                        all_tags_found = False
-                if all_tags_found:
+                required_tags = tuple(content.required_tags)
+                missing = missing_tags.get(required_tags)
+                if missing is None:
+                    missing = [tag for tag in required_tags if not tag in tags_we_have]
+                    missing_tags[required_tags] = missing
+                for tag in missing:
+                    log.debug("Missing required tag '%s', skipping content: %s" % (
+                        tag, content.label))
+                if not missing:
                     lst.add(content)
 
         return lst
@@ -0,0 +1,335 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Responses to server GETs, remembered for the length of an action run.
+
+Several parts of one run ask the server for the same thing: the consumer
+is fetched by the healing, identity cert and product status updates, the
+compliance status by the cert sorter and the compliance managers. The
+connections CPProvider builds send their requests through a
+MemoizingRestlib, which answers a GET of one of the MEMOIZED_PATHS made
+again while the ResponseCache of the provider is active from the cache.
+Any other request, bind, unbind, updateConsumer and the like, empties it.
+Other GETs, the certificates and their content above all, are large and
+asked for once, they are not kept.
+
+The cache is only active between ResponseCache.start and stop, which
+BaseActionClient.update calls around its updates.
+
+conditional_get makes GETs sending the validators (ETag, Last-Modified)
+of an earlier response, for callers keeping that response themselves.
+"""
+
+import copy
+import inspect
+import logging
+import re
+import threading
+
+import rhsm.connection as connection
+from rhsm import ourjson as json
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+# The resources, the query string left out, a run asks for repeatedly:
+MEMOIZED_PATHS = [re.compile(path) for path in [
+    r"^/$",
+    r"^/status/?$",
+    r"^/consumers/[^/]+$",
+    r"^/consumers/[^/]+/(compliance|owner|release|content_overrides)$",
+    r"^/consumers/[^/]+/certificates/serials$",
+]]
+
+
+def memoized(method):
+    """ Whether a GET of method is kept by the ResponseCache. """
+    path = method.split('?', 1)[0]
+    for pattern in MEMOIZED_PATHS:
+        if pattern.match(path):
+            return True
+    return False
+
+
+class ResponseCache(object):
+    """
+    GET responses of the current run, keyed on who asked for what.
+
+    start and stop nest, the responses are dropped when the outermost
+    run stops.
+    """
+
+    def __init__(self):
+        self._responses = {}
+        self._depth = 0
+        # Changed by every request that may modify something, a GET
+        # answered across a change is not remembered:
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Conditional GETs answered 304, and the bytes they did not
+        # download again:
+        self.not_modified = 0
+        self.bytes_saved = 0
+
+    def start(self):
+        self._lock.acquire()
+        try:
+            if not self._depth:
+                self.hits = 0
+                self.misses = 0
+                self.not_modified = 0
+                self.bytes_saved = 0
+            self._depth += 1
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        self._lock.acquire()
+        try:
+            self._depth -= 1
+            if self._depth:
+                return
+            self._responses = {}
+        finally:
+            self._lock.release()
+        log.debug("Response cache: %d hits, %d misses, %d not modified "
+                  "(%d bytes saved)" % (self.hits, self.misses,
+                  self.not_modified, self.bytes_saved))
+
+    def active(self):
+        return self._depth > 0
+
+    def get(self, key):
+        """
+        Return (True, response) for a remembered response, or
+        (False, generation) to pass to put once it is fetched.
+        """
+        self._lock.acquire()
+        try:
+            if key in self._responses:
+                self.hits += 1
+                return True, copy.deepcopy(self._responses[key])
+            self.misses += 1
+            return False, self._generation
+        finally:
+            self._lock.release()
+
+    def generation(self):
+        """
+        The generation to pass to put for a response fetched from now
+        on, without counting a miss like get does.
+        """
+        self._lock.acquire()
+        try:
+            return self._generation
+        finally:
+            self._lock.release()
+
+    def put(self, key, response, generation):
+        self._lock.acquire()
+        try:
+            if self._depth and generation == self._generation:
+                self._responses[key] = copy.deepcopy(response)
+        finally:
+            self._lock.release()
+
+    def count_not_modified(self, length):
+        self._lock.acquire()
+        try:
+            self.not_modified += 1
+            self.bytes_saved += length
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        self._lock.acquire()
+        try:
+            self._generation += 1
+            self._responses = {}
+        finally:
+            self._lock.release()
+
+
+class MemoizingRestlib(object):
+    """
+    Wraps the restlib of a UEPConnection, answering the GETs it makes
+    while cache is active from there. Everything else is passed on to
+    the restlib.
+    """
+
+    def __init__(self, restlib, cache):
+        self.restlib = restlib
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.restlib, name)
+
+    def _key(self, method, args, kwargs):
+        restlib = self.restlib
+        headers = kwargs.get('headers') or (args and args[0]) or {}
+        return (restlib.host, restlib.ssl_port, restlib.apihandler,
+                restlib.cert_file, restlib.username, method,
+                tuple(sorted(headers.items())))
+
+    def remembered(self, method):
+        """
+        Return (True, response) if a plain GET of method is remembered,
+        (False, None) otherwise.
+        """
+        if not self.cache.active() or not memoized(method):
+            return False, None
+        found, value = self.cache.get(self._key(method, (), {}))
+        if found:
+            return True, value
+        return False, None
+
+    def remember(self, method, response, generation):
+        """ Remember response as what a plain GET of method returns. """
+        if not memoized(method):
+            return
+        self.cache.put(self._key(method, (), {}), response, generation)
+
+    def request_get(self, method, *args, **kwargs):
+        if not self.cache.active() or not memoized(method):
+            return self.restlib.request_get(method, *args, **kwargs)
+        key = self._key(method, args, kwargs)
+        found, value = self.cache.get(key)
+        if found:
+            log.debug("Response cache hit: GET %s" % method)
+            return value
+        response = self.restlib.request_get(method, *args, **kwargs)
+        self.cache.put(key, response, value)
+        return response
+
+    def _modify(self, request, method, *args, **kwargs):
+        self.cache.invalidate()
+        try:
+            return request(method, *args, **kwargs)
+        finally:
+            self.cache.invalidate()
+
+    def request_post(self, method, *args, **kwargs):
+        return self._modify(self.restlib.request_post, method, *args, **kwargs)
+
+    def request_put(self, method, *args, **kwargs):
+        return self._modify(self.restlib.request_put, method, *args, **kwargs)
+
+    def request_delete(self, method, *args, **kwargs):
+        return self._modify(self.restlib.request_delete, method, *args, **kwargs)
+
+
+def _unwrap(uep):
+    """ Return the MemoizingRestlib of uep, or None, and its restlib. """
+    conn = getattr(uep, 'conn', None)
+    if isinstance(conn, MemoizingRestlib):
+        return conn, conn.restlib
+    return None, conn
+
+
+def takes_headers(request):
+    """
+    Whether request, the _request method of a restlib or content
+    connection, takes the extra headers a conditional GET sends. That of
+    an older python-rhsm does not.
+    """
+    try:
+        return 'headers' in inspect.getargspec(request)[0]
+    except TypeError:
+        return False
+
+
+def supports_conditional(uep):
+    """ Whether conditional_get can be used with the connection uep. """
+    restlib = _unwrap(uep)[1]
+    if not isinstance(restlib, connection.Restlib):
+        return False
+    return takes_headers(super(connection.Restlib, restlib)._request)
+
+
+def response_validators(result):
+    """
+    The validators of result, a response as BaseRestLib._request returns
+    it, or None if it has none.
+    """
+    headers = {}
+    for name, value in result['headers'].items():
+        headers[name.lower()] = value
+    validators = {}
+    if headers.get('etag'):
+        validators['etag'] = headers['etag']
+    if headers.get('last-modified'):
+        validators['last_modified'] = headers['last-modified']
+    if not validators:
+        return None
+    validators['length'] = len(result['content'])
+    return validators
+
+
+def validator_headers(validators):
+    """ The headers making a GET conditional on validators. """
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def conditional_get(uep, method, validators=None):
+    """
+    GET method with the connection uep, unless the response did not
+    change since it came with validators, as returned by an earlier call.
+
+    Returns (modified, response, validators). modified is False if the
+    server answered 304 Not Modified, response is None then. validators
+    are those to send next time, None if the server sent none.
+
+    A response the ResponseCache remembers is returned as modified, and
+    without validators.
+    """
+    memo, restlib = _unwrap(uep)
+    generation = None
+    if memo is not None:
+        found, response = memo.remembered(method)
+        if found:
+            return True, response, None
+        generation = memo.cache.generation()
+
+    # The response itself, not the content Restlib parses out of it:
+    try:
+        result = super(connection.Restlib, restlib)._request("GET", method,
+                headers=validator_headers(validators))
+        status = str(result['status'])
+    except connection.RestlibException, e:
+        # How a python-rhsm not expecting it answers a 304:
+        if str(e.code) != "304":
+            raise
+        status = "304"
+    if status == "304":
+        length = (validators and validators.get('length')) or 0
+        log.debug("Not modified, %d bytes saved: GET %s" % (length, method))
+        if memo is not None:
+            memo.cache.count_not_modified(length)
+        return False, None, validators
+
+    response = None
+    if result['content']:
+        response = json.loads(result['content'])
+    if memo is not None:
+        memo.remember(method, response, generation)
+    return True, response, response_validators(result)
@@ -0,0 +1,439 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+"""
+Where the local state (caches, product id database) is kept.
+
+By default every piece of state is a file of its own. With the
+state_store setting enabled they are rows of a single SQLite database
+instead, keyed on the path of the file they replace. Updates made
+between StateStore.begin and commit, see in_transaction, are then
+committed together, and everything is read through one open database.
+
+Files found at the path of a missing key are moved into the database the
+first time the key is read, so enabling the store migrates existing
+state as it is used. Not all of it is a cache that can be regenerated,
+the product id database is kept there too, so once the store is disabled
+again everything in it is written back to files and the database is
+removed.
+
+The open_state, write_state, rename_state, remove_state, state_exists
+and state_mtime functions act on the store if it is enabled, and on the file otherwise.
+"""
+
+from cStringIO import StringIO
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import sqlite3
+except ImportError:
+    # python 2.4
+    sqlite3 = None
+
+from rhsm.config import initConfig
+
+log = logging.getLogger('rhsm-app.' + __name__)
+
+cfg = initConfig()
+
+STATE_DB = "/var/lib/rhsm/state.db"
+
+
+class StateStoreError(IOError):
+    """ Raised when the state store can not be read or written. """
+    pass
+
+
+def _write_atomic(path, dump):
+    """
+    Write a file through dump(open_file) to a temp file, and rename it
+    into place so readers never see it partially written.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix='.', dir=os.path.dirname(path))
+    try:
+        f = os.fdopen(fd, "wb")
+        try:
+            dump(f)
+        finally:
+            f.close()
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class StateStore(object):
+    """
+    State kept in one SQLite database, as (data, mtime) entries keyed on
+    the path of the file each would otherwise be.
+
+    The connection is shared by every thread, but transactions are per
+    thread: updates made by a thread between begin and commit are only
+    seen by that thread until they are committed.
+    """
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        db_dir = os.path.dirname(self.path)
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        try:
+            conn = sqlite3.connect(self.path, timeout=10,
+                    check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS state "
+                    "(key TEXT PRIMARY KEY, data BLOB NOT NULL, mtime REAL NOT NULL)")
+            conn.commit()
+        except sqlite3.Error, e:
+            raise StateStoreError("Unable to open state store %s: %s" %
+                    (self.path, e))
+        os.chmod(self.path, 0644)
+        self._conn = conn
+        return conn
+
+    def _staged(self):
+        """ The updates of this thread's open transaction, or None. """
+        if getattr(self._local, 'depth', 0):
+            return self._local.staged
+        return None
+
+    def _select(self, key):
+        self._lock.acquire()
+        try:
+            try:
+                row = self._connect().execute(
+                        "SELECT data, mtime FROM state WHERE key = ?",
+                        (key,)).fetchone()
+            except sqlite3.Error, e:
+                raise StateStoreError("Unable to read %s from state store: %s" %
+                        (key, e))
+        finally:
+            self._lock.release()
+        if row is None:
+            return None
+        return (str(row[0]), row[1])
+
+    def _apply(self, changes):
+        """ Commit a dict of key to (data, mtime), or None to delete. """
+        self._lock.acquire()
+        try:
+            conn = self._connect()
+            try:
+                for key, entry in changes.items():
+                    if entry is None:
+                        conn.execute("DELETE FROM state WHERE key = ?", (key,))
+                    else:
+                        conn.execute("INSERT OR REPLACE INTO state "
+                                "(key, data, mtime) VALUES (?, ?, ?)",
+                                (key, sqlite3.Binary(entry[0]), entry[1]))
+                conn.commit()
+            except sqlite3.Error, e:
+                conn.rollback()
+                raise StateStoreError("Unable to write state store: %s" % e)
+        finally:
+            self._lock.release()
+
+    def _import_file(self, key):
+        """
+        Move the file at key into the store, returns its entry or None if
+        there is no such file.
+        """
+        try:
+            f = open(key, "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            mtime = os.stat(key).st_mtime
+        except (IOError, OSError):
+            return None
+
+        self._lock.acquire()
+        try:
+            conn = self._connect()
+            try:
+                # Another process may have migrated it meanwhile:
+                conn.execute("INSERT OR IGNORE INTO state (key, data, mtime) "
+                        "VALUES (?, ?, ?)", (key, sqlite3.Binary(data), mtime))
+                conn.commit()
+            except sqlite3.Error, e:
+                conn.rollback()
+                raise StateStoreError("Unable to migrate %s to state store: %s" %
+                        (key, e))
+        finally:
+            self._lock.release()
+        log.info("Migrated %s to the state store" % key)
+        try:
+            os.remove(key)
+        except OSError:
+            pass
+        return self._select(key)
+
+    def get(self, key):
+        """ Return the (data, mtime) stored for key, or None. """
+        staged = self._staged()
+        if staged is not None and key in staged:
+            return staged[key]
+        entry = self._select(key)
+        if entry is None and os.path.isfile(key):
+            entry = self._import_file(key)
+        return entry
+
+    def put(self, key, data, mtime=None):
+        if mtime is None:
+            mtime = time.time()
+        self._update(key, (data, mtime))
+
+    def delete(self, key):
+        self._update(key, None)
+        # Or reading key would migrate it back:
+        if os.path.exists(key):
+            os.remove(key)
+
+    def _update(self, key, entry):
+        staged = self._staged()
+        if staged is not None:
+            staged[key] = entry
+        else:
+            self._apply({key: entry})
+
+    def begin(self):
+        """
+        Start a transaction, updates from this thread are committed
+        together by the matching commit. Transactions nest.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if not depth:
+            self._local.staged = {}
+            self._local.aborted = False
+        self._local.depth = depth + 1
+
+    def commit(self):
+        self._local.depth -= 1
+        if not self._local.depth:
+            staged = self._local.staged
+            self._local.staged = None
+            if staged and not self._local.aborted:
+                self._apply(staged)
+
+    def rollback(self):
+        """
+        Drop the updates of the transaction. Rolling back a nested
+        transaction aborts the outermost one, its commit is then a
+        rollback too.
+        """
+        self._local.depth -= 1
+        self._local.aborted = True
+        self._local.staged.clear()
+        if not self._local.depth:
+            self._local.staged = None
+
+    def export(self):
+        """
+        Write every entry back to the file at its key, unless that file
+        has been written since, and remove the database.
+        """
+        self._lock.acquire()
+        try:
+            try:
+                rows = self._connect().execute(
+                        "SELECT key, data, mtime FROM state").fetchall()
+            except sqlite3.Error, e:
+                raise StateStoreError("Unable to read state store %s: %s" %
+                        (self.path, e))
+            for key, data, mtime in rows:
+                if os.path.exists(key) and os.stat(key).st_mtime >= mtime:
+                    continue
+                state_dir = os.path.dirname(key)
+                if not os.access(state_dir, os.R_OK):
+                    os.makedirs(state_dir)
+                _write_atomic(key, lambda f: f.write(str(data)))
+                os.utime(key, (mtime, mtime))
+                log.info("Exported %s from the state store" % key)
+            self.close()
+            os.remove(self.path)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        finally:
+            self._lock.release()
+
+
+def _get_state_store_enabled():
+    """
+    Whether to keep the local state in a single SQLite database, rather
+    than in files (the default).
+    """
+    if not cfg.has_option('rhsm', 'state_store'):
+        return False
+    try:
+        return bool(cfg.get_int('rhsm', 'state_store'))
+    except ValueError:
+        log.warn("Ignoring invalid state_store setting")
+        return False
+
+
+_state_store = None
+_exported = False
+
+
+def _export_state_store():
+    """
+    Move the state left in the store while it was enabled back to files.
+    """
+    global _exported
+    if _exported:
+        return
+    _exported = True
+    if sqlite3 is None or not os.path.exists(STATE_DB):
+        return
+    try:
+        StateStore(STATE_DB).export()
+    except (IOError, OSError), e:
+        log.error("Unable to export state store %s: %s" % (STATE_DB, e))
+
+
+def get_state_store():
+    """
+    Return the state store, or None if the state is kept in files.
+    """
+    global _state_store
+    if not _get_state_store_enabled():
+        _export_state_store()
+        return None
+    if sqlite3 is None:
+        log.warn("sqlite3 is not available, keeping state in files")
+        return None
+    if _state_store is None:
+        _state_store = StateStore()
+    return _state_store
+
+
+def in_transaction(func, *args, **kwargs):
+    """
+    Call func, committing the state store updates it makes together. Any
+    exception it raises rolls them back.
+    """
+    store = get_state_store()
+    if store is None:
+        return func(*args, **kwargs)
+    store.begin()
+    succeeded = False
+    try:
+        result = func(*args, **kwargs)
+        succeeded = True
+    finally:
+        if not succeeded:
+            store.rollback()
+    store.commit()
+    return result
+
+
+def open_state(path):
+    """
+    Open the state at path for reading. Raises IOError if there is none.
+    """
+    store = get_state_store()
+    if store is None:
+        return open(path, "rb")
+    entry = store.get(path)
+    if entry is None:
+        raise IOError("No such state: %s" % path)
+    return StringIO(entry[0])
+
+
+def write_state(path, dump):
+    """
+    Write the state at path through dump(open_file), replacing whatever
+    was there in one go.
+    """
+    store = get_state_store()
+    if store is None:
+        state_dir = os.path.dirname(path)
+        if not os.access(state_dir, os.R_OK):
+            os.makedirs(state_dir)
+        _write_atomic(path, dump)
+        return
+    buf = StringIO()
+    dump(buf)
+    store.put(path, buf.getvalue())
+
+
+def rename_state(path, new_path):
+    """
+    Move the state at path, with its mtime, to new_path. If there is none
+    the state at new_path is removed.
+    """
+    store = get_state_store()
+    if store is None:
+        if os.path.exists(path):
+            os.rename(path, new_path)
+        elif os.path.exists(new_path):
+            os.remove(new_path)
+        return
+    entry = store.get(path)
+    if entry is None:
+        store.delete(new_path)
+        return
+    store.put(new_path, entry[0], entry[1])
+    store.delete(path)
+
+
+def remove_state(path):
+    """ Remove the state at path, if there is any. """
+    store = get_state_store()
+    if store is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    store.delete(path)
+
+
+def state_exists(path):
+    store = get_state_store()
+    if store is None:
+        return os.path.exists(path)
+    return store.get(path) is not None
+
+
+def state_mtime(path):
+    """
+    Return when the state at path was last written. Raises OSError if
+    there is none.
+    """
+    store = get_state_store()
+    if store is None:
+        return os.stat(path).st_mtime
+    entry = store.get(path)
+    if entry is None:
+        raise OSError("No such state: %s" % path)
+    return entry[1]
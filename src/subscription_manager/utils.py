@@ -25,6 +25,7 @@ import syslog
 import urllib
 
 from M2Crypto.SSL import SSLError
+from rhsm.https import ssl
 
 from subscription_manager.branding import get_branding
 from subscription_manager.hwprobe import ClassicCheck
@@ -140,7 +141,7 @@ def is_valid_server_info(hostname, port, prefix):
         else:
             log.exception(e)
             return False
-    except SSLError, e:
+    except (SSLError, ssl.SSLError), e:
         # Indicates a missing CA certificate, which callers may need to
         # notify the user of:
         raise MissingCaCertException(e)
@@ -40,7 +40,8 @@ Requires:  python-ethtool
 Requires:  python-iniparse
 Requires:  pygobject2
 Requires:  virt-what
-Requires:  python-rhsm >= 1.12.3
+Requires:  python-rhsm >= 1.19.2
+Requires:  m2crypto
 Requires:  dbus-python
 Requires:  yum >= 3.2.19-15
 Requires:  usermode
@@ -241,9 +242,12 @@ rm -rf %{buildroot}
 %{_datadir}/rhsm/subscription_manager/base_plugin.py*
 %{_datadir}/rhsm/subscription_manager/branding
 %{_datadir}/rhsm/subscription_manager/cache.py*
+%{_datadir}/rhsm/subscription_manager/statestore.py*
 %{_datadir}/rhsm/subscription_manager/certdirectory.py*
+%{_datadir}/rhsm/subscription_manager/certcache.py*
 %{_datadir}/rhsm/subscription_manager/certlib.py*
 %{_datadir}/rhsm/subscription_manager/content_action_client.py*
+%{_datadir}/rhsm/subscription_manager/compactcontent.py*
 %{_datadir}/rhsm/subscription_manager/action_client.py*
 %{_datadir}/rhsm/subscription_manager/cert_sorter.py*
 %{_datadir}/rhsm/subscription_manager/cli.py*
@@ -284,6 +288,8 @@ rm -rf %{buildroot}
 %{_datadir}/rhsm/subscription_manager/validity.py*
 %{_datadir}/rhsm/subscription_manager/reasons.py*
 %{_datadir}/rhsm/subscription_manager/cp_provider.py*
+%{_datadir}/rhsm/subscription_manager/connpool.py*
+%{_datadir}/rhsm/subscription_manager/requestcache.py*
 %{_datadir}/rhsm/subscription_manager/file_monitor.py*
 %{_datadir}/rhsm/subscription_manager/overrides.py*
 %{_datadir}/rhsm/subscription_manager/exceptions.py*
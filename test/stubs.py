@@ -22,9 +22,11 @@ import tempfile
 
 from subscription_manager.cert_sorter import CertSorter
 from subscription_manager.cache import EntitlementStatusCache, ProductStatusCache, \
-        OverrideStatusCache, ProfileManager, InstalledProductsManager
+        OverrideStatusCache, ProfileManager, InstalledProductsManager, \
+        ReleaseListingCache
 from subscription_manager.facts import Facts
 from subscription_manager.lock import ActionLock
+from subscription_manager.requestcache import ResponseCache
 from rhsm.certificate import GMT
 from subscription_manager.gui.utils import AsyncWidgetUpdater, handle_gui_exception
 from rhsm.certificate2 import Version
@@ -547,6 +549,7 @@ class StubCPProvider(object):
     basic_auth_cp = StubUEP()
     no_auth_cp = StubUEP()
     content_connection = StubContentConnection()
+    response_cache = ResponseCache()
 
     def set_connection_info(self,
                 host=None,
@@ -614,6 +617,16 @@ class StubOverrideStatusCache(OverrideStatusCache):
         self.server_status = None
 
 
+class StubReleaseListingCache(ReleaseListingCache):
+
+    def __init__(self):
+        ReleaseListingCache.__init__(self)
+        self.listings = {}
+
+    def write_cache(self):
+        pass
+
+
 class StubPool(object):
 
     def __init__(self, poolid):
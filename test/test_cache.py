@@ -18,7 +18,7 @@ import shutil
 import socket
 import tempfile
 import threading
-from mock import Mock
+from mock import Mock, patch
 
 # used to get a user readable cfg class for test cases
 from stubs import StubProduct, StubProductCertificate, StubCertificateDirectory, \
@@ -28,11 +28,15 @@ from fixture import SubManFixture
 from rhsm import ourjson as json
 from subscription_manager.cache import ProfileManager, \
         InstalledProductsManager, EntitlementStatusCache, \
-        PoolTypeCache
+        ProductStatusCache, OverrideStatusCache, PoolTypeCache, CacheManager, \
+        CacheSerializer, BinaryCacheSerializer, CacheWriter, cache_writer, \
+        status_refresher, package_profile_delta, DIGEST_SUFFIX
 import subscription_manager.injection as inj
 from rhsm.profile import Package, RPMProfile
 
 from rhsm.connection import RestlibException, UnauthorizedException
+from rhsm.https import ssl
+from M2Crypto import SSL
 
 from subscription_manager import injection as inj
 
@@ -166,6 +170,175 @@ class TestProfileManager(unittest.TestCase):
         return mock_profile
 
 
+def _pkg(name, version="1.0", release="1", arch="x86_64"):
+    return {'name': name, 'version': version, 'release': release,
+            'arch': arch, 'epoch': 0, 'vendor': None}
+
+
+class TestPackageProfileDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.cached = [_pkg("bash"), _pkg("kernel", "1"), _pkg("kernel", "2"),
+                       _pkg("vim"), _pkg("zsh")]
+
+    def test_no_changes(self):
+        delta = package_profile_delta(self.cached, list(reversed(self.cached)))
+        self.assertEquals({'added': [], 'removed': [], 'changed': []}, delta)
+
+    def test_added_removed(self):
+        current = self.cached[:-1] + [_pkg("tmux")]
+        delta = package_profile_delta(self.cached, current)
+        self.assertEquals([_pkg("tmux")], delta['added'])
+        self.assertEquals([_pkg("zsh")], delta['removed'])
+        self.assertEquals([], delta['changed'])
+
+    def test_changed(self):
+        current = [_pkg("bash", "2.0")] + self.cached[1:]
+        delta = package_profile_delta(self.cached, current)
+        self.assertEquals([], delta['added'])
+        self.assertEquals([], delta['removed'])
+        self.assertEquals(1, len(delta['changed']))
+        self.assertEquals("2.0", delta['changed'][0]['version'])
+        self.assertEquals({'epoch': 0, 'version': '1.0', 'release': '1'},
+                delta['changed'][0]['previous'])
+
+    def test_multiple_versions_not_changed(self):
+        current = [p for p in self.cached if p['version'] != "1"] + [_pkg("kernel", "3")]
+        delta = package_profile_delta(self.cached, current)
+        self.assertEquals([_pkg("kernel", "3")], delta['added'])
+        self.assertEquals([_pkg("kernel", "1")], delta['removed'])
+        self.assertEquals([], delta['changed'])
+
+
+class TestProfileManagerDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.pkgs = [Package(name="package%s" % i, version="1.0.0", release=1,
+                             arch="x86_64") for i in range(10)]
+        self.profile_mgr = ProfileManager(
+                current_profile=TestProfileManager._mock_pkg_profile(self.pkgs))
+        self.profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        self.profile_mgr.write_cache()
+        self.uep = Mock()
+        self.uep.supports_resource.return_value = True
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _change_package(self):
+        self.pkgs[0] = Package(name="package0", version="2.0.0", release=1,
+                               arch="x86_64")
+        self.profile_mgr.current_profile = TestProfileManager._mock_pkg_profile(self.pkgs)
+
+    def test_delta_upload(self):
+        cached = self.profile_mgr.to_dict()
+        self._change_package()
+        self.profile_mgr._sync_with_server(self.uep, 'FAKEUUID')
+
+        self.assertEquals(0, self.uep.updatePackageProfile.call_count)
+        method, delta = self.uep.conn.request_put.call_args[0]
+        self.assertEquals("/consumers/FAKEUUID/packages/delta", method)
+        self.assertEquals(['package0'], [p['name'] for p in delta['changed']])
+        self.assertEquals(self.profile_mgr._digest(cached), delta['base'])
+
+    def test_delta_not_supported(self):
+        self.uep.supports_resource.return_value = False
+        self._change_package()
+        self.profile_mgr._sync_with_server(self.uep, 'FAKEUUID')
+
+        self.assertEquals(0, self.uep.conn.request_put.call_count)
+        self.uep.updatePackageProfile.assert_called_with('FAKEUUID',
+                self.profile_mgr.to_dict())
+
+    def test_delta_rejected(self):
+        self.uep.conn.request_put.side_effect = RestlibException(409, "base mismatch")
+        self._change_package()
+        self.profile_mgr._sync_with_server(self.uep, 'FAKEUUID')
+
+        self.uep.updatePackageProfile.assert_called_with('FAKEUUID',
+                self.profile_mgr.to_dict())
+
+    def test_no_cache(self):
+        os.remove(self.profile_mgr.CACHE_FILE)
+        self.profile_mgr._sync_with_server(self.uep, 'FAKEUUID')
+        self.assertEquals(0, self.uep.conn.request_put.call_count)
+        self.assertEquals(1, self.uep.updatePackageProfile.call_count)
+
+    def test_large_change_uploads_full(self):
+        self.profile_mgr.current_profile = TestProfileManager._mock_pkg_profile(
+                [Package(name="other%s" % i, version="1.0.0", release=1,
+                         arch="x86_64") for i in range(10)])
+        self.profile_mgr._sync_with_server(self.uep, 'FAKEUUID')
+        self.assertEquals(0, self.uep.conn.request_put.call_count)
+        self.assertEquals(1, self.uep.updatePackageProfile.call_count)
+
+
+class TestProfileManagerRpmdb(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fingerprint = [['Packages', 1, 2048, 1400000000.5]]
+        self.fingerprint_patcher = patch('subscription_manager.cache.rpmdb_fingerprint')
+        self.fingerprint_mock = self.fingerprint_patcher.start()
+        self.fingerprint_mock.side_effect = lambda: self.fingerprint
+
+        pkgs = [Package(name="package1", version="1.0.0", release=1, arch="x86_64")]
+        self.profile = TestProfileManager._mock_pkg_profile(pkgs)
+
+    def tearDown(self):
+        self.fingerprint_patcher.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def _profile_mgr(self):
+        profile_mgr = ProfileManager()
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr._get_profile = Mock(return_value=self.profile)
+        return profile_mgr
+
+    def test_unchanged_rpmdb_skips_collection(self):
+        self._profile_mgr().write_cache()
+
+        profile_mgr = self._profile_mgr()
+        self.assertFalse(profile_mgr.has_changed())
+        self.assertEquals(0, profile_mgr._get_profile.call_count)
+
+    def test_changed_rpmdb_collects(self):
+        self._profile_mgr().write_cache()
+        self.fingerprint = [['Packages', 1, 4096, 1400000100.5]]
+
+        profile_mgr = self._profile_mgr()
+        self.assertFalse(profile_mgr.has_changed())
+        self.assertEquals(1, profile_mgr._get_profile.call_count)
+
+    def test_no_rpmdb_collects(self):
+        self._profile_mgr().write_cache()
+        self.fingerprint = None
+
+        profile_mgr = self._profile_mgr()
+        profile_mgr.has_changed()
+        self.assertEquals(1, profile_mgr._get_profile.call_count)
+
+    def test_given_profile_not_fingerprinted(self):
+        profile_mgr = ProfileManager(current_profile=self.profile)
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr.write_cache()
+        self.assertFalse(os.path.exists(profile_mgr.CACHE_FILE + '.rpmdb'))
+
+    def test_fingerprint_taken_before_collecting(self):
+        profile_mgr = self._profile_mgr()
+
+        def install_while_collecting(profile_type):
+            self.fingerprint = [['Packages', 1, 4096, 1400000100.5]]
+            return self.profile
+        profile_mgr._get_profile = Mock(side_effect=install_while_collecting)
+        profile_mgr.write_cache()
+
+        profile_mgr = self._profile_mgr()
+        profile_mgr.has_changed()
+        self.assertEquals(1, profile_mgr._get_profile.call_count)
+
+
 class TestInstalledProductsCache(SubManFixture):
 
     def setUp(self):
@@ -283,6 +456,15 @@ class TestEntitlementStatusCache(SubManFixture):
         status = self.status_cache.load_status(uep, "SOMEUUID")
         self.assertEquals(None, status)
 
+    def test_server_ssl_error(self):
+        # From a connection made by python-rhsm over M2Crypto, and from one
+        # made with rhsm.https:
+        for error in [SSL.SSLError("boom"), ssl.SSLError("boom")]:
+            uep = Mock()
+            uep.getCompliance = Mock(side_effect=error)
+            self.assertEquals(None, self.status_cache.load_status(uep, "SOMEUUID"))
+            self.assertTrue(self.status_cache.last_error is error)
+
     def test_server_network_error(self):
         dummy_status = {"a": "1"}
         uep = Mock()
@@ -308,20 +490,11 @@ class TestEntitlementStatusCache(SubManFixture):
         cache_file = os.path.join(cache_dir, 'status_cache.json')
         status_cache.CACHE_FILE = cache_file
         status_cache.write_cache()
-
-        def threadActive(name):
-            for thread in threading.enumerate():
-                if thread.getName() == name:
-                    return True
-            return False
-
-        # If the file exists, and the thread that writes it does not, we know writing has completed
-        while not (os.path.exists(cache_file) and not threadActive("WriteCacheEntitlementStatusCache")):
-            pass
+        cache_writer.flush()
         try:
-            new_status_buf = open(cache_file).read()
-            new_status = json.loads(new_status_buf)
-            self.assertEquals(new_status, mock_server_status)
+            new_status_cache = EntitlementStatusCache()
+            new_status_cache.CACHE_FILE = cache_file
+            self.assertEquals(new_status_cache._read_cache(), mock_server_status)
         finally:
             shutil.rmtree(cache_dir)
 
@@ -331,6 +504,381 @@ class TestEntitlementStatusCache(SubManFixture):
         self.assertEquals(None, self.status_cache.load_status(uep, "aaa"))
 
 
+class TestCacheWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.writer = CacheWriter()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _status_cache(self, cls, name):
+        status_cache = cls()
+        status_cache.CACHE_FILE = os.path.join(self.cache_dir, name)
+        return status_cache
+
+    def _read(self, cls, cache_file):
+        status_cache = cls()
+        status_cache.CACHE_FILE = cache_file
+        return status_cache._read_cache()
+
+    def test_latest_state_lands(self):
+        caches = [self._status_cache(EntitlementStatusCache, 'entitlement_status.json'),
+                  self._status_cache(ProductStatusCache, 'product_status.json'),
+                  self._status_cache(OverrideStatusCache, 'content_overrides.json')]
+        written = []
+        for status_cache in caches:
+            write_data = status_cache._write_data
+
+            def counting_write(data, debug=True, write_data=write_data):
+                written.append(data)
+                return write_data(data, debug)
+            status_cache._write_data = counting_write
+
+        # Several threads racing to write each cache, like the writes made
+        # during one ActionClient.update():
+        def write_all(thread_id):
+            for i in range(1000):
+                for status_cache in caches:
+                    status_cache.server_status = {'thread': thread_id, 'write': i}
+                    self.writer.write(status_cache)
+
+        threads = [threading.Thread(target=write_all, args=[thread_id])
+                   for thread_id in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Each thread's last write is the last one queued for each cache:
+        last = {}
+        for status_cache in caches:
+            status_cache.server_status = {'thread': 'main', 'write': 'last'}
+            self.writer.write(status_cache)
+            last[status_cache.CACHE_FILE] = status_cache.server_status
+        self.writer.flush()
+
+        for status_cache in caches:
+            self.assertEquals(last[status_cache.CACHE_FILE],
+                    self._read(status_cache.__class__, status_cache.CACHE_FILE))
+        self.assertTrue(len(written) < 3 * 3 * 1000)
+        self.assertEquals(sorted(['entitlement_status.json', 'product_status.json',
+                'content_overrides.json']), sorted(os.listdir(self.cache_dir)))
+
+    def test_discard(self):
+        status_cache = self._status_cache(EntitlementStatusCache, 'entitlement_status.json')
+        status_cache.server_status = {'status': 'valid'}
+        status_cache._write_data = Mock()
+        self.writer._start = Mock()
+        self.writer.write(status_cache)
+        self.writer.discard(status_cache.CACHE_FILE)
+        self.writer.flush()
+        self.assertEquals(0, status_cache._write_data.call_count)
+
+    def test_failed_write_keeps_writer(self):
+        broken = self._status_cache(EntitlementStatusCache, 'entitlement_status.json')
+        broken._write_data = Mock(side_effect=RuntimeError("boom"))
+        broken.server_status = {'status': 'valid'}
+        self.writer.write(broken)
+
+        status_cache = self._status_cache(ProductStatusCache, 'product_status.json')
+        status_cache.server_status = [{'productId': '69'}]
+        self.writer.write(status_cache)
+        self.writer.flush()
+        self.assertEquals([{'productId': '69'}],
+                self._read(ProductStatusCache, status_cache.CACHE_FILE))
+
+
+class TestStatusCacheFreshness(SubManFixture):
+
+    def setUp(self):
+        super(TestStatusCacheFreshness, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.status_cache = self._status_cache()
+        self.status_cache.server_status = {'status': 'cached'}
+        CacheManager.write_cache(self.status_cache, False)
+
+        self.freshness_patcher = patch('subscription_manager.cache._get_status_cache_freshness')
+        self.freshness_patcher.start().return_value = 300
+        # Refreshes are run by the tests, not at exit:
+        self.atexit_patcher = patch('subscription_manager.cache.atexit')
+        self.atexit_patcher.start()
+
+        self.uep = Mock()
+        self.uep.getCompliance.return_value = {'status': 'server'}
+
+    def tearDown(self):
+        super(TestStatusCacheFreshness, self).tearDown()
+        self.freshness_patcher.stop()
+        self.atexit_patcher.stop()
+        status_refresher._refreshes = []
+        cache_writer.flush()
+        shutil.rmtree(self.cache_dir)
+
+    def _status_cache(self):
+        status_cache = EntitlementStatusCache()
+        status_cache.CACHE_FILE = os.path.join(self.cache_dir, 'entitlement_status.json')
+        status_cache.DEPENDS_ON = []
+        return status_cache
+
+    def _wait_for_refresh(self, status_cache):
+        status_refresher.run()
+
+    def test_fresh_cache_served(self):
+        status_cache = self._status_cache()
+        self.assertEquals({'status': 'cached'}, status_cache.load_status(self.uep, 'UUID'))
+        self.assertTrue(0 <= status_cache.cached_age < 300)
+        # Not before the process is done:
+        self.assertEquals(0, self.uep.getCompliance.call_count)
+
+        self._wait_for_refresh(status_cache)
+        self.assertEquals(1, self.uep.getCompliance.call_count)
+        self.assertEquals({'status': 'server'}, self._status_cache()._read_cache())
+
+    def test_stale_cache_not_served(self):
+        os.utime(self.status_cache.CACHE_FILE, (0, 0))
+        status_cache = self._status_cache()
+        self.assertEquals({'status': 'server'}, status_cache.load_status(self.uep, 'UUID'))
+        self.assertEquals(None, status_cache.cached_age)
+        self.assertEquals([], status_refresher._refreshes)
+
+    def test_disabled(self):
+        self.freshness_patcher.stop()
+        self.freshness_patcher.start().return_value = 0
+        status_cache = self._status_cache()
+        self.assertEquals({'status': 'server'}, status_cache.load_status(self.uep, 'UUID'))
+        self.assertEquals(None, status_cache.cached_age)
+
+    def test_changed_certificates_not_served(self):
+        cert_dir = os.path.join(self.cache_dir, 'entitlement')
+        os.mkdir(cert_dir)
+        status_cache = self._status_cache()
+        status_cache.DEPENDS_ON = ['entitlementCertDir']
+        cfg_patcher = patch('subscription_manager.cache.cfg')
+        cfg_patcher.start().get.return_value = cert_dir
+        try:
+            self.assertEquals({'status': 'server'}, status_cache.load_status(self.uep, 'UUID'))
+        finally:
+            cfg_patcher.stop()
+
+    def test_refreshed_once(self):
+        status_cache = self._status_cache()
+        status_cache.load_status(self.uep, 'UUID')
+        status_cache.load_status(self.uep, 'UUID')
+        self._wait_for_refresh(status_cache)
+        self.assertEquals(1, self.uep.getCompliance.call_count)
+
+    def test_failed_refresh_keeps_cache(self):
+        self.uep.getCompliance.side_effect = socket.error("boom")
+        status_cache = self._status_cache()
+        self.assertEquals({'status': 'cached'}, status_cache.load_status(self.uep, 'UUID'))
+        self._wait_for_refresh(status_cache)
+        self.assertEquals({'status': 'cached'}, self._status_cache()._read_cache())
+
+
+class TestCacheSerializer(SubManFixture):
+
+    def setUp(self):
+        super(TestCacheSerializer, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, 'cache', 'installed_products.bin')
+        self.legacy_file = os.path.join(self.cache_dir, 'cache', 'installed_products.json')
+        self.mgr = InstalledProductsManager()
+        self.mgr.CACHE_FILE = self.cache_file
+        self.mgr.LEGACY_CACHE_FILE = self.legacy_file
+        self.installed = {'a-product': {'productName': u'Product A',
+                'productId': u'a-product', 'version': u'1.0', 'arch': u'x86_64'}}
+        self.mgr.installed = self.installed
+
+    def tearDown(self):
+        super(TestCacheSerializer, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+
+    def _write_json(self, data, path=None):
+        path = path or self.cache_file
+        if not os.path.exists(os.path.dirname(path)):
+            os.mkdir(os.path.dirname(path))
+        f = open(path, 'w')
+        json.dump(data, f)
+        f.close()
+
+    def _is_binary(self):
+        f = open(self.cache_file, 'rb')
+        try:
+            return BinaryCacheSerializer.is_encoded(f)
+        finally:
+            f.close()
+
+    def test_binary_round_trip(self):
+        self.mgr.write_cache()
+        self.assertTrue(self._is_binary())
+        self.assertEquals(self.installed, self.mgr._read_cache())
+        self.assertEquals([], [name for name in os.listdir(os.path.dirname(self.cache_file))
+                               if name.startswith('.')])
+
+    def test_json_serializer(self):
+        self.mgr.SERIALIZER = CacheSerializer()
+        self.mgr.write_cache()
+        self.assertEquals(self.installed, json.load(open(self.cache_file)))
+        self.assertEquals(self.installed, self.mgr._read_cache())
+
+    def test_migrate_from_json(self):
+        self._write_json(self.installed, self.legacy_file)
+        os.utime(self.legacy_file, (1400000000, 1400000000))
+        open(self.legacy_file + DIGEST_SUFFIX, 'w').close()
+        self.assertEquals(self.installed, self.mgr._read_cache())
+        self.assertFalse(os.path.exists(self.legacy_file))
+        self.assertFalse(os.path.exists(self.legacy_file + DIGEST_SUFFIX))
+        self.assertTrue(os.path.exists(self.cache_file + DIGEST_SUFFIX))
+        self.assertEquals(1400000000, os.stat(self.cache_file).st_mtime)
+
+        self.mgr.write_cache()
+        self.assertTrue(self._is_binary())
+        self.assertEquals(self.installed, self.mgr._read_cache())
+
+    def test_legacy_removed_once_written(self):
+        self.mgr.write_cache()
+        self._write_json({}, self.legacy_file)
+        self.assertTrue(self.mgr._cache_exists())
+        self.assertFalse(os.path.exists(self.legacy_file))
+        self.assertEquals(self.installed, self.mgr._read_cache())
+
+    def test_delete_removes_legacy(self):
+        self._write_json(self.installed, self.legacy_file)
+        # delete_cache is a classmethod:
+        cache_patch = patch.object(InstalledProductsManager, 'CACHE_FILE',
+                self.cache_file)
+        legacy_patch = patch.object(InstalledProductsManager,
+                'LEGACY_CACHE_FILE', self.legacy_file)
+        cache_patch.start()
+        legacy_patch.start()
+        try:
+            self.mgr.delete_cache()
+        finally:
+            legacy_patch.stop()
+            cache_patch.stop()
+        self.assertFalse(os.path.exists(self.legacy_file))
+        self.assertFalse(self.mgr._cache_exists())
+
+    def test_other_version_ignored(self):
+        self.mgr.write_cache()
+        data = open(self.cache_file, 'rb').read()
+        f = open(self.cache_file, 'wb')
+        f.write(BinaryCacheSerializer.MAGIC + chr(BinaryCacheSerializer.VERSION + 1) +
+                data[len(BinaryCacheSerializer.MAGIC) + 1:])
+        f.close()
+        self.assertEquals(None, self.mgr._read_cache())
+
+    def test_corrupt_cache_ignored(self):
+        os.mkdir(os.path.dirname(self.cache_file))
+        f = open(self.cache_file, 'wb')
+        f.write(BinaryCacheSerializer.MAGIC + chr(BinaryCacheSerializer.VERSION) + "junk")
+        f.close()
+        self.assertEquals(None, self.mgr._read_cache())
+
+    def test_failed_write_keeps_old_cache(self):
+        self._write_json(self.installed)
+        self.mgr.SERIALIZER = Mock()
+        self.mgr.SERIALIZER.dump.side_effect = IOError("disk full")
+        self.mgr.write_cache()
+
+        self.assertEquals(self.installed, json.load(open(self.cache_file)))
+        self.assertEquals([], [name for name in os.listdir(os.path.dirname(self.cache_file))
+                               if name.startswith('.')])
+
+    def test_profile_round_trip(self):
+        profile = Mock()
+        profile.collect.return_value = [{'name': 'package1', 'version': '1.0.0',
+                'release': '1', 'arch': 'x86_64', 'epoch': 0, 'vendor': None}]
+        profile_mgr = ProfileManager(current_profile=profile)
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr.write_cache()
+
+        cached = profile_mgr._read_cache()
+        self.assertTrue(isinstance(cached, RPMProfile))
+        self.assertEquals(profile.collect.return_value, cached.collect())
+
+    def test_unmarshallable_falls_back_to_json(self):
+        # marshal only takes plain dicts:
+        class InstalledDict(dict):
+            pass
+        self.mgr.installed = InstalledDict(self.installed)
+        self.mgr.write_cache()
+        self.assertFalse(self._is_binary())
+        self.assertEquals(self.installed, self.mgr._read_cache())
+
+
+class TestCacheDigest(SubManFixture):
+
+    def setUp(self):
+        super(TestCacheDigest, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.prod_dir = StubCertificateDirectory([
+            StubProductCertificate(StubProduct('a-product', name="Product A"))])
+        inj.provide(inj.PROD_DIR, self.prod_dir)
+        self.mgr = InstalledProductsManager()
+        self.mgr.CACHE_FILE = os.path.join(self.cache_dir, 'installed_products.json')
+        self.digest_file = self.mgr.CACHE_FILE + '.digest'
+
+    def tearDown(self):
+        super(TestCacheDigest, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+
+    def test_unchanged_without_reading_cache(self):
+        self.mgr.write_cache()
+        self.assertTrue(os.path.exists(self.digest_file))
+        self.mgr._read_cache = Mock()
+        self.assertFalse(self.mgr.has_changed())
+        self.assertEquals(0, self.mgr._read_cache.call_count)
+
+    def test_changed_without_reading_cache(self):
+        self.mgr.write_cache()
+        self.prod_dir.certs.append(StubProductCertificate(
+            StubProduct('b-product', name="Product B")))
+        self.mgr._read_cache = Mock()
+        self.assertTrue(self.mgr.has_changed())
+        self.assertEquals(0, self.mgr._read_cache.call_count)
+
+    def test_no_digest_compares_cache(self):
+        self.mgr.write_cache()
+        os.remove(self.digest_file)
+        self.mgr._read_cache = Mock(return_value=self.mgr.installed)
+        self.assertFalse(self.mgr.has_changed())
+        self.assertEquals(1, self.mgr._read_cache.call_count)
+
+    def test_failed_write_drops_digest(self):
+        self.mgr.write_cache()
+        self.mgr.SERIALIZER = Mock()
+        self.mgr.SERIALIZER.dump.side_effect = IOError("disk full")
+        self.mgr.write_cache()
+        self.assertFalse(os.path.exists(self.digest_file))
+
+    def test_delete_cache(self):
+        self.mgr.write_cache()
+        # delete_cache is a classmethod:
+        cache_patch = patch.object(InstalledProductsManager, 'CACHE_FILE',
+                self.mgr.CACHE_FILE)
+        cache_patch.start()
+        try:
+            self.mgr.delete_cache()
+        finally:
+            cache_patch.stop()
+        self.assertEquals([], os.listdir(self.cache_dir))
+
+    def test_profile_package_order_ignored(self):
+        pkgs = [Package(name="package1", version="1.0.0", release=1, arch="x86_64"),
+                Package(name="package2", version="2.0.0", release=2, arch="x86_64")]
+        profile_mgr = ProfileManager(current_profile=TestProfileManager._mock_pkg_profile(pkgs))
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr.write_cache()
+
+        pkgs.reverse()
+        profile_mgr.current_profile = TestProfileManager._mock_pkg_profile(pkgs)
+        profile_mgr._read_cache = Mock()
+        self.assertFalse(profile_mgr.has_changed())
+        self.assertEquals(0, profile_mgr._read_cache.call_count)
+
+
 class TestPoolTypeCache(SubManFixture):
 
     def setUp(self):
@@ -340,6 +888,15 @@ class TestPoolTypeCache(SubManFixture):
         self.cp = self.cp_provider.consumer_auth_cp
         certs = [StubEntitlementCertificate(StubProduct('pid1'), pool=StubPool('someid'))]
         self.ent_dir = StubEntitlementDirectory(certificates=certs)
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_patch = patch.object(PoolTypeCache, 'CACHE_FILE',
+                os.path.join(self.cache_dir, 'pool_types.json'))
+        self.cache_patch.start()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        shutil.rmtree(self.cache_dir)
+        super(TestPoolTypeCache, self).tearDown()
 
     def test_empty_cache(self):
         pooltype_cache = PoolTypeCache()
@@ -366,8 +923,35 @@ class TestPoolTypeCache(SubManFixture):
         self.assertFalse(pooltype_cache.requires_update())
 
     def test_update(self):
+        self._inject_mock_valid_consumer()
+        pooltype_cache = PoolTypeCache()
+        pooltype_cache.ent_dir = self.ent_dir
+        self.cp.getPool.return_value = self._build_pool_json('someid', 'some type')
+
+        # Only the missing pool is fetched:
+        pooltype_cache.update()
+
+        self.cp.getPool.assert_called_once_with('someid', 'VALIDCONSUMERUUID')
+        self.assertEquals(0, self.cp.getEntitlementList.call_count)
+        self.assertEquals('some type', pooltype_cache.get('someid'))
+
+    def test_update_pool_error(self):
+        self._inject_mock_valid_consumer()
         pooltype_cache = PoolTypeCache()
         pooltype_cache.ent_dir = self.ent_dir
+        self.cp.getPool.side_effect = RestlibException(404, "Not found")
+        self.cp.getEntitlementList.return_value = [
+                self._build_ent_json('someid', 'some type')]
+
+        pooltype_cache.update()
+
+        self.assertEquals('some type', pooltype_cache.get('someid'))
+
+    def test_update_many_missing(self):
+        self._inject_mock_valid_consumer()
+        pooltype_cache = PoolTypeCache()
+        pooltype_cache.ent_dir = self.ent_dir
+        pooltype_cache.MAX_POOL_REQUESTS = 0
         self.cp.getEntitlementList.return_value = [
                 self._build_ent_json('poolid', 'some type'),
                 self._build_ent_json('poolid2', 'some other type')]
@@ -376,6 +960,7 @@ class TestPoolTypeCache(SubManFixture):
         # to generate a correct mapping
         pooltype_cache.update()
 
+        self.assertEquals(0, self.cp.getPool.call_count)
         self.assertEquals(2, len(pooltype_cache.pooltype_map))
         self.assertEquals('some type', pooltype_cache.get('poolid'))
         self.assertEquals('some other type', pooltype_cache.get('poolid2'))
@@ -397,6 +982,28 @@ class TestPoolTypeCache(SubManFixture):
             expected_id = 'poolid' + str(i)
             self.assertEquals('some type', pooltype_cache.get(expected_id))
 
+    def test_persisted(self):
+        self._inject_mock_valid_consumer()
+        inj.provide(inj.ENT_DIR, self.ent_dir)
+        self.cp.getPool.return_value = self._build_pool_json('someid', 'some type')
+        PoolTypeCache()
+
+        self.cp.reset_mock()
+        pooltype_cache = PoolTypeCache()
+        self.assertEquals('some type', pooltype_cache.get('someid'))
+        self.assertEquals(0, self.cp.getPool.call_count)
+        self.assertEquals(0, self.cp.getEntitlementList.call_count)
+
+    def test_persists_attached_only(self):
+        inj.provide(inj.ENT_DIR, self.ent_dir)
+        pooltype_cache = PoolTypeCache()
+        pooltype_cache.update_from_pools({
+            'someid': self._build_pool_json('someid', 'some type'),
+            'otherid': self._build_pool_json('otherid', 'other type')})
+        pooltype_cache.update()
+
+        self.assertEquals({'someid': 'some type'}, PoolTypeCache()._read_cache())
+
     def test_requires_update_ents_with_no_pool(self):
         pooltype_cache = PoolTypeCache()
         pooltype_cache.ent_dir = self.ent_dir
@@ -0,0 +1,219 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from stubs import StubProduct, StubContent, StubEntitlementCertificate, \
+    StubProductCertificate
+from rhsm.certificate2 import EntitlementCertificate, Pool
+from subscription_manager.certcache import CertificateCache, cert_to_dict, \
+    cert_from_dict, file_signature
+from subscription_manager.certdirectory import CertificateDirectory
+
+
+class CertDictTests(unittest.TestCase):
+
+    def test_entitlement_round_trip(self):
+        content = [StubContent('content-a', required_tags='rhel-6,rhel-6-server'),
+                   StubContent('content-b', gpg='/gpg', enabled=0)]
+        cert = StubEntitlementCertificate(StubProduct('product1'),
+                provided_products=['product2'], content=content,
+                stacking_id='stack1', pool=Pool(id='pool1'))
+
+        restored = cert_from_dict(cert_to_dict(cert), '/tmp/1.pem')
+
+        self.assertEquals(cert.serial, restored.serial)
+        self.assertEquals('/tmp/1.pem', restored.path)
+        self.assertEquals(cert.valid_range.begin().replace(microsecond=0),
+                restored.valid_range.begin())
+        self.assertEquals(cert.valid_range.end().replace(microsecond=0),
+                restored.valid_range.end())
+        self.assertEquals(['product1', 'product2'], [p.id for p in restored.products])
+        self.assertEquals('stack1', restored.order.stacking_id)
+        self.assertEquals('pool1', restored.pool.id)
+        self.assertEquals(['content-a', 'content-b'], [c.label for c in restored.content])
+        self.assertEquals(('rhel-6', 'rhel-6-server'), restored.content[0].required_tags)
+        self.assertFalse(restored.content[1].enabled)
+        self.assertEquals('/tmp/1-key.pem', restored.key_path())
+
+    def test_product_round_trip(self):
+        cert = StubProductCertificate(StubProduct('product1', version='6.5',
+                provided_tags='rhel-6'))
+
+        restored = cert_from_dict(cert_to_dict(cert), '/tmp/product1.pem')
+
+        self.assertFalse(hasattr(restored, 'order'))
+        self.assertEquals('1.0', str(restored.version))
+        self.assertEquals('6.5', restored.products[0].version)
+        self.assertEquals(['rhel-6'], restored.products[0].provided_tags)
+
+    def test_unknown_type_not_cached(self):
+        self.assertEquals(None, cert_to_dict(object()))
+
+
+class LazyCertificateTests(unittest.TestCase):
+
+    def setUp(self):
+        cert = StubEntitlementCertificate(StubProduct('product1'),
+                content=[StubContent('content-a')], pool=Pool(id='pool1'))
+        self.cert_dict = cert_to_dict(cert)
+        self.restored = cert_from_dict(self.cert_dict, '/tmp/1.pem')
+
+    def test_is_entitlement_certificate(self):
+        self.assertTrue(isinstance(self.restored, EntitlementCertificate))
+
+    def test_header_access_does_not_decode(self):
+        self.restored.serial
+        self.restored.is_valid()
+        self.assertEquals(['content', 'order', 'pool', 'products'],
+                sorted(self.restored._encoded.keys()))
+
+    def test_field_decoded_once(self):
+        content = self.restored.content
+        self.assertEquals(['content-a'], [c.label for c in content])
+        self.assertFalse('content' in self.restored._encoded)
+        self.assertTrue(content is self.restored.content)
+        self.assertTrue('products' in self.restored._encoded)
+
+    def test_assign_field(self):
+        self.restored.content = []
+        self.assertEquals([], self.restored.content)
+        self.assertEquals('[]', cert_to_dict(self.restored)['content'])
+
+    def test_undecoded_fields_reencoded_as_is(self):
+        self.restored.products
+        cert_dict = cert_to_dict(self.restored)
+        self.assertTrue(cert_dict['content'] is self.cert_dict['content'])
+        self.assertEquals(['product1'], [p.id for p in
+                cert_from_dict(cert_dict, '/tmp/1.pem').products])
+
+
+class CertificateCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'cache', 'certs.json')
+        self.cert = StubEntitlementCertificate(StubProduct('product1'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookup_after_save(self):
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        cache.store('1.pem', (1, 2, 3.5), self.cert)
+        cache.save()
+
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        restored = cache.lookup('1.pem', (1, 2, 3.5))
+        self.assertEquals(self.cert.serial, restored.serial)
+
+    def test_lookup_signature_mismatch(self):
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        cache.store('1.pem', (1, 2, 3.5), self.cert)
+        cache.save()
+
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        self.assertEquals(None, cache.lookup('1.pem', (1, 2, 4.5)))
+
+    def test_other_directory_ignored(self):
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        cache.store('1.pem', (1, 2, 3.5), self.cert)
+        cache.save()
+
+        cache = CertificateCache(self.cache_file, '/mnt/sysimage' + self.tmp_dir)
+        self.assertEquals(None, cache.lookup('1.pem', (1, 2, 3.5)))
+
+    def test_corrupt_cache_ignored(self):
+        os.makedirs(os.path.dirname(self.cache_file))
+        f = open(self.cache_file, 'w')
+        f.write("{not json")
+        f.close()
+
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        self.assertEquals(None, cache.lookup('1.pem', (1, 2, 3.5)))
+
+    def test_prune(self):
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        cache.store('1.pem', (1, 2, 3.5), self.cert)
+        cache.prune(['2.pem'])
+        cache.save()
+
+        cache = CertificateCache(self.cache_file, self.tmp_dir)
+        cache.load()
+        self.assertEquals({}, cache.entries)
+
+
+class CachedCertificateDirectoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cert_dir = os.path.join(self.tmp_dir, 'certs')
+        os.mkdir(self.cert_dir)
+        self.certs = {}
+        for name in ['1.pem', '2.pem']:
+            self._write_cert(name)
+
+        # Key files are never parsed:
+        open(os.path.join(self.cert_dir, '1-key.pem'), 'w').close()
+
+        self.create_patcher = patch('subscription_manager.certdirectory.create_from_file')
+        self.create_mock = self.create_patcher.start()
+        self.create_mock.side_effect = lambda path: self.certs[os.path.basename(path)]
+
+    def tearDown(self):
+        self.create_patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_cert(self, name):
+        f = open(os.path.join(self.cert_dir, name), 'w')
+        f.write(name)
+        f.close()
+        self.certs[name] = StubEntitlementCertificate(StubProduct(name))
+
+    def _cert_dir(self):
+        class CachedDirectory(CertificateDirectory):
+            CACHE_FILE = os.path.join(self.tmp_dir, 'cache', 'certs.json')
+        return CachedDirectory(self.cert_dir)
+
+    def _serials(self, listing):
+        return sorted([c.serial for c in listing])
+
+    def test_second_instance_uses_cache(self):
+        expected = self._serials(self.certs.values())
+        self.assertEquals(expected, self._serials(self._cert_dir().list()))
+        self.assertEquals(2, self.create_mock.call_count)
+
+        self.assertEquals(expected, self._serials(self._cert_dir().list()))
+        self.assertEquals(2, self.create_mock.call_count)
+
+    def test_modified_cert_reparsed(self):
+        self._cert_dir().list()
+        self._write_cert('2.pem')
+        os.utime(os.path.join(self.cert_dir, '2.pem'), (0, 0))
+
+        listing = self._cert_dir().list()
+        self.assertEquals(3, self.create_mock.call_count)
+        self.assertEquals(self._serials(self.certs.values()), self._serials(listing))
+
+    def test_file_signature_changes(self):
+        path = os.path.join(self.cert_dir, '1.pem')
+        before = file_signature(path)
+        os.utime(path, (0, 0))
+        self.assertNotEquals(before, file_signature(path))
@@ -15,13 +15,24 @@
 
 import unittest
 import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
 
-from mock import patch
+from mock import Mock, patch
 
 from stubs import StubProduct, StubEntitlementCertificate, \
-    StubProductCertificate
+    StubProductCertificate, StubEntitlementDirectory
 from subscription_manager.certdirectory import Path, EntitlementDirectory, \
-    ProductDirectory
+    ProductDirectory, CertificateDirectory, ValidityIndex, BatchWriter, \
+    Writer, STAGING_TIMEOUT
+from subscription_manager.file_monitor import MonitorDirectory
+from subscription_manager import injection as inj
+from subscription_manager import compactcontent
+from subscription_manager.compactcontent import share_string
 from subscription_manager.repolib import RepoFile
 from subscription_manager.productid import ProductDatabase
 
@@ -116,6 +127,66 @@ class TestEntitlementDirectoryCheckKey(unittest.TestCase):
         self.assertFalse(ret)
 
 
+class EntitlementDirectoryKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cert_dir_path = tempfile.mkdtemp()
+        self.certs = {}
+        for name in ['1.pem', '2.pem']:
+            path = os.path.join(self.cert_dir_path, name)
+            open(path, 'w').close()
+            self.certs[name] = StubEntitlementCertificate(StubProduct(name))
+            self.certs[name].path = path
+        self._touch('1-key.pem')
+
+        self.create_patcher = patch('subscription_manager.certdirectory.create_from_file')
+        self.create_mock = self.create_patcher.start()
+        self.create_mock.side_effect = lambda path: self.certs[os.path.basename(path)]
+
+        class TempEntitlementDirectory(EntitlementDirectory):
+            PATH = self.cert_dir_path
+            CACHE_FILE = None
+        self.ent_dir = TempEntitlementDirectory()
+
+    def tearDown(self):
+        self.create_patcher.stop()
+        shutil.rmtree(self.cert_dir_path)
+
+    def _touch(self, name):
+        open(os.path.join(self.cert_dir_path, name), 'w').close()
+
+    def _valid_serials(self):
+        return sorted([c.serial for c in self.ent_dir.list_valid()])
+
+    def test_list_valid_uses_scanned_keys(self):
+        self.ent_dir.list()
+        access = Mock()
+        with patch('os.access', access):
+            self.assertEquals([self.certs['1.pem'].serial], self._valid_serials())
+        self.assertFalse(access.called)
+
+    def test_key_added_after_refresh(self):
+        self.assertEquals([self.certs['1.pem'].serial], self._valid_serials())
+        self._touch('2-key.pem')
+        self.assertEquals([self.certs['1.pem'].serial], self._valid_serials())
+
+        self.ent_dir.refresh()
+        self.assertEquals(sorted([self.certs['1.pem'].serial, self.certs['2.pem'].serial]),
+                self._valid_serials())
+
+    @patch('subscription_manager.certdirectory.Key')
+    @patch('subscription_manager.certdirectory.Writer')
+    def test_legacy_key_migrated_once_per_scan(self, MockWriter, MockKey):
+        self._touch('key.pem')
+
+        self.assertEquals(2, len(self.ent_dir.list_valid()))
+        self.assertEquals(2, len(self.ent_dir.list_valid()))
+
+        MockKey.read.assert_called_once_with(os.path.join(self.cert_dir_path, 'key.pem'))
+        MockWriter.return_value.write.assert_called_once_with(
+                MockKey.read.return_value, self.certs['2.pem'])
+
+
 class ProductDirectoryTest(unittest.TestCase):
     @patch('os.path.exists')
     def test_get_installed_products(self, MockExists):
@@ -126,3 +197,352 @@ class ProductDirectoryTest(unittest.TestCase):
         pd.list = lambda: [StubProductCertificate(top_product, provided_products)]
         installed_products = pd.get_installed_products()
         self.assertTrue("top" in installed_products)
+
+
+class CertificateIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cert1 = StubEntitlementCertificate(StubProduct('product1'),
+                provided_products=['product2'], stacking_id='stack1')
+        self.cert2 = StubEntitlementCertificate(StubProduct('product3'),
+                stacking_id='stack1')
+        self.cert3 = StubEntitlementCertificate(StubProduct('product2'))
+        self.ent_dir = StubEntitlementDirectory([self.cert1, self.cert2, self.cert3])
+
+    def _serials(self, certs):
+        return sorted([c.serial for c in certs])
+
+    def test_find(self):
+        self.assertTrue(self.ent_dir.find(self.cert2.serial) is self.cert2)
+        self.assertEquals(None, self.ent_dir.find(1))
+
+    def test_find_by_product(self):
+        self.assertTrue(self.ent_dir.find_by_product('product2') is self.cert1)
+        self.assertTrue(self.ent_dir.find_by_product('product3') is self.cert2)
+        self.assertEquals(None, self.ent_dir.find_by_product('product4'))
+
+    def test_find_all_by_product_includes_stack(self):
+        self.assertEquals(self._serials([self.cert1, self.cert2, self.cert3]),
+                self._serials(self.ent_dir.find_all_by_product('product2')))
+        self.assertEquals(self._serials([self.cert1, self.cert2]),
+                self._serials(self.ent_dir.find_all_by_product('product3')))
+        self.assertEquals([], self.ent_dir.find_all_by_product('product4'))
+
+    def test_find_all_by_product_order(self):
+        # Certs providing the product in listing order, then their stacks:
+        self.assertEquals([self.cert1.serial, self.cert3.serial, self.cert2.serial],
+                [c.serial for c in self.ent_dir.find_all_by_product('product2')])
+
+    def test_list_for_product(self):
+        self.assertEquals([self.cert1.serial, self.cert3.serial],
+                [c.serial for c in self.ent_dir.list_for_product('product2')])
+        self.assertEquals([], self.ent_dir.list_for_product('product4'))
+
+    def test_index_follows_listing(self):
+        self.assertEquals(None, self.ent_dir.find_by_product('product4'))
+        cert4 = StubEntitlementCertificate(StubProduct('product4'))
+        self.ent_dir.certs.append(cert4)
+        self.assertTrue(self.ent_dir.find_by_product('product4') is cert4)
+        self.assertTrue(self.ent_dir.find(cert4.serial) is cert4)
+
+
+class ValidityIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2014, 6, 1)
+        self.expired = self._cert(-400, -10)
+        self.valid = self._cert(-10, 300)
+        self.expiring = self._cert(-300, 5)
+        self.future = self._cert(10, 400)
+        self.ent_dir = StubEntitlementDirectory([self.expired, self.valid,
+            self.expiring, self.future])
+
+    def _cert(self, start_days, end_days):
+        return StubEntitlementCertificate(StubProduct('product1'),
+                start_date=self.now + timedelta(days=start_days),
+                end_date=self.now + timedelta(days=end_days))
+
+    def _serials(self, certs):
+        return [c.serial for c in certs]
+
+    def test_list_valid(self):
+        self.assertEquals(self._serials([self.valid, self.expiring]),
+                self._serials(self.ent_dir.list_valid(self.now)))
+        self.assertEquals(self._serials([self.valid, self.future]),
+                self._serials(self.ent_dir.list_valid(self.now + timedelta(days=20))))
+
+    def test_list_valid_includes_range_ends(self):
+        self.assertEquals(self._serials([self.valid, self.expiring]),
+                self._serials(self.ent_dir.list_valid(self.now + timedelta(days=5))))
+        self.assertEquals(self._serials([self.expired]),
+                self._serials(self.ent_dir.list_valid(self.now - timedelta(days=400))))
+
+    def test_list_expired(self):
+        self.assertEquals(self._serials([self.expired]),
+                self._serials(self.ent_dir.list_expired(self.now)))
+
+    def test_list_future(self):
+        self.assertEquals(self._serials([self.future]),
+                self._serials(self.ent_dir.list_future(self.now)))
+
+    def test_list_expiring(self):
+        self.assertEquals(self._serials([self.expiring]),
+                self._serials(self.ent_dir.list_expiring(30, self.now)))
+        self.assertEquals([], self.ent_dir.list_expiring(5, self.now))
+
+    def test_defaults_to_now(self):
+        cert = StubEntitlementCertificate(StubProduct('product1'))
+        self.ent_dir.certs.append(cert)
+        self.assertEquals([cert.serial], self._serials(self.ent_dir.list_valid()))
+        self.assertEquals(4, len(self.ent_dir.list_expired()))
+
+    def test_matches_linear_scan(self):
+        certs = []
+        for i in range(200):
+            start = random.randint(-1000, 1000)
+            certs.append(self._cert(start, start + random.randint(0, 500)))
+        index = ValidityIndex(certs)
+
+        for days in range(-1100, 1600, 7):
+            on_date = self.now + timedelta(days=days)
+            self.assertEquals(
+                    self._serials([c for c in certs if c.is_valid(on_date)]),
+                    self._serials(index.valid_at(on_date)))
+            self.assertEquals(
+                    self._serials([c for c in certs if c.is_expired(on_date)]),
+                    self._serials(index.expired_before(on_date)))
+
+
+class CertificateDirectoryRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cert_dir_path = tempfile.mkdtemp()
+        self.certs = {}
+        for name in ['1.pem', '2.pem', '3.pem']:
+            self._write_cert(name)
+
+        self.create_patcher = patch('subscription_manager.certdirectory.create_from_file')
+        self.create_mock = self.create_patcher.start()
+        self.create_mock.side_effect = lambda path: self.certs[os.path.basename(path)]
+
+        self.cert_dir = CertificateDirectory(self.cert_dir_path)
+
+    def tearDown(self):
+        self.create_patcher.stop()
+        shutil.rmtree(self.cert_dir_path)
+
+    def _write_cert(self, name, mtime=None):
+        path = os.path.join(self.cert_dir_path, name)
+        f = open(path, 'w')
+        f.write(name)
+        f.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        self.certs[name] = StubEntitlementCertificate(StubProduct(name))
+
+    def _serials(self, listing):
+        return sorted([c.serial for c in listing])
+
+    def test_refresh_unchanged(self):
+        first = self.cert_dir.list()
+        self.cert_dir.refresh()
+        second = self.cert_dir.list()
+
+        self.assertEquals(3, self.create_mock.call_count)
+        self.assertEquals(self._serials(first), self._serials(second))
+
+    def test_shared_content_cleared(self):
+        share_string(u'rhel-6-server')
+        self.cert_dir.list()
+        self.assertEquals({}, compactcontent._strings)
+
+    def test_refresh_added(self):
+        self.cert_dir.list()
+        self._write_cert('4.pem')
+        self.cert_dir.refresh()
+
+        listing = self.cert_dir.list()
+        self.assertEquals(4, self.create_mock.call_count)
+        self.create_mock.assert_called_with(os.path.join(self.cert_dir_path, '4.pem'))
+        self.assertEquals(self._serials(self.certs.values()), self._serials(listing))
+
+    def test_add_written_not_parsed(self):
+        self.cert_dir.list()
+        self._write_cert('4.pem')
+        self.certs['4.pem'].path = os.path.join(self.cert_dir_path, '4.pem')
+        self.cert_dir.add_written([self.certs['4.pem']])
+
+        listing = self.cert_dir.list()
+        self.assertEquals(3, self.create_mock.call_count)
+        self.assertEquals(self._serials(self.certs.values()), self._serials(listing))
+
+    def test_refresh_modified(self):
+        self.cert_dir.list()
+        self._write_cert('2.pem', mtime=0)
+        self.cert_dir.refresh()
+
+        listing = self.cert_dir.list()
+        self.assertEquals(4, self.create_mock.call_count)
+        self.assertTrue(self.certs['2.pem'].serial in self._serials(listing))
+
+    def test_refresh_deleted(self):
+        self.cert_dir.list()
+        os.unlink(os.path.join(self.cert_dir_path, '3.pem'))
+        self.cert_dir.refresh()
+
+        listing = self.cert_dir.list()
+        self.assertEquals(3, self.create_mock.call_count)
+        self.assertEquals(2, len(listing))
+        self.assertFalse(self.certs['3.pem'].serial in self._serials(listing))
+
+    def test_list_from_threads(self):
+        def slow_parse(path):
+            time.sleep(0.05)
+            return self.certs[os.path.basename(path)]
+        self.create_mock.side_effect = slow_parse
+        listings = []
+
+        def list_certs():
+            listings.append(self.cert_dir.list())
+        threads = [threading.Thread(target=list_certs) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Scanned once, the other threads got that listing:
+        self.assertEquals(3, self.create_mock.call_count)
+        for listing in listings:
+            self.assertTrue(listing is listings[0])
+
+    def test_parallel_parse(self):
+        self.cert_dir._parse_workers = 2
+        self.cert_dir.PARALLEL_PARSE_MIN = 2
+
+        listing = self.cert_dir.list()
+
+        # Parsed in the worker processes, not here:
+        self.assertEquals(0, self.create_mock.call_count)
+        self.assertEquals(self._serials(self.certs.values()), self._serials(listing))
+
+    def test_parallel_parse_error_reported(self):
+        self.cert_dir._parse_workers = 2
+        self.cert_dir.PARALLEL_PARSE_MIN = 2
+        self.create_mock.side_effect = IOError("bad cert")
+
+        self.assertRaises(IOError, self.cert_dir.list)
+
+    def test_parallel_parse_skipped_below_minimum(self):
+        self.cert_dir._parse_workers = 2
+
+        with patch('multiprocessing.Pool') as pool_mock:
+            self.cert_dir.list()
+            self.assertEquals(0, pool_mock.call_count)
+        self.assertEquals(3, self.create_mock.call_count)
+
+
+class BatchWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ent_dir_path = os.path.join(self.tmp_dir, 'entitlement')
+        os.mkdir(self.ent_dir_path)
+        self.ent_dir = StubEntitlementDirectory([])
+        self.ent_dir.add_written = Mock()
+        inj.provide(inj.ENT_DIR, self.ent_dir)
+        self.writer = BatchWriter(self.ent_dir_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _stage(self, serial):
+        key = Mock()
+        key.write.side_effect = lambda path: open(path, 'w').close()
+        cert = StubEntitlementCertificate(StubProduct('product1'))
+        cert.serial = serial
+
+        def write_cert(path):
+            open(path, 'w').close()
+            cert.path = path
+        cert.write = write_cert
+        self.writer.write(key, cert)
+        return cert
+
+    def _staging_dirs(self):
+        return [d for d in os.listdir(self.tmp_dir) if d != 'entitlement']
+
+    def test_nothing_visible_until_commit(self):
+        self._stage(1)
+        self._stage(2)
+        self.assertEquals([], os.listdir(self.ent_dir_path))
+        self.assertEquals(1, len(self._staging_dirs()))
+
+        self.writer.commit()
+        self.assertEquals(['1-key.pem', '1.pem', '2-key.pem', '2.pem'],
+                sorted(os.listdir(self.ent_dir_path)))
+        self.assertEquals([], self._staging_dirs())
+
+    def test_keys_moved_first(self):
+        self._stage(1)
+        self.writer.write_pem('2.pem', 'cert')
+        self.writer.write_pem('2-key.pem', 'key')
+        renamed = []
+        real_rename = os.rename
+
+        def rename(src, dest):
+            renamed.append(os.path.basename(dest))
+            real_rename(src, dest)
+        with patch('os.rename', rename):
+            self.writer.commit()
+        self.assertEquals(['1-key.pem', '2-key.pem'], sorted(renamed[:2]))
+
+    def test_certs_handed_to_directory(self):
+        cert = self._stage(1)
+        self.writer.commit()
+        self.assertEquals(os.path.join(self.ent_dir_path, '1.pem'), cert.path)
+        self.ent_dir.add_written.assert_called_once_with([cert])
+
+    def test_abort(self):
+        self._stage(1)
+        self.writer.abort()
+        self.writer.commit()
+        self.assertEquals([], os.listdir(self.ent_dir_path))
+        self.assertEquals([], self._staging_dirs())
+        self.assertFalse(self.ent_dir.add_written.called)
+
+    def test_stale_staging_removed(self):
+        stale = os.path.join(self.tmp_dir, 'entitlement.staging-stale')
+        recent = os.path.join(self.tmp_dir, 'entitlement.staging-recent')
+        for staging_dir in [stale, recent]:
+            os.mkdir(staging_dir)
+            open(os.path.join(staging_dir, '1-key.pem'), 'w').close()
+        old = time.time() - STAGING_TIMEOUT - 1
+        os.utime(stale, (old, old))
+
+        self._stage(1)
+        self.assertFalse(os.path.exists(stale))
+        # Possibly another writer's:
+        self.assertTrue(os.path.exists(recent))
+
+    def test_failed_single_write_aborted(self):
+        key = Mock()
+        key.write.side_effect = lambda path: open(path, 'w').close()
+        cert = StubEntitlementCertificate(StubProduct('product1'))
+        cert.write = Mock(side_effect=IOError("disk full"))
+        writer_patch = patch('subscription_manager.certdirectory.BatchWriter',
+                lambda: BatchWriter(self.ent_dir_path))
+        writer_patch.start()
+        try:
+            self.assertRaises(IOError, Writer().write, key, cert)
+        finally:
+            writer_patch.stop()
+        self.assertEquals([], self._staging_dirs())
+        self.assertEquals([], os.listdir(self.ent_dir_path))
+
+    def test_monitor_holds_off_while_staging(self):
+        monitor_dir = MonitorDirectory(self.ent_dir_path)
+        self._stage(1)
+        self.assertFalse(monitor_dir.update())
+        self.writer.commit()
+        self.assertTrue(monitor_dir.update())
+        self.assertFalse(monitor_dir.update())
@@ -14,12 +14,15 @@
 #
 
 from datetime import datetime, timedelta
+import threading
 
 import mock
 import stubs
 
 from rhsm import ourjson as json
 from subscription_manager import action_client
+from subscription_manager import base_action_client
+from subscription_manager.certlib import ActionReport
 from subscription_manager import content_action_client
 from subscription_manager import entcertlib
 from subscription_manager import identitycertlib
@@ -83,6 +86,9 @@ class ActionClientTestBase(SubManFixture):
         self.patcher_entcertlib_writer = mock.patch("subscription_manager.entcertlib.Writer")
         self.entcertlib_writer = self.patcher_entcertlib_writer.start()
 
+        self.patcher_entcertlib_batch_writer = mock.patch("subscription_manager.entcertlib.BatchWriter")
+        self.entcertlib_batch_writer = self.patcher_entcertlib_batch_writer.start()
+
         self.patcher_entcertlib_action_syslogreport = mock.patch.object(entcertlib.EntCertUpdateAction, 'syslog_results')
         self.update_action_syslog_mock = self.patcher_entcertlib_action_syslogreport.start()
 
@@ -135,6 +141,7 @@ class ActionClientTestBase(SubManFixture):
         #self.patcher8.stop()
 
         self.patcher_entcertlib_writer.stop()
+        self.patcher_entcertlib_batch_writer.stop()
 
         self.hwprobe_getall_patcher.stop()
         self.patcher_entcertlib_action_syslogreport.stop()
@@ -321,3 +328,109 @@ class TestHealingActionClient(TestActionClient):
             if call[0] == 'exception' and isinstance(call[1][0], TypeError):
                 return
         self.fail("Did not see TypeError in the logged exceptions")
+
+
+class TestConcurrentActionClient(TestActionClient):
+    """The TestActionClient tests, running independent libs at once."""
+
+    def setUp(self):
+        TestActionClient.setUp(self)
+        self.workers_patcher = mock.patch(
+                'subscription_manager.base_action_client._get_action_workers')
+        self.workers_patcher.start().return_value = 4
+
+    def tearDown(self):
+        self.workers_patcher.stop()
+        TestActionClient.tearDown(self)
+
+    def test_reports_in_libset_order(self):
+        actionclient = action_client.ActionClient()
+        actionclient.update()
+        self.assertEquals(6, len(actionclient.update_reports))
+        self.assertEquals(actionclient.entcertlib.report,
+                actionclient.update_reports[0])
+
+
+class StubInvoker(object):
+
+    def __init__(self, name, runs, wait_for=None, side_effect=None, timeout=5):
+        self.name = name
+        self.runs = runs
+        self.wait_for = wait_for
+        self.side_effect = side_effect
+        self.timeout = timeout
+        self.started = threading.Event()
+        self.report = ActionReport()
+
+    def update(self):
+        self.started.set()
+        if self.wait_for:
+            # Only set if it runs at the same time:
+            self.wait_for.started.wait(self.timeout)
+            if not self.wait_for.started.isSet():
+                raise Exception("%s did not run alongside" % self.wait_for.name)
+        if self.side_effect:
+            raise self.side_effect
+        self.runs.append(self.name)
+        return self.report
+
+
+class StubGraphActionClient(base_action_client.BaseActionClient):
+
+    def __init__(self, libset, dependencies):
+        self.libset = libset
+        self.dependencies = dependencies
+        base_action_client.BaseActionClient.__init__(self)
+
+    def _get_libset(self):
+        return self.libset
+
+    def _get_dependencies(self):
+        return self.dependencies
+
+
+class TestConcurrentUpdates(SubManFixture):
+
+    def setUp(self):
+        SubManFixture.setUp(self)
+        self.workers_patcher = mock.patch(
+                'subscription_manager.base_action_client._get_action_workers')
+        self.workers_patcher.start().return_value = 4
+        self.runs = []
+
+    def tearDown(self):
+        self.workers_patcher.stop()
+        SubManFixture.tearDown(self)
+
+    def test_independent_libs_run_together(self):
+        first = StubInvoker('first', self.runs)
+        b = StubInvoker('b', self.runs)
+        a = StubInvoker('a', self.runs, wait_for=b)
+        last = StubInvoker('last', self.runs)
+        client = StubGraphActionClient([first, a, b, last],
+                {a: [first], b: [first], last: [a, b]})
+        client.update()
+        self.assertEquals([first.report, a.report, b.report, last.report],
+                client.update_reports)
+        self.assertEquals('first', self.runs[0])
+        self.assertEquals('last', self.runs[-1])
+
+    def test_serial_without_workers(self):
+        self.workers_patcher.stop()
+        try:
+            b = StubInvoker('b', self.runs)
+            a = StubInvoker('a', self.runs, wait_for=b, timeout=0.1)
+            client = StubGraphActionClient([a, b], {})
+            client.update()
+        finally:
+            self.workers_patcher.start().return_value = 4
+        # a ran, and failed, before b started:
+        self.assertEquals([None, b.report], client.update_reports)
+
+    def test_gone_exception_stops_updates(self):
+        first = StubInvoker('first', self.runs,
+                side_effect=GoneException(410, "bye bye", " 234234"))
+        second = StubInvoker('second', self.runs)
+        client = StubGraphActionClient([first, second], {second: [first]})
+        self.assertRaises(GoneException, client.update)
+        self.assertFalse(second.started.isSet())
@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import unittest
+
+from rhsm.certificate2 import Content
+
+from stubs import StubProduct, StubContent, StubEntitlementCertificate
+from subscription_manager.certcache import cert_to_dict, cert_from_dict
+from subscription_manager import compactcontent
+from subscription_manager.compactcontent import CompactContent, \
+    clear_shared, compact_certificate, share_string, share_tuple
+from subscription_manager.models import EntCertEntitledContent
+
+
+class CompactContentTests(unittest.TestCase):
+
+    def _content(self, label, url="/content/dist/rhel/server/6/$basearch/os"):
+        return StubContent(label, url=url, vendor="Red Hat",
+                required_tags="rhel-6,rhel-6-server")
+
+    def test_fields_match(self):
+        content = self._content('content-a')
+        compact = CompactContent.from_content(content)
+        for name in ['content_type', 'name', 'label', 'vendor', 'url', 'gpg',
+                     'enabled', 'metadata_expire']:
+            self.assertEquals(getattr(content, name), getattr(compact, name))
+        self.assertEquals(tuple(content.required_tags), compact.required_tags)
+        self.assertEquals((), compact.arches)
+
+    def test_fields_in_slots(self):
+        compact = CompactContent.from_content(self._content('content-a'))
+        self.assertEquals({}, compact.__dict__)
+
+    def test_repeated_values_shared(self):
+        first = CompactContent.from_content(self._content('content-a'))
+        second = CompactContent.from_content(self._content('content-b'))
+        self.assertTrue(first.vendor is second.vendor)
+        self.assertTrue(first.required_tags is second.required_tags)
+        self.assertTrue(first._url_prefix is second._url_prefix)
+
+    def test_share_unicode(self):
+        value = u'rhel-' + u'6'
+        self.assertTrue(share_string(u'rhel-6') is share_string(value))
+        self.assertEquals((), share_tuple(None))
+
+    def test_clear_shared(self):
+        first = CompactContent.from_content(self._content('content-a'))
+        clear_shared()
+        self.assertEquals({}, compactcontent._strings)
+        self.assertEquals({}, compactcontent._tuples)
+        second = CompactContent.from_content(self._content('content-b'))
+        self.assertFalse(first.required_tags is second.required_tags)
+        self.assertEquals(first.required_tags, second.required_tags)
+        self.assertEquals(first.url, second.url)
+
+    def test_url_without_slash(self):
+        for url in [None, '', 'os', '/']:
+            compact = CompactContent.from_content(self._content('content-a', url))
+            self.assertEquals(url, compact.url)
+
+    def test_equal_to_plain_content(self):
+        content = Content(content_type='yum', name='A', label='content-a')
+        compact = CompactContent.from_content(content)
+        self.assertEquals(compact, content)
+        self.assertEquals(content, compact)
+        self.assertEquals(1, len(set([compact, content])))
+        self.assertNotEquals(compact, CompactContent.from_content(
+            Content(content_type='yum', name='B', label='content-b')))
+
+    def test_compact_certificate(self):
+        cert = StubEntitlementCertificate(StubProduct('product1'),
+                content=[self._content('content-a')])
+        self.assertTrue(cert is compact_certificate(cert))
+        self.assertTrue(isinstance(cert.content[0], CompactContent))
+
+    def test_cache_decodes_compact(self):
+        cert = StubEntitlementCertificate(StubProduct('product1'),
+                content=[self._content('content-a')])
+        restored = cert_from_dict(cert_to_dict(cert), '/tmp/1.pem')
+        self.assertTrue(isinstance(restored.content[0], CompactContent))
+        self.assertEquals(cert.content[0].url, restored.content[0].url)
+
+    def test_entitled_content_not_copied(self):
+        compact = CompactContent.from_content(self._content('content-a'))
+        entitled = EntCertEntitledContent(content=compact)
+        self.assertTrue(entitled.content is compact)
+        self.assertEquals('yum', entitled.content_type)
+        self.assertEquals(None, EntCertEntitledContent().content_type)
@@ -0,0 +1,301 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import BaseHTTPServer
+import SocketServer
+import httplib
+import json
+import threading
+import unittest
+
+from mock import Mock, patch
+
+from subscription_manager import connpool
+from subscription_manager.connpool import ConnectionPool, PooledRestlib
+from subscription_manager.cp_provider import CPProvider
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        body = '{"path": "%s"}' % self.path
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.server.accept_encodings.append(self.headers.get('Accept-Encoding'))
+        if self.server.gzip_responses:
+            body = connpool._gzip(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.close_connections:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop_connections:
+            # Closed without telling the client, like an idle timeout:
+            self.close_connection = 1
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        encoding = self.headers.get('Content-Encoding')
+        self.server.bodies.append((encoding, len(body)))
+        if encoding == 'gzip':
+            if self.server.refuse_gzip:
+                self.send_response(415)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = connpool._gunzip(body)
+        if self.path.endswith('/invalid'):
+            self.send_response(400)
+            body = '{"displayMessage": "Invalid"}'
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # What was received, uncompressed:
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # A thread per connection, so they can be kept open:
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                KeepAliveHandler)
+        self.connections = 0
+        self.close_connections = False
+        self.drop_connections = False
+        self.gzip_responses = False
+        self.refuse_gzip = False
+        # (Content-Encoding, length) of the request bodies received:
+        self.bodies = []
+        self.accept_encodings = []
+
+
+class StubServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.server_thread = threading.Thread(target=self.server.serve_forever,
+                args=(0.05,))
+        self.server_thread.setDaemon(True)
+        self.server_thread.start()
+
+        # Plain http, the stub server has no certificate:
+        self.connection_patch = patch.object(PooledRestlib, '_new_connection',
+                lambda restlib: httplib.HTTPConnection(restlib.host,
+                        restlib.ssl_port, timeout=5))
+        self.connection_patch.start()
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.connection_patch.stop()
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _restlib(self, **kwargs):
+        return PooledRestlib(self.pool, '127.0.0.1', self.server.server_port,
+                '/candlepin', **kwargs)
+
+
+class PooledRestlibTests(StubServerTestCase):
+
+    def test_reuses_connection(self):
+        restlib = self._restlib()
+        self.assertEquals({'path': '/candlepin/status'},
+                restlib.request_get('/status'))
+        restlib.request_get('/status')
+        self._restlib(username='admin', password='admin').request_get('/status')
+        self.assertEquals(1, self.server.connections)
+        self.assertEquals([3], self.pool.requests_per_connection())
+        self.assertEquals(2, self.pool.reused)
+
+    def test_connection_per_client_cert(self):
+        self._restlib().request_get('/status')
+        cert_restlib = self._restlib()
+        cert_restlib._pool_key = Mock(return_value=('127.0.0.1', 'cert'))
+        cert_restlib.request_get('/status')
+        self.assertEquals(2, self.server.connections)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        restlib = self._restlib()
+        restlib.request_get('/status')
+        restlib.request_get('/status')
+        self.assertEquals(2, self.server.connections)
+        self.assertEquals([1, 1], self.pool.requests_per_connection())
+        # Not left open:
+        self.assertEquals([True, True],
+                [pooled.closed for pooled in self.pool.connections])
+
+    def test_connection_close(self):
+        self.server.close_connections = True
+        restlib = self._restlib()
+        restlib.request_get('/status')
+        restlib.request_get('/status')
+        self.assertEquals(2, self.server.connections)
+        self.assertEquals(0, self.pool.reused)
+
+    def test_dropped_connection_not_reused(self):
+        self.server.drop_connections = True
+        restlib = self._restlib()
+        restlib.request_get('/status')
+        # Let the server close it:
+        restlib.request_get('/status')
+        self.assertEquals(2, self.server.connections)
+        self.assertEquals(0, self.pool.reconnects)
+
+    def test_reconnects_on_reset(self):
+        self.server.drop_connections = True
+        restlib = self._restlib()
+        dropped_patch = patch('subscription_manager.connpool.PooledConnection.is_dropped',
+                Mock(return_value=False))
+        dropped_patch.start()
+        try:
+            restlib.request_get('/status')
+            self.assertEquals({'path': '/candlepin/status'},
+                    restlib.request_get('/status'))
+        finally:
+            dropped_patch.stop()
+        self.assertEquals(2, self.server.connections)
+        self.assertEquals(1, self.pool.reconnects)
+
+    def test_no_retry_on_new_connection(self):
+        restlib = self._restlib()
+        restlib._send = Mock(side_effect=httplib.BadStatusLine(''))
+        self.assertRaises(httplib.BadStatusLine, restlib.request_get, '/status')
+        self.assertEquals(1, restlib._send.call_count)
+        self.assertEquals(0, self.pool.reconnects)
+
+
+class CompressionTests(StubServerTestCase):
+
+    def setUp(self):
+        StubServerTestCase.setUp(self)
+        self.pool.compress_threshold = 100
+        self.profile = [{'name': 'package%d' % i, 'version': '1.0'}
+                        for i in range(20)]
+        self.profile_length = len(json.dumps(self.profile))
+
+    def test_small_body_not_compressed(self):
+        restlib = self._restlib()
+        self.assertEquals({'name': 'small'},
+                restlib.request_put('/consumers/abc/packages', {'name': 'small'}))
+        self.assertEquals([(None, 17)], self.server.bodies)
+
+    def test_large_body_compressed(self):
+        restlib = self._restlib()
+        self.assertEquals(self.profile,
+                restlib.request_put('/consumers/abc/packages', self.profile))
+        encoding, length = self.server.bodies[0]
+        self.assertEquals('gzip', encoding)
+        self.assertTrue(length < self.profile_length)
+
+    def test_refused_compression(self):
+        self.server.refuse_gzip = True
+        restlib = self._restlib()
+        self.assertEquals(self.profile,
+                restlib.request_put('/consumers/abc/packages', self.profile))
+        restlib.request_put('/consumers/abc/packages', self.profile)
+        self.assertEquals(['gzip', None, None],
+                [encoding for encoding, length in self.server.bodies])
+        self.assertEquals(set([('127.0.0.1', self.server.server_port)]),
+                self.pool.gzip_refused)
+
+    def test_invalid_request_not_taken_as_refusal(self):
+        restlib = self._restlib()
+        self.assertRaises(connpool.connection.RestlibException,
+                restlib.request_put, '/consumers/abc/invalid', self.profile)
+        self.assertEquals(['gzip', None],
+                [encoding for encoding, length in self.server.bodies])
+        self.assertEquals(set(), self.pool.gzip_refused)
+
+    def test_compressed_response(self):
+        self.server.gzip_responses = True
+        self.assertEquals({'path': '/candlepin/status'},
+                self._restlib().request_get('/status'))
+        self.assertEquals(['gzip'], self.server.accept_encodings)
+
+    def test_compressed_without_keepalive(self):
+        self.pool.idle_timeout = 0
+        self._restlib().request_put('/consumers/abc/packages', self.profile)
+        self.assertEquals('gzip', self.server.bodies[0][0])
+
+    def test_compression_disabled(self):
+        self.pool.compress_threshold = 0
+        restlib = self._restlib()
+        restlib.request_get('/status')
+        restlib.request_put('/consumers/abc/packages', self.profile)
+        self.assertEquals(['identity'], self.server.accept_encodings)
+        self.assertEquals([(None, self.profile_length)], self.server.bodies)
+
+
+class CPProviderPoolTests(unittest.TestCase):
+
+    def test_connections_share_pool(self):
+        provider = CPProvider()
+        provider.set_user_pass('admin', 'admin')
+        for cp in [provider.get_no_auth_cp(), provider.get_basic_auth_cp(),
+                   provider.get_consumer_auth_cp()]:
+            self.assertTrue(isinstance(cp.conn.restlib, PooledRestlib))
+            self.assertTrue(cp.conn.pool is provider.connection_pool)
+
+    def test_keepalive_disabled(self):
+        timeout_patch = patch('subscription_manager.connpool._get_keepalive_timeout',
+                Mock(return_value=0))
+        timeout_patch.start()
+        try:
+            provider = CPProvider()
+        finally:
+            timeout_patch.stop()
+        # Still compressing:
+        self.assertEquals(0, provider.connection_pool.idle_timeout)
+        self.assertTrue(isinstance(provider.get_no_auth_cp().conn.restlib,
+                PooledRestlib))
+
+    def test_keepalive_and_compression_disabled(self):
+        timeout_patch = patch('subscription_manager.connpool._get_keepalive_timeout',
+                Mock(return_value=0))
+        threshold_patch = patch('subscription_manager.connpool._get_compress_threshold',
+                Mock(return_value=0))
+        timeout_patch.start()
+        threshold_patch.start()
+        try:
+            provider = CPProvider()
+        finally:
+            threshold_patch.stop()
+            timeout_patch.stop()
+        self.assertEquals(None, provider.connection_pool)
+        self.assertFalse(isinstance(provider.get_no_auth_cp().conn.restlib,
+                PooledRestlib))
+
+    def test_default_timeout(self):
+        self.assertEquals(connpool.KEEPALIVE_TIMEOUT,
+                CPProvider().connection_pool.idle_timeout)
+
+    def test_default_compress_threshold(self):
+        self.assertEquals(connpool.COMPRESS_THRESHOLD,
+                CPProvider().connection_pool.compress_threshold)
@@ -13,14 +13,22 @@
 # in this software or its documentation.
 #
 
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 from mock import Mock, patch
 from datetime import timedelta, datetime
 
+from rhsm.connection import GoneException
+
 from stubs import StubEntitlementCertificate, StubProduct, StubEntitlementDirectory
 
 from fixture import SubManFixture
 
-from subscription_manager.certdirectory import Writer
+from subscription_manager.certdirectory import BatchWriter
 from subscription_manager import entcertlib
 from subscription_manager import injection as inj
 
@@ -34,8 +42,10 @@ class TestingUpdateAction(entcertlib.EntCertUpdateAction):
 class UpdateActionTests(SubManFixture):
 
     @patch("subscription_manager.entcertlib.EntitlementCertBundleInstaller.build_cert")
-    @patch.object(Writer, "write")
-    def test_expired_are_not_ignored_when_installing_certs(self, write_mock, build_cert_mock):
+    @patch.object(BatchWriter, "commit")
+    @patch.object(BatchWriter, "write")
+    def test_expired_are_not_ignored_when_installing_certs(self, write_mock, commit_mock,
+            build_cert_mock):
         valid_ent = StubEntitlementCertificate(StubProduct("PValid"))
         expired_ent = StubEntitlementCertificate(StubProduct("PExpired"),
                 start_date=datetime.now() - timedelta(days=365),
@@ -94,3 +104,145 @@ class UpdateActionTests(SubManFixture):
 
         exceptions = update_action.report.exceptions()
         self.assertEquals([], exceptions)
+
+
+class ChunkedFetchTests(SubManFixture):
+
+    def setUp(self):
+        SubManFixture.setUp(self)
+        self.mock_uep = Mock()
+        self.mock_uep.getCertificates.side_effect = self._get_certificates
+        self.set_consumer_auth_cp(self.mock_uep)
+        self.chunk_patch = patch("subscription_manager.entcertlib._get_cert_chunk_size",
+                Mock(return_value=2))
+        self.chunk_patch.start()
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.fetching = 0
+        self.most_fetching = 0
+
+    def tearDown(self):
+        self.chunk_patch.stop()
+
+    def _get_certificates(self, consumer_uuid, serials):
+        self.lock.acquire()
+        self.fetching += 1
+        self.most_fetching = max(self.most_fetching, self.fetching)
+        self.lock.release()
+        try:
+            time.sleep(0.01)
+            failures = self.failures.get(serials[0])
+            if failures:
+                self.failures[serials[0]] = failures[1:]
+                raise failures[0]
+            return [{'serial': serial} for serial in serials]
+        finally:
+            self.lock.acquire()
+            self.fetching -= 1
+            self.lock.release()
+
+    def _fetch(self, serials):
+        update_action = TestingUpdateAction()
+        bundles = update_action.get_certificates_by_serial_list(serials)
+        return update_action.report, sorted([b['serial'] for b in bundles])
+
+    def test_chunks(self):
+        report, serials = self._fetch(range(1, 8))
+        self.assertEquals([str(i) for i in range(1, 8)], serials)
+        self.assertEquals(4, self.mock_uep.getCertificates.call_count)
+        self.assertEquals([2, 2, 2, 1],
+                sorted([c['serials'] for c in report.chunks], reverse=True))
+        self.assertEquals(entcertlib.MAX_CHUNK_FETCHES, self.most_fetching)
+        self.assertTrue("Fetched in 4 requests" in str(report))
+
+    def test_all_at_once(self):
+        entcertlib._get_cert_chunk_size.return_value = 0
+        report, serials = self._fetch(range(1, 8))
+        self.assertEquals(7, len(serials))
+        self.assertEquals(1, self.mock_uep.getCertificates.call_count)
+
+    def test_failed_chunk_retried(self):
+        self.failures['3'] = [IOError("reset")]
+        report, serials = self._fetch(range(1, 6))
+        self.assertEquals(5, len(serials))
+        self.assertEquals([], report.exceptions())
+        self.assertEquals([1, 1, 2], sorted([c['attempts'] for c in report.chunks]))
+
+    def test_failed_chunk_left_out(self):
+        error = IOError("reset")
+        self.failures['3'] = [error, error]
+        report, serials = self._fetch(range(1, 6))
+        self.assertEquals(['1', '2', '5'], serials)
+        self.assertEquals([error], report.exceptions())
+        self.assertEquals([False, False, True],
+                sorted([c['failed'] for c in report.chunks]))
+
+    def test_gone_raised(self):
+        self.failures['1'] = [GoneException(410, "Gone", "abc")]
+        self.assertRaises(GoneException, self._fetch, range(1, 10))
+        # Not retried, and no chunk started after it:
+        self.assertTrue(self.mock_uep.getCertificates.call_count <=
+                entcertlib.MAX_CHUNK_FETCHES)
+
+
+class EntitlementCertBundlesInstallerTests(SubManFixture):
+
+    @patch("subscription_manager.entcertlib.EntitlementCertBundleInstaller.build_cert")
+    @patch("subscription_manager.entcertlib.BatchWriter")
+    def test_installed_as_one_batch(self, batch_writer_mock, build_cert_mock):
+        certs = [StubEntitlementCertificate(StubProduct("P1")),
+                 StubEntitlementCertificate(StubProduct("P2"))]
+        build_cert_mock.side_effect = lambda bundle: (bundle['key'], bundle['cert'])
+        report = entcertlib.EntCertUpdateReport()
+
+        installer = entcertlib.EntitlementCertBundlesInstaller(report)
+        installer.install([{'key': Mock(), 'cert': cert} for cert in certs])
+
+        batch_writer = batch_writer_mock.return_value
+        self.assertEquals(2, batch_writer.write.call_count)
+        batch_writer.commit.assert_called_once_with()
+        self.assertEquals([c.serial for c in certs], [c.serial for c in report.added])
+
+    @patch("subscription_manager.entcertlib.EntitlementCertBundleInstaller.build_cert")
+    @patch("subscription_manager.entcertlib.BatchWriter")
+    def test_failed_commit_not_reported_added(self, batch_writer_mock, build_cert_mock):
+        cert = StubEntitlementCertificate(StubProduct("P1"))
+        build_cert_mock.return_value = (Mock(), cert)
+        batch_writer_mock.return_value.commit.side_effect = OSError("disk full")
+        report = entcertlib.EntCertUpdateReport()
+
+        installer = entcertlib.EntitlementCertBundlesInstaller(report)
+        installer.install([{'key': Mock(), 'cert': cert}])
+
+        self.assertEquals([], report.added)
+        self.assertEquals(1, len(report.exceptions()))
+
+    @patch("subscription_manager.entcertlib.EntitlementCertBundleInstaller.build_cert")
+    def test_failed_fetch_leaves_nothing_staged(self, build_cert_mock):
+        tmp_dir = tempfile.mkdtemp()
+        ent_dir_path = os.path.join(tmp_dir, 'entitlement')
+        os.mkdir(ent_dir_path)
+
+        key = Mock()
+        key.write.side_effect = lambda path: open(path, 'w').close()
+        cert = StubEntitlementCertificate(StubProduct("P1"))
+        cert.write = lambda path: open(path, 'w').close()
+        build_cert_mock.return_value = (key, cert)
+
+        def cert_bundles():
+            yield {'key': key, 'cert': cert}
+            raise GoneException(410, "gone", "abc")
+
+        report = entcertlib.EntCertUpdateReport()
+        installer = entcertlib.EntitlementCertBundlesInstaller(report)
+        writer_patch = patch("subscription_manager.entcertlib.BatchWriter",
+                lambda: BatchWriter(ent_dir_path))
+        writer_patch.start()
+        try:
+            self.assertRaises(GoneException, installer.install, cert_bundles())
+            self.assertEquals(['entitlement'], os.listdir(tmp_dir))
+            self.assertEquals([], os.listdir(ent_dir_path))
+            self.assertEquals([], report.added)
+        finally:
+            writer_patch.stop()
+            shutil.rmtree(tmp_dir)
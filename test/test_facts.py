@@ -1,6 +1,7 @@
+import os
 import tempfile
 import shutil
-from mock import patch
+from mock import Mock, patch
 
 import fixture
 from stubs import StubEntitlementDirectory, StubProductDirectory
@@ -136,6 +137,7 @@ class TestFacts(fixture.SubManFixture):
         self.f = facts.Facts(ent_dir=StubEntitlementDirectory([]),
                              prod_dir=StubProductDirectory([]))
         self.f.CACHE_FILE = fact_cache
+        self.f.collector_cache.CACHE_FILE = self.fact_cache_dir + "/collectors.json"
 
     def tearDown(self):
         super(TestFacts, self).tearDown()
@@ -179,6 +181,24 @@ class TestFacts(fixture.SubManFixture):
         self.assertEquals(self.f.facts['cpu.cpu_socket(s)'], '16')
         self.assertTrue(changed)
 
+    @patch('subscription_manager.facts.Facts._load_custom_facts',
+           return_value={})
+    @patch('subscription_manager.facts.Facts._load_hw_facts')
+    def test_facts_has_changed_digest(self, mock_load_hw, mock_load_cf):
+        test_facts = json.loads(facts_buf)
+        mock_load_hw.return_value = test_facts
+        self.f.get_facts(True)
+        self.f.write_cache()
+        self.f._read_cache = Mock()
+
+        # Graylisted facts are ignored:
+        test_facts['cpu.cpu_mhz'] = '1200'
+        self.assertFalse(self.f.has_changed())
+
+        test_facts['cpu.cpu_socket(s)'] = '16'
+        self.assertTrue(self.f.has_changed())
+        self.assertEquals(0, self.f._read_cache.call_count)
+
     @patch('subscription_manager.facts.Facts._read_cache',
            return_value=None)
     @patch('subscription_manager.facts.Facts._load_custom_facts',
@@ -300,3 +320,86 @@ class TestFacts(fixture.SubManFixture):
         self.assertTrue("system.certificate_version" in self.f.get_facts())
         self.assertEquals(facts.CERT_VERSION,
                 self.f.get_facts()['system.certificate_version'])
+
+    def _facts(self):
+        f = facts.Facts(ent_dir=StubEntitlementDirectory([]),
+                        prod_dir=StubProductDirectory([]))
+        f.CACHE_FILE = self.f.CACHE_FILE
+        f.collector_cache.CACHE_FILE = self.f.collector_cache.CACHE_FILE
+        return f
+
+    @patch('subscription_manager.facts.Facts._load_custom_facts',
+           return_value={})
+    @patch('subscription_manager.hwprobe.Hardware')
+    def test_collectors_cached(self, mock_hardware, mock_load_cf):
+        collected = {'get_cpu_info': [['boot'], {'cpu.cpu(s)': 8}]}
+        hardware = mock_hardware.return_value
+        hardware.get_all.return_value = {'cpu.cpu(s)': 8}
+        hardware.collected = collected
+        self.f.write_cache()
+        hardware.get_all.assert_called_once_with(None)
+
+        self._facts().get_facts()
+        hardware.get_all.assert_called_with(collected)
+
+        # An explicit refresh probes everything again:
+        self._facts().get_facts(True)
+        hardware.get_all.assert_called_with(None)
+
+    @patch('subscription_manager.facts.Facts._load_custom_facts',
+           return_value={})
+    @patch('subscription_manager.hwprobe.Hardware')
+    def test_forced_update_skips_collector_cache(self, mock_hardware, mock_load_cf):
+        collected = {'get_cpu_info': [['boot'], {'cpu.cpu(s)': 8}]}
+        hardware = mock_hardware.return_value
+        hardware.get_all.return_value = {'cpu.cpu(s)': 8}
+        hardware.collected = collected
+        self.f.write_cache()
+
+        uep = Mock()
+        self.assertEquals(0, self._facts().update_check(uep, 'abc'))
+        hardware.get_all.assert_called_with(collected)
+        self.assertEquals(1, self._facts().update_check(uep, 'abc', force=True))
+        hardware.get_all.assert_called_with(None)
+        uep.updateConsumer.assert_called_once_with('abc', facts={
+            'cpu.cpu(s)': 8, 'system.certificate_version': facts.CERT_VERSION})
+
+    @patch('subscription_manager.facts.Facts._load_custom_facts',
+           return_value={})
+    @patch('subscription_manager.hwprobe.Hardware')
+    def test_has_changed_writes_nothing(self, mock_hardware, mock_load_cf):
+        hardware = mock_hardware.return_value
+        hardware.get_all.return_value = {}
+        hardware.collected = {'get_cpu_info': [['boot'], {}]}
+        self.assertTrue(self.f.has_changed())
+        self.assertFalse(os.path.exists(self.f.collector_cache.CACHE_FILE))
+
+    @patch('subscription_manager.facts.Facts._load_hw_facts',
+           return_value={})
+    def test_custom_facts_cached(self, mock_load_hw):
+        facts_dir = self.fact_cache_dir + "/facts"
+        os.mkdir(facts_dir)
+        facts_file = facts_dir + "/test.facts"
+        fd = open(facts_file, "w")
+        fd.write('{"some.custom_fact": "foobar"}')
+        fd.close()
+
+        config_patch = patch('rhsm.config.DEFAULT_CONFIG_DIR', self.fact_cache_dir)
+        config_patch.start()
+        try:
+            self.assertTrue(self.f.has_changed())
+            self.assertEquals('foobar', self.f.facts['some.custom_fact'])
+            self.f.write_cache()
+
+            f = self._facts()
+            f._open_custom_facts = Mock()
+            self.assertEquals('foobar', f.get_facts()['some.custom_fact'])
+            self.assertEquals(0, f._open_custom_facts.call_count)
+
+            fd = open(facts_file, "w")
+            fd.write('{"some.custom_fact": "changed"}')
+            fd.close()
+            os.utime(facts_file, (0, 0))
+            self.assertEquals('changed', self._facts().get_facts()['some.custom_fact'])
+        finally:
+            config_patch.stop()
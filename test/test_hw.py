@@ -12,6 +12,9 @@
 # granted to use or replicate Red Hat trademarks that are incorporated
 # in this software or its documentation.
 
+import os
+import shutil
+import tempfile
 import unittest
 
 
@@ -740,3 +743,83 @@ class HardwareProbeTests(fixture.SubManFixture):
                                 'cpu.topology_source':
                                     'kernel /sys cpu sibling lists'},
                                hw.get_cpu_info())
+
+
+class HardwareCollectorCacheTests(fixture.SubManFixture):
+
+    COLLECTORS = ['get_uname_info', 'get_release_info', 'get_mem_info',
+                  'get_cpu_info', 'get_ls_cpu_info', 'get_network_info',
+                  'get_network_interfaces', 'get_virt_info',
+                  'get_platform_specific_info']
+
+    def setUp(self):
+        super(HardwareCollectorCacheTests, self).setUp()
+        self.calls = []
+        self.boot = [hwprobe.COLLECTOR_CACHE_VERSION, 'boot-id', '0-3']
+
+    def _collector(self, hw, name):
+        def collect():
+            self.calls.append(name)
+            hw.allhw['%s.fact' % name] = len(self.calls)
+        collect.__name__ = name
+        return collect
+
+    def _hardware(self):
+        hw = hwprobe.Hardware()
+        for name in self.COLLECTORS:
+            setattr(hw, name, self._collector(hw, name))
+        hw.get_boot_fingerprint = Mock(side_effect=lambda: self.boot)
+        return hw
+
+    def test_slow_collectors_fingerprinted(self):
+        hw = self._hardware()
+        hw.get_all()
+        self.assertEquals(self.COLLECTORS, self.calls)
+        self.assertEquals(['get_cpu_info', 'get_ls_cpu_info', 'get_platform_specific_info',
+                           'get_virt_info'], sorted(hw.collected))
+        self.assertEquals([self.boot, {'get_cpu_info.fact': 4}],
+                          hw.collected['get_cpu_info'])
+
+    def test_unchanged_collectors_reused(self):
+        first = self._hardware()
+        first_facts = first.get_all().copy()
+        self.calls = []
+
+        hw = self._hardware()
+        self.assertEquals(first_facts['get_cpu_info.fact'],
+                          hw.get_all(first.collected)['get_cpu_info.fact'])
+        self.assertEquals(['get_uname_info', 'get_release_info', 'get_mem_info',
+                           'get_network_info', 'get_network_interfaces'], self.calls)
+        self.assertEquals(first.collected, hw.collected)
+
+    def test_changed_collectors_run(self):
+        first = self._hardware()
+        first.get_all()
+        self.calls = []
+
+        self.boot = [hwprobe.COLLECTOR_CACHE_VERSION, 'boot-id', '0-7']
+        self._hardware().get_all(first.collected)
+        self.assertEquals(self.COLLECTORS, self.calls)
+
+    def test_unknown_boot_not_cached(self):
+        self.boot = None
+        hw = self._hardware()
+        hw.get_all()
+        self.assertEquals({}, hw.collected)
+
+    def test_boot_fingerprint(self):
+        prefix = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(prefix, 'proc/sys/kernel/random'))
+            f = open(os.path.join(prefix, 'proc/sys/kernel/random/boot_id'), 'w')
+            f.write('f2b1b2ae-5f4c-4bd4-9a42-0d0b5bd0f9c6\n')
+            f.close()
+            hw = hwprobe.Hardware(prefix=prefix, testing=True)
+            self.assertEquals([hwprobe.COLLECTOR_CACHE_VERSION,
+                               'f2b1b2ae-5f4c-4bd4-9a42-0d0b5bd0f9c6', None],
+                              hw.get_boot_fingerprint())
+
+            os.remove(os.path.join(prefix, 'proc/sys/kernel/random/boot_id'))
+            self.assertEquals(None, hw.get_boot_fingerprint())
+        finally:
+            shutil.rmtree(prefix)
@@ -1,5 +1,7 @@
-import unittest
+import os
 import tempfile
+import threading
+import unittest
 
 from subscription_manager import lock
 
@@ -20,3 +22,64 @@ class TestLock(unittest.TestCase):
         lf = lock.Lock("%s/lock.file" % self.tmp_dir)
         lf.acquire()
         lf.release()
+
+    def test_lock_shared_in_process(self):
+        path = "%s/lock.file" % self.tmp_dir
+        outer = lock.Lock(path)
+        outer.acquire()
+        inner = lock.Lock(path)
+        inner.acquire()
+        inner.release()
+        # Still held by outer:
+        self.assertTrue(os.path.exists(path))
+        outer.release()
+        self.assertFalse(os.path.exists(path))
+
+    def test_lock_from_threads(self):
+        path = "%s/lock.file" % self.tmp_dir
+        outer = lock.Lock(path)
+        outer.acquire()
+        errors = []
+
+        def acquire_release():
+            try:
+                for i in range(20):
+                    lf = lock.Lock(path)
+                    lf.acquire()
+                    lf.release()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=acquire_release) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], errors)
+        self.assertTrue(os.path.exists(path))
+        outer.release()
+        self.assertFalse(os.path.exists(path))
+
+    def test_wait_does_not_block_other_locks(self):
+        path = "%s/lock.file" % self.tmp_dir
+        # Held by another live process:
+        f = open(path, 'w')
+        f.write(str(os.getppid()))
+        f.close()
+        waiting = lock.Lock(path)
+        waiter = threading.Thread(target=waiting.acquire)
+        waiter.setDaemon(True)
+        waiter.start()
+
+        other = lock.Lock("%s/other.file" % self.tmp_dir)
+        taker = threading.Thread(target=lambda: (other.acquire(), other.release()))
+        taker.setDaemon(True)
+        taker.start()
+        taker.join(5)
+        self.assertFalse(taker.isAlive())
+        self.assertFalse(waiting.acquired())
+
+        os.unlink(path)
+        waiter.join(5)
+        self.assertTrue(waiting.acquired())
+        waiting.release()
+        self.assertFalse(os.path.exists(path))
@@ -15,10 +15,16 @@
 import mock
 import httplib
 import socket
+import threading
+import time
 from M2Crypto.SSL import SSLError
+from rhsm.https import ssl
+
+import rhsm.connection as connection
 
 import stubs
 import fixture
+from test_requestcache import ConditionalServer
 
 from subscription_manager import injection as inj
 from subscription_manager import release
@@ -179,6 +185,149 @@ class TestCdnReleaseVerionProvider(fixture.SubManFixture):
             releases = cdn_rv_provider.get_releases()
             self.assertEquals([], releases)
 
+            mock_cc.get_versions.side_effect = \
+                    ssl.SSLError()
+            releases = cdn_rv_provider.get_releases()
+            self.assertEquals([], releases)
+
+
+class PlainContentConnection(connection.ContentConnection):
+    """ A ContentConnection over plain http, to a stub server. """
+
+    def _request(self, request_type, handler, body=None, headers=None):
+        conn = httplib.HTTPConnection(self.host, self.ssl_port, timeout=5)
+        conn.request(request_type, handler, body=body, headers=headers or {})
+        response = conn.getresponse()
+        result = {"content": response.read().decode('utf-8'),
+                  "status": response.status,
+                  "headers": dict(response.getheaders())}
+        conn.close()
+        return result
+
+
+class HeaderlessContentConnection(PlainContentConnection):
+    """ The _request of a python-rhsm taking no extra headers. """
+
+    def _request(self, request_type, handler, body=None):
+        return PlainContentConnection._request(self, request_type, handler,
+                body)
+
+
+class TestCdnReleaseListingCache(fixture.SubManFixture):
+
+    def setUp(self):
+        fixture.SubManFixture.setUp(self)
+        stub_content = stubs.StubContent("c1", required_tags='rhel-6',
+                gpg=None, enabled="1", url="/content/rhel/6/$releasever/os")
+        inj.provide(inj.ENT_DIR, stubs.StubEntitlementDirectory(
+                [stubs.StubEntitlementCertificate(stubs.StubProduct("rhel-6"),
+                        content=[stub_content])]))
+        inj.provide(inj.PROD_DIR, stubs.StubProductDirectory(
+            [stubs.StubProductCertificate(stubs.StubProduct("rhel-6",
+                    provided_tags="rhel-6"))]))
+
+        self.server = ConditionalServer()
+        self.server.start()
+        # The handler get_versions makes of the listing path:
+        self.listing = '///content/rhel/6//listing'
+        self.server.documents[self.listing] = (versions, '"1"', None)
+        # Asking the CDN every time, unless testing the TTL:
+        self.ttl_patch = mock.patch('subscription_manager.release._get_release_listing_ttl',
+                mock.Mock(return_value=0))
+        self.ttl = self.ttl_patch.start()
+
+    def tearDown(self):
+        self.ttl_patch.stop()
+        self.server.stop()
+
+    def _get_cdn_rv_provider(self):
+        provider = release.CdnReleaseVersionProvider()
+        provider.content_connection = PlainContentConnection(host='127.0.0.1',
+                ssl_port=self.server.server_port)
+        return provider
+
+    def test_listing_not_modified(self):
+        releases = self._get_cdn_rv_provider().get_releases()
+        self.assertEquals(['6.0', '6.1', '6.2', '6Super', '7'], releases)
+        self.assertEquals(releases, self._get_cdn_rv_provider().get_releases())
+        self.assertEquals(len(versions), self.server.bytes_sent)
+        self.assertEquals(1, self.server.not_modified)
+
+    def test_no_conditional_get_without_headers(self):
+        for i in range(2):
+            provider = self._get_cdn_rv_provider()
+            provider.content_connection = HeaderlessContentConnection(
+                    host='127.0.0.1', ssl_port=self.server.server_port)
+            self.assertEquals(['6.0', '6.1', '6.2', '6Super', '7'],
+                    provider.get_releases())
+        self.assertEquals(2 * len(versions), self.server.bytes_sent)
+        self.assertEquals(0, self.server.not_modified)
+
+    def test_listing_modified(self):
+        self._get_cdn_rv_provider().get_releases()
+        self.server.documents[self.listing] = ("6.0\n6.5\n", '"2"', None)
+        self.assertEquals(['6.0', '6.5'],
+                self._get_cdn_rv_provider().get_releases())
+        self.assertEquals(0, self.server.not_modified)
+
+    def test_fresh_listing_not_fetched(self):
+        self.ttl.return_value = 600
+        releases = self._get_cdn_rv_provider().get_releases()
+        self.server.documents[self.listing] = ("6.0\n6.5\n", '"2"', None)
+        self.assertEquals(releases, self._get_cdn_rv_provider().get_releases())
+        self.assertEquals(len(versions), self.server.bytes_sent)
+        self.assertEquals(0, self.server.not_modified)
+
+    def test_stale_listing_revalidated(self):
+        self.ttl.return_value = 600
+        self._get_cdn_rv_provider().get_releases()
+        listing_cache = inj.require(inj.RELEASE_LISTING_CACHE)
+        for listing in listing_cache.listings.values():
+            listing['fetched'] -= 600
+        self._get_cdn_rv_provider().get_releases()
+        self.assertEquals(1, self.server.not_modified)
+        # Fresh again:
+        self._get_cdn_rv_provider().get_releases()
+        self.assertEquals(1, self.server.not_modified)
+
+
+class TestCdnReleaseListingFetches(TestCdnReleaseVerionProvider):
+
+    def setUp(self):
+        TestCdnReleaseVerionProvider.setUp(self)
+        contents = [stubs.StubContent("c%d" % i, required_tags='rhel-6',
+                gpg=None, enabled="1", url="/content/%d/$releasever/os" % i)
+                for i in range(10)]
+        self.ent_dir = stubs.StubEntitlementDirectory(
+                [stubs.StubEntitlementCertificate(stubs.StubProduct("rhel-6"),
+                        content=contents)])
+        self.lock = threading.Lock()
+        self.fetching = 0
+        self.most_fetching = 0
+
+    def _get_release_versions(self, listing_path):
+        self.lock.acquire()
+        self.fetching += 1
+        self.most_fetching = max(self.most_fetching, self.fetching)
+        self.lock.release()
+        time.sleep(0.01)
+        self.lock.acquire()
+        self.fetching -= 1
+        self.lock.release()
+        # Release 6.<n> in each listing:
+        return "6.%s\n" % listing_path.split('/')[2]
+
+    def test_concurrent_fetches(self):
+        releases = self._get_cdn_rv_provider().get_releases()
+        self.assertEquals(["6.%d" % i for i in range(10)], releases)
+        self.assertEquals(release.MAX_LISTING_FETCHES, self.most_fetching)
+
+    def test_error_raised(self):
+        provider = self._get_cdn_rv_provider()
+        provider.content_connection = mock.Mock()
+        provider.content_connection.get_versions.side_effect = ValueError()
+        self.assertRaises(ValueError, provider.get_releases)
+
 
 class TestReleaseIsCorrectRhel(fixture.SubManFixture):
 
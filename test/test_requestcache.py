@@ -0,0 +1,414 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import BaseHTTPServer
+import httplib
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+
+import rhsm.connection as connection
+
+from subscription_manager.base_action_client import BaseActionClient
+from subscription_manager.cache import EntitlementStatusCache, \
+        ProductStatusCache, cache_writer
+from subscription_manager.connpool import ConnectionPool, PooledRestlib
+from subscription_manager.requestcache import MemoizingRestlib, \
+        ResponseCache, conditional_get, supports_conditional
+import subscription_manager.injection as inj
+
+from fixture import SubManFixture
+
+
+def stub_restlib(cert_file='/etc/pki/consumer/cert.pem', username=None):
+    restlib = Mock()
+    restlib.host = 'candlepin.example.com'
+    restlib.ssl_port = 443
+    restlib.apihandler = '/candlepin'
+    restlib.cert_file = cert_file
+    restlib.username = username
+    restlib.request_get.side_effect = lambda method, headers=None: \
+            {'method': method, 'calls': restlib.request_get.call_count}
+    return restlib
+
+
+class TestMemoizingRestlib(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.restlib = stub_restlib()
+        self.conn = MemoizingRestlib(self.restlib, self.cache)
+        self.cache.start()
+
+    def test_inactive(self):
+        self.cache.stop()
+        self.conn.request_get('/consumers/abc')
+        self.conn.request_get('/consumers/abc')
+        self.assertEquals(2, self.restlib.request_get.call_count)
+
+    def test_get_memoized(self):
+        first = self.conn.request_get('/consumers/abc')
+        self.assertEquals(first, self.conn.request_get('/consumers/abc'))
+        self.conn.request_get('/consumers/abc/compliance')
+        self.assertEquals(2, self.restlib.request_get.call_count)
+        self.assertEquals((1, 2), (self.cache.hits, self.cache.misses))
+
+    def test_certificates_not_memoized(self):
+        for _ in range(2):
+            self.conn.request_get('/consumers/abc/certificates?serials=1,2')
+            self.conn.request_get('/consumers/abc/certificates/serials')
+        self.assertEquals(3, self.restlib.request_get.call_count)
+        self.assertEquals((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_query_string_memoized(self):
+        self.conn.request_get('/consumers/abc/compliance?on_date=2014-10-20')
+        self.conn.request_get('/consumers/abc/compliance?on_date=2014-10-20')
+        self.conn.request_get('/consumers/abc/compliance')
+        self.assertEquals(2, self.restlib.request_get.call_count)
+
+    def test_copies_returned(self):
+        self.conn.request_get('/consumers/abc')['method'] = 'changed'
+        self.assertEquals('/consumers/abc',
+                self.conn.request_get('/consumers/abc')['method'])
+
+    def test_modifications_invalidate(self):
+        for request in [self.conn.request_post, self.conn.request_put,
+                        self.conn.request_delete]:
+            self.conn.request_get('/consumers/abc')
+            request('/consumers/abc/entitlements')
+        self.assertEquals(3, self.restlib.request_get.call_count)
+        self.restlib.request_put.assert_called_once_with(
+                '/consumers/abc/entitlements')
+
+    def test_failed_modification_invalidates(self):
+        self.conn.request_get('/consumers/abc')
+        self.restlib.request_post.side_effect = IOError()
+        self.assertRaises(IOError, self.conn.request_post, '/consumers/abc/entitlements')
+        self.conn.request_get('/consumers/abc')
+        self.assertEquals(2, self.restlib.request_get.call_count)
+
+    def test_keyed_on_credentials(self):
+        basic_auth = MemoizingRestlib(stub_restlib(cert_file=None,
+                username='admin'), self.cache)
+        self.conn.request_get('/consumers/abc')
+        basic_auth.request_get('/consumers/abc')
+        self.assertEquals(2, self.cache.misses)
+
+    def test_keyed_on_headers(self):
+        self.conn.request_get('/consumers/abc')
+        self.conn.request_get('/consumers/abc', headers={'If-None-Match': '"1"'})
+        self.assertEquals(2, self.restlib.request_get.call_count)
+
+    def test_get_across_modification_not_kept(self):
+        def modify(method, headers=None):
+            # Another thread binds while the GET is answered:
+            self.conn.request_post('/consumers/abc/entitlements')
+            return {}
+        self.restlib.request_get.side_effect = modify
+        self.conn.request_get('/consumers/abc')
+        self.conn.request_get('/consumers/abc')
+        self.assertEquals(2, self.restlib.request_get.call_count)
+
+    def test_dropped_when_stopped(self):
+        self.cache.start()
+        self.conn.request_get('/consumers/abc')
+        self.cache.stop()
+        self.conn.request_get('/consumers/abc')
+        self.cache.stop()
+        self.cache.start()
+        self.conn.request_get('/consumers/abc')
+        self.assertEquals(2, self.restlib.request_get.call_count)
+
+    def test_passes_attributes(self):
+        self.assertEquals('/candlepin', self.conn.apihandler)
+
+
+class TestActionRunCache(SubManFixture):
+
+    def test_active_during_updates(self):
+        cp_provider = inj.require(inj.CP_PROVIDER)
+        active = []
+
+        class Lib(object):
+            def update(self):
+                active.append(cp_provider.response_cache.active())
+
+        client = BaseActionClient()
+        client._libset = [Lib()]
+        debug_patch = patch('subscription_manager.requestcache.log')
+        log = debug_patch.start()
+        try:
+            client.update()
+        finally:
+            debug_patch.stop()
+        self.assertEquals([True], active)
+        self.assertFalse(cp_provider.response_cache.active())
+        log.debug.assert_called_once_with("Response cache: 0 hits, 0 misses, "
+                "0 not modified (0 bytes saved)")
+
+
+class ConditionalHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body, etag, last_modified = self.server.documents[self.path]
+        if (etag and self.headers.get('If-None-Match') == etag) or \
+                (last_modified and
+                 self.headers.get('If-Modified-Since') == last_modified):
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            self.server.not_modified += 1
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        if last_modified:
+            self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.bytes_sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConditionalServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves documents, path: (body, etag, last_modified), honoring the
+    validators of conditional requests.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                ConditionalHandler)
+        self.documents = {}
+        self.bytes_sent = 0
+        self.not_modified = 0
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class HeaderlessBaseRestLib(connection.BaseRestLib):
+    """ The _request of a python-rhsm taking no extra headers. """
+
+    def _request(self, request_type, method, info=None):
+        raise AssertionError("not expected to be called")
+
+
+class HeaderlessRestlib(connection.Restlib, HeaderlessBaseRestLib):
+    pass
+
+
+class ConditionalServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ConditionalServer()
+        self.server.start()
+        # Plain http, the stub server has no certificate:
+        self.connection_patch = patch.object(PooledRestlib, '_new_connection',
+                lambda restlib: httplib.HTTPConnection(restlib.host,
+                        restlib.ssl_port, timeout=5))
+        self.connection_patch.start()
+        self.pool = ConnectionPool()
+        self.response_cache = ResponseCache()
+        self.uep = Mock()
+        self.uep.sanitize = lambda value: value
+        self.uep.conn = MemoizingRestlib(PooledRestlib(self.pool, '127.0.0.1',
+                self.server.server_port, '/candlepin'), self.response_cache)
+
+    def tearDown(self):
+        self.connection_patch.stop()
+        self.pool.close()
+        self.server.stop()
+
+    def _serve(self, path, body, etag=None, last_modified=None):
+        self.server.documents['/candlepin' + path] = (body, etag, last_modified)
+
+
+class TestConditionalGet(ConditionalServerTestCase):
+
+    def test_etag(self):
+        self._serve('/consumers/abc/compliance', '{"status": "valid"}', '"1"')
+        modified, response, validators = conditional_get(self.uep,
+                '/consumers/abc/compliance')
+        self.assertTrue(modified)
+        self.assertEquals({'status': 'valid'}, response)
+        self.assertEquals({'etag': '"1"', 'length': 19}, validators)
+
+        self.assertEquals((False, None, validators), conditional_get(self.uep,
+                '/consumers/abc/compliance', validators))
+        self.assertEquals(1, self.server.not_modified)
+
+        self._serve('/consumers/abc/compliance', '{"status": "invalid"}', '"2"')
+        modified, response, validators = conditional_get(self.uep,
+                '/consumers/abc/compliance', validators)
+        self.assertEquals({'status': 'invalid'}, response)
+        self.assertEquals('"2"', validators['etag'])
+
+    def test_last_modified(self):
+        date = 'Mon, 20 Oct 2014 10:00:00 GMT'
+        self._serve('/consumers/abc', '{}', last_modified=date)
+        validators = conditional_get(self.uep, '/consumers/abc')[2]
+        self.assertEquals(date, validators['last_modified'])
+        self.assertFalse(conditional_get(self.uep, '/consumers/abc',
+                validators)[0])
+
+    def test_no_validators(self):
+        self._serve('/consumers/abc', '{}')
+        self.assertEquals((True, {}, None),
+                conditional_get(self.uep, '/consumers/abc'))
+
+    def test_counts_bytes_saved(self):
+        self._serve('/consumers/abc', '{"uuid": "abc"}', '"1"')
+        self.response_cache.start()
+        validators = conditional_get(self.uep, '/consumers/abc')[2]
+        # Remembered for the plain GETs of the run:
+        self.assertEquals({'uuid': 'abc'},
+                self.uep.conn.request_get('/consumers/abc'))
+        self.assertEquals(15, self.server.bytes_sent)
+        # Only the plain GET counts:
+        self.assertEquals((1, 1), (self.response_cache.hits,
+                self.response_cache.misses))
+        self.response_cache.stop()
+
+        self.response_cache.start()
+        conditional_get(self.uep, '/consumers/abc', validators)
+        self.assertEquals((1, 15), (self.response_cache.not_modified,
+                self.response_cache.bytes_saved))
+        self.response_cache.stop()
+
+    def test_supports_conditional(self):
+        self.assertTrue(supports_conditional(self.uep))
+        self.uep.conn = MemoizingRestlib(HeaderlessRestlib('127.0.0.1',
+                self.server.server_port, '/candlepin'), self.response_cache)
+        self.assertFalse(supports_conditional(self.uep))
+        self.uep.conn = Mock()
+        self.assertFalse(supports_conditional(self.uep))
+
+    def test_not_modified_raised(self):
+        self._serve('/consumers/abc', '{}', '"1"')
+        validators = conditional_get(self.uep, '/consumers/abc')[2]
+
+        def validate_response(restlib, result, request_type, handler):
+            # As a python-rhsm only expecting 2xx does:
+            if str(result['status'])[0] != '2':
+                raise connection.RestlibException(result['status'])
+        validate_patch = patch.object(PooledRestlib, 'validateResponse',
+                validate_response)
+        validate_patch.start()
+        try:
+            self.assertEquals((False, None, validators),
+                    conditional_get(self.uep, '/consumers/abc', validators))
+        finally:
+            validate_patch.stop()
+
+
+class TestConditionalStatusCache(ConditionalServerTestCase):
+
+    def setUp(self):
+        ConditionalServerTestCase.setUp(self)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        cache_writer.flush()
+        shutil.rmtree(self.cache_dir)
+        ConditionalServerTestCase.tearDown(self)
+
+    def _status_cache(self, cache_class=EntitlementStatusCache):
+        status_cache = cache_class()
+        status_cache.CACHE_FILE = os.path.join(self.cache_dir, 'status.json')
+        return status_cache
+
+    def _load(self, status_cache):
+        status = status_cache.load_status(self.uep, 'abc')
+        cache_writer.flush()
+        return status
+
+    def test_not_modified_uses_cache(self):
+        body = '{"status": "valid", "reasons": []}'
+        self._serve('/consumers/abc/compliance', body, '"1"')
+        self.assertEquals({'status': 'valid', 'reasons': []},
+                self._load(self._status_cache()))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir,
+                'status.json.validators')))
+
+        # A later run, with nothing but the cache on disk:
+        status_cache = self._status_cache()
+        self.assertEquals({'status': 'valid', 'reasons': []},
+                self._load(status_cache))
+        self.assertEquals(len(body), self.server.bytes_sent)
+        self.assertEquals(1, self.server.not_modified)
+
+    def test_modified(self):
+        self._serve('/consumers/abc/compliance', '{"status": "valid"}', '"1"')
+        self._load(self._status_cache())
+        self._serve('/consumers/abc/compliance', '{"status": "invalid"}', '"2"')
+        status_cache = self._status_cache()
+        self.assertEquals({'status': 'invalid'}, self._load(status_cache))
+        self.assertEquals('"2"', status_cache.validators['etag'])
+        self.assertEquals(0, self.server.not_modified)
+
+    def test_validators_of_other_status_ignored(self):
+        self._serve('/consumers/abc/compliance', '{"status": "valid"}', '"1"')
+        self._load(self._status_cache())
+        # The cache replaced without its validators:
+        status_cache = self._status_cache()
+        status_cache.server_status = {'status': 'partial'}
+        status_cache.validators = None
+        EntitlementStatusCache._write_state(status_cache, {'status': 'partial'})
+        self.assertFalse(os.path.exists(status_cache.CACHE_FILE + '.validators'))
+
+        status_cache = self._status_cache()
+        self.assertEquals({'status': 'valid'}, self._load(status_cache))
+        self.assertEquals(0, self.server.not_modified)
+
+    def test_product_status(self):
+        self._serve('/consumers/abc', '{"uuid": "abc", "installedProducts": '
+                '[{"productId": "69"}]}', '"1"')
+        self._load(self._status_cache(ProductStatusCache))
+        status_cache = self._status_cache(ProductStatusCache)
+        self.assertEquals([{'productId': '69'}], self._load(status_cache))
+        self.assertEquals(1, self.server.not_modified)
+
+    def test_delete_removes_validators(self):
+        self._serve('/consumers/abc/compliance', '{"status": "valid"}', '"1"')
+        status_cache = self._status_cache()
+        self._load(status_cache)
+        # delete_cache is a classmethod of CacheManager:
+        cache_patch = patch.object(EntitlementStatusCache, 'CACHE_FILE',
+                status_cache.CACHE_FILE)
+        cache_patch.start()
+        try:
+            status_cache.delete_cache()
+        finally:
+            cache_patch.stop()
+        self.assertEquals([], os.listdir(self.cache_dir))
+        self.assertEquals(None, status_cache.validators)
@@ -0,0 +1,300 @@
+#
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Red Hat trademarks are not licensed under GPLv2. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated
+# in this software or its documentation.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+
+from stubs import StubProduct, StubProductCertificate, StubCertificateDirectory
+from fixture import SubManFixture
+
+from rhsm.profile import Package
+from subscription_manager import statestore
+from subscription_manager.statestore import StateStore
+from subscription_manager.cache import InstalledProductsManager, ProfileManager
+import subscription_manager.injection as inj
+
+from test_cache import TestProfileManager
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.store = StateStore(os.path.join(self.state_dir, 'state.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.state_dir)
+
+    def _path(self, name):
+        return os.path.join(self.state_dir, name)
+
+    def test_put_get(self):
+        self.store.put(self._path('a.json'), '\0binary', 1400000000.5)
+        self.assertEquals(('\0binary', 1400000000.5),
+                self.store.get(self._path('a.json')))
+        self.assertEquals(None, self.store.get(self._path('b.json')))
+
+    def test_persisted(self):
+        self.store.put(self._path('a.json'), '{}')
+        self.store.close()
+        self.assertEquals('{}', StateStore(self.store.path).get(self._path('a.json'))[0])
+
+    def test_delete(self):
+        self.store.put(self._path('a.json'), '{}')
+        self.store.delete(self._path('a.json'))
+        self.assertEquals(None, self.store.get(self._path('a.json')))
+
+    def test_transaction_commits_together(self):
+        self.store.begin()
+        self.store.put(self._path('a.json'), 'a')
+        self.store.put(self._path('b.json'), 'b')
+        # Seen by this thread, not committed yet:
+        self.assertEquals('a', self.store.get(self._path('a.json'))[0])
+        self.assertEquals(None, StateStore(self.store.path).get(self._path('a.json')))
+        self.store.commit()
+        other = StateStore(self.store.path)
+        self.assertEquals('a', other.get(self._path('a.json'))[0])
+        self.assertEquals('b', other.get(self._path('b.json'))[0])
+
+    def test_rollback(self):
+        self.store.put(self._path('a.json'), 'a')
+        self.store.begin()
+        self.store.delete(self._path('a.json'))
+        self.store.put(self._path('b.json'), 'b')
+        self.store.rollback()
+        self.assertEquals('a', self.store.get(self._path('a.json'))[0])
+        self.assertEquals(None, self.store.get(self._path('b.json')))
+
+    def test_nested_rollback_aborts_outer(self):
+        self.store.begin()
+        self.store.put(self._path('a.json'), 'a')
+        self.store.begin()
+        self.store.put(self._path('b.json'), 'b')
+        self.store.rollback()
+        self.store.commit()
+        self.assertEquals(None, self.store.get(self._path('a.json')))
+        self.assertEquals(None, self.store.get(self._path('b.json')))
+
+    def test_transaction_per_thread(self):
+        self.store.begin()
+        self.store.put(self._path('a.json'), 'a')
+        seen = []
+        thread = threading.Thread(target=lambda:
+                seen.append(self.store.get(self._path('a.json'))))
+        thread.start()
+        thread.join()
+        self.store.commit()
+        self.assertEquals([None], seen)
+
+    def test_migrates_files(self):
+        path = self._path('a.json')
+        f = open(path, 'w')
+        f.write('{"a": 1}')
+        f.close()
+        os.utime(path, (1400000000, 1400000000))
+
+        self.assertEquals(('{"a": 1}', 1400000000), self.store.get(path))
+        self.assertFalse(os.path.exists(path))
+        self.assertEquals('{"a": 1}', self.store.get(path)[0])
+
+    def test_export(self):
+        path = self._path('a.json')
+        self.store.put(path, '{"a": 1}', 1400000000)
+        self.store.put(self._path('sub/b.json'), 'b')
+        self.store.export()
+        self.assertFalse(os.path.exists(self.store.path))
+        self.assertEquals('{"a": 1}', open(path).read())
+        self.assertEquals(1400000000, os.stat(path).st_mtime)
+        self.assertEquals('b', open(self._path('sub/b.json')).read())
+
+    def test_export_keeps_newer_files(self):
+        path = self._path('a.json')
+        self.store.put(path, 'old', 1400000000)
+        f = open(path, 'w')
+        f.write('new')
+        f.close()
+        self.store.export()
+        self.assertEquals('new', open(path).read())
+
+    def test_delete_removes_file(self):
+        path = self._path('a.json')
+        open(path, 'w').close()
+        self.store.delete(path)
+        self.assertFalse(os.path.exists(path))
+        self.assertEquals(None, self.store.get(path))
+
+
+class TestStateFunctions(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.state_dir, 'cache', 'a.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_disabled_by_default(self):
+        self.assertEquals(None, statestore.get_state_store())
+
+    def test_files_without_store(self):
+        statestore.write_state(self.path, lambda f: f.write('{}'))
+        self.assertTrue(os.path.exists(self.path))
+        self.assertTrue(statestore.state_exists(self.path))
+        self.assertEquals('{}', statestore.open_state(self.path).read())
+        statestore.remove_state(self.path)
+        self.assertFalse(statestore.state_exists(self.path))
+        self.assertRaises(IOError, statestore.open_state, self.path)
+        self.assertRaises(OSError, statestore.state_mtime, self.path)
+
+    def test_exported_when_disabled(self):
+        db_path = os.path.join(self.state_dir, 'state.db')
+        store = StateStore(db_path)
+        store.put(self.path, '{}')
+        store.close()
+        db_patch = patch('subscription_manager.statestore.STATE_DB', db_path)
+        exported_patch = patch('subscription_manager.statestore._exported', False)
+        db_patch.start()
+        exported_patch.start()
+        try:
+            self.assertEquals(None, statestore.get_state_store())
+            self.assertEquals('{}', statestore.open_state(self.path).read())
+            self.assertFalse(os.path.exists(db_path))
+        finally:
+            exported_patch.stop()
+            db_patch.stop()
+
+    def test_rename_state(self):
+        new_path = os.path.join(self.state_dir, 'cache', 'a.bin')
+        statestore.write_state(self.path, lambda f: f.write('{}'))
+        os.utime(self.path, (1400000000, 1400000000))
+        statestore.rename_state(self.path, new_path)
+        self.assertFalse(statestore.state_exists(self.path))
+        self.assertEquals('{}', statestore.open_state(new_path).read())
+        self.assertEquals(1400000000, statestore.state_mtime(new_path))
+        # Nothing to move, what was there is removed:
+        statestore.rename_state(self.path, new_path)
+        self.assertFalse(statestore.state_exists(new_path))
+
+    def test_rename_state_in_store(self):
+        store = StateStore(os.path.join(self.state_dir, 'state.db'))
+        store_patch = patch('subscription_manager.statestore.get_state_store',
+                Mock(return_value=store))
+        store_patch.start()
+        try:
+            new_path = os.path.join(self.state_dir, 'cache', 'a.bin')
+            store.put(self.path, '{}', 1400000000)
+            statestore.rename_state(self.path, new_path)
+            self.assertEquals(None, store.get(self.path))
+            self.assertEquals(('{}', 1400000000), store.get(new_path))
+        finally:
+            store_patch.stop()
+            store.close()
+
+    def test_in_transaction_rolls_back(self):
+        store = StateStore(os.path.join(self.state_dir, 'state.db'))
+        store_patch = patch('subscription_manager.statestore.get_state_store',
+                Mock(return_value=store))
+        store_patch.start()
+        try:
+            def write_and_fail():
+                statestore.write_state(self.path, lambda f: f.write('{}'))
+                raise ValueError()
+            self.assertRaises(ValueError, statestore.in_transaction, write_and_fail)
+            self.assertFalse(statestore.state_exists(self.path))
+        finally:
+            store_patch.stop()
+            store.close()
+
+
+class TestCachesInStateStore(SubManFixture):
+
+    def setUp(self):
+        super(TestCachesInStateStore, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.store = StateStore(os.path.join(self.cache_dir, 'state.db'))
+        self.store_patch = patch('subscription_manager.statestore.get_state_store',
+                Mock(return_value=self.store))
+        self.store_patch.start()
+
+        inj.provide(inj.PROD_DIR, StubCertificateDirectory([
+            StubProductCertificate(StubProduct('a-product', name="Product A"))]))
+        self.mgr = InstalledProductsManager()
+        self.mgr.CACHE_FILE = os.path.join(self.cache_dir, 'installed_products.json')
+
+    def tearDown(self):
+        self.store_patch.stop()
+        self.store.close()
+        shutil.rmtree(self.cache_dir)
+        super(TestCachesInStateStore, self).tearDown()
+
+    def test_no_files_written(self):
+        self.assertTrue(self.mgr.write_cache())
+        self.assertEquals(['state.db'], os.listdir(self.cache_dir))
+        self.assertNotEquals(None, self.store.get(self.mgr.CACHE_FILE + '.digest'))
+        self.assertEquals(self.mgr.installed, self.mgr._read_cache())
+        self.assertFalse(self.mgr.has_changed())
+
+    def test_delete_cache(self):
+        self.mgr.write_cache()
+        cache_patch = patch.object(InstalledProductsManager, 'CACHE_FILE',
+                self.mgr.CACHE_FILE)
+        cache_patch.start()
+        try:
+            self.mgr.delete_cache()
+        finally:
+            cache_patch.stop()
+        self.assertFalse(self.mgr._cache_exists())
+        self.assertEquals(None, self.store.get(self.mgr.CACHE_FILE + '.digest'))
+
+    def test_migrates_cache_file(self):
+        # Written as a file, before the store was enabled:
+        self.store_patch.stop()
+        self.mgr.write_cache()
+        self.store_patch.start()
+
+        self.assertFalse(self.mgr.has_changed())
+        self.assertEquals(['state.db'], os.listdir(self.cache_dir))
+
+    def _profile_mgr(self):
+        pkgs = [Package(name="package1", version="1.0.0", release=1, arch="x86_64")]
+        profile_mgr = ProfileManager()
+        profile_mgr.CACHE_FILE = os.path.join(self.cache_dir, 'packages.json')
+        profile_mgr._get_profile = Mock(
+                return_value=TestProfileManager._mock_pkg_profile(pkgs))
+        return profile_mgr
+
+    def test_profile_written_together(self):
+        fingerprint_patch = patch('subscription_manager.cache.rpmdb_fingerprint',
+                Mock(return_value=[['Packages', 1, 2048, 1400000000.5]]))
+        fingerprint_patch.start()
+        try:
+            profile_mgr = self._profile_mgr()
+            profile_mgr.current_profile
+            # Fails between the profile and its fingerprint:
+            profile_mgr._digest = Mock(side_effect=ValueError())
+            self.assertFalse(profile_mgr.write_cache())
+            self.assertFalse(profile_mgr._cache_exists())
+
+            del profile_mgr._digest
+            self.assertTrue(profile_mgr.write_cache())
+            self.assertTrue(self._profile_mgr()._rpmdb_unchanged())
+        finally:
+            fingerprint_patch.stop()